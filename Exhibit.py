@@ -30,7 +30,9 @@ import sys
 sys.path.append(sys.path[0] + "/includes")
 import album_data
 import Export
+import LibraryDiff
 import ProcessData
+import SqlInstrument
 import ExhibitOptions
 
 
@@ -50,7 +52,15 @@ class Exhibit(object):
     self.__WARNING_INFO = "WARNING:[Exhibit."
     self.__TESTED_ALBUM_DATA_VERSION = "1.1"  
     self.__options = ExhibitOptions.ExhibitOptions(sys.argv).options
+    self.__sql_connector = None
+    self.__library_diff = None
+    self.__processor = None
 
+    if self.__options['export_only']:
+      if not self.__options['quiet']:
+        print "Checking configuration options, and loading AlbumData..."
+      self.__LoadAlbumData()
+      return
     if not self.__options['quiet']:
       print ("Checking configuration options, loading AlbumData, and connecting"
              " to SQL server...")
@@ -68,34 +78,58 @@ class Exhibit(object):
     self.__sql_connector = (
         self.__ClassLoader(self.__options['sql_type'])(
             connection=sql_connection))
+    self.__sql_connector.SetCommitInterval(
+        rows=self.__options['commit_rows'],
+        seconds=self.__options['commit_seconds'])
+    if self.__options['sql_stats']:
+      self.__sql_connector = SqlInstrument.SqlInstrument(
+          connector=self.__sql_connector,
+          slow_seconds=self.__options['slow_statement'] / 1000.0)
     if __debug__:
-      print ("%(debug)s__init__] Loaded and connected to SQL server!\n"
-             "%(debug)s__init__] Loading AlbumData..." % 
-             {'debug':self.__DEBUG_INFO})
-    self.__album_data = album_data.AlbumData(
-        iphoto_library=self.__options['library'])
-    if self.__album_data.__version__ != self.__TESTED_ALBUM_DATA_VERSION:
-      print ("%(warn)s AlbumData version not tested!\n"
-             "%(warn)s Possible data lost may occur!" % {
-             'warn':self.__WARNING_INFO,
-             'warn':self.__WARNING_INFO})
-    if __debug__:
-      print "%s__init__] Albumdata loaded!" % self.__DEBUG_INFO
+      print ("%s__init__] Loaded and connected to SQL server!" %
+             self.__DEBUG_INFO)
+    self.__LoadAlbumData()
+    # the snapshot must be taken before ProcessData prepares the album data
+    if self.__options['snapshot']:
+      self.__library_diff = LibraryDiff.LibraryDiff(
+          album_data=self.__album_data,
+          snapshot_file=self.__options['snapshot'],
+          target="%(sql_address)s/%(sql_database)s/%(sql_prepend)s" %
+                 self.__options)
     if self.__options['force']:
-      print ("%s__init__] Forcing SQL database to be rebuilt." % 
-             self.__WARNING_INFO)
-      self.__sql_connector.DatabaseCheck(force=True)
-      print "%s__init__] SQL database rebuilt." % self.__WARNING_INFO
+      print ("%s__init__] Forcing SQL database to be rebuilt, into staging "
+             "tables." % self.__WARNING_INFO)
+      self.__sql_connector.BeginRebuild()
     if __debug__:
       print "%s__init__] Loading data processor..." % self.__DEBUG_INFO
-    self.__processor = ProcessData.ProcessData(album_data=self.__album_data, 
-                                               db=self.__sql_connector,
-                                               quiet=self.__options['quiet'])
+    self.__processor = ProcessData.ProcessData(
+        album_data=self.__album_data,
+        db=self.__sql_connector,
+        quiet=self.__options['quiet'],
+        max_delete=self.__options['max_delete'],
+        connections=self.__options['connections'])
     if __debug__:
       print "%s__init__] Loaded data processor!" % self.__DEBUG_INFO
     if not self.__options['quiet']:
       print "Options checked and loaded; SQL connection established."
 
+  def __LoadAlbumData(self):
+    """ Loads AlbumData from the iPhoto library, or its cache. """
+    if __debug__:
+      print "%s__LoadAlbumData] Loading AlbumData..." % self.__DEBUG_INFO
+    self.__album_data = album_data.AlbumData(
+        iphoto_library=self.__options['library'],
+        cache_file=self.__options['cache'],
+        refresh_cache=self.__options['refresh_cache'],
+        processes=self.__options['processes'])
+    if self.__album_data.__version__ != self.__TESTED_ALBUM_DATA_VERSION:
+      print ("%(warn)s AlbumData version not tested!\n"
+             "%(warn)s Possible data lost may occur!" % {
+             'warn':self.__WARNING_INFO,
+             'warn':self.__WARNING_INFO})
+    if __debug__:
+      print "%s__LoadAlbumData] Albumdata loaded!" % self.__DEBUG_INFO
+
   def __ClassLoader(self, file_name=None):
     """ Loads a given python file VIA the file basename.
     
@@ -131,15 +165,46 @@ class Exhibit(object):
     Kills:
       sys.exit: Critical module errors
     """
-    self.__processor.FullImport()
+    if self.__options['export_only']:
+      self.__Export()
+      print "\n\nDone!"
+      return
+    changes = None
+    applied = True
+    if self.__options['incremental'] and not self.__options['force']:
+      changes = self.__library_diff.changes
+      if changes is None:
+        print ("%sRun] No usable library snapshot, running a full import." %
+               self.__WARNING_INFO)
+    if changes:
+      applied = self.__processor.IncrementalImport(changes)
+    else:
+      self.__processor.FullImport()
+    if self.__options['force']:
+      self.__sql_connector.FinishRebuild()
+      print "%sRun] SQL database rebuilt." % self.__WARNING_INFO
+    self.__Export()
+    if self.__library_diff and applied:
+      self.__library_diff.Save()
+    elif self.__library_diff:
+      print ("%sRun] Library snapshot not saved; the refused deletions are "
+             "retried on the next run." % self.__WARNING_INFO)
+    if self.__options['sql_stats']:
+      print "\n%s" % self.__sql_connector.Summary()
+      if self.__options['sql_stats_file']:
+        self.__sql_connector.WriteJson(self.__options['sql_stats_file'])
+    print "\n\nDone!"
+
+  def __Export(self):
+    """ Exports the images, with the SQL database if connected. """
     self.__exporter = Export.Export(
         album_data=self.__album_data, 
         db=self.__sql_connector, 
         export_options={'export_path':self.__options['export_path'],
-                        'link':self.__options['link']},
+                        'link':self.__options['link'],
+                        'threads':self.__options['export_threads']},
                         quiet=self.__options['quiet'])
     self.__exporter.Run()
-    print "\n\nDone!"
 
 
 
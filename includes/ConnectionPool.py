@@ -0,0 +1,211 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+#
+# Copyright 2008, Robert Pufky
+# Exhibit - database connection pool Class
+#
+""" Lends database connectors to worker threads
+
+A connector (i.e. MySql) holds a single connection and transaction, and must
+not be used by more than one thread at a time.  The pool forks new connectors
+from a connector as workers need them, up to a maximum, and lends them out one
+worker at a time.  Connectors are checked (and reconnected if the connection
+was lost) before they are lent out.
+
+Functional Notes:
+  Connectors must support Fork(), Ping(), Commit() and Close().  The connector
+  the pool is created from is not lent out, and stays usable by its owner.
+
+Testing:
+  This module can be tested by running this file from the command line.  A
+  stand-in connector is used, no database is needed.
+
+Debugging:
+  Removing the optimization flag (-OO) from this file will turn debugging on.
+
+Attributes:
+  Class ConnectionPool: Lends forked database connectors to worker threads
+"""
+__author__ = "Robert Pufky (github.com/r-pufky)"
+import sys
+import threading
+
+
+
+class ConnectionPool(object):
+  """ Lends forked database connectors to worker threads.
+
+  Attributes:
+    Borrow(): Takes a connector from the pool, waiting if all are lent out
+    Return(): Commits a borrowed connector, and gives it back to the pool
+    Close(): Closes every connector of the pool
+  """
+  __author__ = "Robert Pufky (github.com/r-pufky)"
+  __version__ = "1.0"
+
+  def __init__(self, connector=None, size=4):
+    """ Initializes an empty pool; connectors are forked when borrowed.
+
+    Args:
+      connector: Connector object to fork the pool's connectors from
+      size: Integer maximum number of connectors
+
+    Kills:
+      sys.exit: Invalid arguments
+    """
+    self.__DEBUG_INFO = "DEBUG:[ConnectionPool."
+    self.__WARNING_INFO = "WARNING:[ConnectionPool."
+    if not connector:
+      sys.exit("%(debug)s__init__] Connector not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    if not size or size < 1:
+      sys.exit("%(debug)s__init__] Pool size must be at least 1!" %
+               {'debug':self.__DEBUG_INFO})
+    self.__connector = connector
+    self.__size = size
+    self.__opened = []
+    self.__idle = []
+    self.__available = threading.Condition(threading.Lock())
+
+  def Borrow(self):
+    """ Takes a connector from the pool, waiting if all are lent out.
+
+    Idle connectors are pinged first, and replaced if they cannot reconnect.
+
+    Kills:
+      sys.exit: A new connector cannot connect
+
+    Returns:
+      A connector object, to be given back with Return()
+    """
+    self.__available.acquire()
+    try:
+      while not self.__idle and len(self.__opened) >= self.__size:
+        self.__available.wait()
+      if self.__idle:
+        connector = self.__idle.pop()
+      else:
+        connector = None
+        # reserve the slot, the connector is forked outside of the lock
+        self.__opened.append(connector)
+    finally:
+      self.__available.release()
+    if connector and not connector.Ping():
+      print ("%(warn)sBorrow] Connector cannot reconnect, replacing it." %
+             {'warn':self.__WARNING_INFO})
+      self.__Discard(connector)
+      return self.Borrow()
+    if not connector:
+      connector = self.__connector.Fork()
+      self.__available.acquire()
+      try:
+        self.__opened[self.__opened.index(None)] = connector
+      finally:
+        self.__available.release()
+      if __debug__:
+        print ("%(debug)sBorrow] Opened connector %(count)s of %(size)s" %
+               {'debug':self.__DEBUG_INFO,
+                'count':len(self.__opened),
+                'size':self.__size})
+    return connector
+
+  def Return(self, connector=None):
+    """ Commits a borrowed connector, and gives it back to the pool.
+
+    Args:
+      connector: Connector object taken with Borrow()
+
+    Kills:
+      sys.exit: Commit fails on the database
+    """
+    connector.Commit()
+    self.__available.acquire()
+    try:
+      self.__idle.append(connector)
+      self.__available.notify()
+    finally:
+      self.__available.release()
+
+  def __Discard(self, connector=None):
+    """ Removes a broken connector from the pool, freeing its slot.
+
+    Args:
+      connector: Connector object to remove
+    """
+    self.__available.acquire()
+    try:
+      if connector in self.__opened:
+        self.__opened.remove(connector)
+      self.__available.notify()
+    finally:
+      self.__available.release()
+
+  def Close(self):
+    """ Closes every connector of the pool; lent connectors are closed too. """
+    self.__available.acquire()
+    try:
+      for connector in self.__opened:
+        if connector:
+          connector.Close()
+      self.__opened = []
+      self.__idle = []
+    finally:
+      self.__available.release()
+
+
+
+class _TestConnector(object):
+  """ Stand-in connector, counting forks and commits. """
+  forks = 0
+
+  def __init__(self):
+    self.commits = 0
+    self.alive = True
+
+  def Fork(self):
+    _TestConnector.forks += 1
+    return _TestConnector()
+
+  def Ping(self):
+    return self.alive
+
+  def Commit(self):
+    self.commits += 1
+
+  def Close(self):
+    self.alive = False
+
+
+
+if __name__ == "__main__":
+  print "Testing ConnectionPool Class...\n"
+  print "-->Test connectors are reused:"
+  pool = ConnectionPool(connector=_TestConnector(), size=2)
+  first = pool.Borrow()
+  pool.Return(first)
+  if pool.Borrow() is first and first.commits == 1:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test borrowers wait when all connectors are lent out:"
+  second = pool.Borrow()
+  borrowed = []
+  waiter = threading.Thread(target=lambda: borrowed.append(pool.Borrow()))
+  waiter.start()
+  waiter.join(0.2)
+  waiting = not borrowed
+  pool.Return(second)
+  waiter.join()
+  if waiting and borrowed == [second] and _TestConnector.forks == 2:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test broken connectors are replaced:"
+  pool.Return(first)
+  first.alive = False
+  if pool.Borrow() is not first and _TestConnector.forks == 3:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  pool.Close()
+  print "\n\nTesting completeled successfully!\n\n"
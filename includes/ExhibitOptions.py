@@ -94,16 +94,80 @@ class ExhibitOptions(object):
     self.__parser.add_option('-c','--config',metavar='FILE',dest='config',
         help="Alternate configuration file.  Default file:    [Exhibit Base "
         "Directory]/exhibit.config")
-    self.__parser.add_option('-i','--link',action='store_true',dest='link',
-        help="Forces export option to use symlinks instead of copying the file."
-        "  If the symlink fails, attempts to copy the actual file to local "
-        "directory.")
+    self.__parser.add_option('-i',action='store_const',const='symlink',
+        dest='link',help="Forces export option to use symlinks instead of "
+        "copying the file.  If the symlink fails, attempts to copy the actual "
+        "file to local directory.  Same as --link=symlink.")
+    self.__parser.add_option('--link',metavar='MODE',type='choice',
+        choices=('copy','symlink','hard','reflink'),dest='link',
+        help="How images are exported: copy, symlink, hard (hard links) or "
+        "reflink (copy-on-write clones).  Hard links and clones need the "
+        "export directory on the iPhoto library's file system; files are "
+        "copied where they cannot be linked.  Default: [export] link in the "
+        "configuration file, or copy")
     self.__parser.add_option('-f','--force',action='store_true',dest='force',
-        help="Forces the SQL database to be rebuilt.  THIS IS SQL DATA "
-        "DESTRUCTIVE")
+        help="Forces the SQL database to be rebuilt.  The new tables are "
+        "loaded next to the old ones, and replace them once complete.  THIS IS "
+        "SQL DATA DESTRUCTIVE")
+    self.__parser.add_option('--export-only',action='store_true',
+        dest='export_only',help="Only exports images, without connecting to "
+        "the SQL server.  Exported file names use the library's database ID "
+        "cached in the export directory, so Exhibit must have exported there "
+        "with the SQL database before.")
     self.__parser.add_option('-q','--quiet',action='store_true',dest='quiet',
         help="Disables all output, except ERRORS and WARNINGS.  Useful for "
         "cronjobs.")
+    self.__parser.add_option('--cache',metavar='FILE',dest='cache',
+        help="Parsed iPhoto library cache file.  Default file: [library] "
+        "cache in the configuration file.")
+    self.__parser.add_option('--refresh-cache',action='store_true',
+        dest='refresh_cache',help="Ignores the parsed iPhoto library cache and"
+        " rebuilds it from the iPhoto library.")
+    self.__parser.add_option('-n','--incremental',action='store_true',
+        dest='incremental',help="Uploads only what changed in the iPhoto "
+        "library since the last run; exported images which are up to date are "
+        "skipped either way.  Needs a library snapshot; runs a full import if "
+        "there is none.")
+    self.__parser.add_option('--snapshot',metavar='FILE',dest='snapshot',
+        help="Library snapshot file used to find changes between runs.  "
+        "Default file: [library] snapshot in the configuration file.")
+    self.__parser.add_option('-j','--processes',metavar='NUMBER',type='int',
+        dest='processes',default=1,help="Number of processes used to parse "
+        "the iPhoto library's images.  Default: 1")
+    self.__parser.add_option('--max-delete',metavar='PERCENT',type='int',
+        dest='max_delete',help="Largest percentage of the images, albums or "
+        "rolls in the SQL database which may be deleted in one run, because "
+        "they are no longer in the iPhoto library.  Protects the database from "
+        "a truncated library; deleting fewer than 10 rows is always allowed.  "
+        "Default: [sql] max_delete in the configuration file, or 25")
+    self.__parser.add_option('--commit-rows',metavar='NUMBER',type='int',
+        dest='commit_rows',help="Commits the SQL changes every NUMBER rows; 0 "
+        "to not commit by rows.  Default: [sql] commit_rows in the "
+        "configuration file, or 10000")
+    self.__parser.add_option('--commit-seconds',metavar='SECONDS',type='int',
+        dest='commit_seconds',help="Commits the SQL changes every SECONDS "
+        "seconds; 0 to not commit by time.  Default: [sql] commit_seconds in "
+        "the configuration file, or 60")
+    self.__parser.add_option('--connections',metavar='NUMBER',type='int',
+        dest='connections',help="Number of SQL connections a full import "
+        "runs on; with more than one, tables and image ranges are loaded "
+        "concurrently.  Default: [sql] connections in the configuration file, "
+        "or 1")
+    self.__parser.add_option('--export-threads',metavar='NUMBER',type='int',
+        dest='export_threads',help="Number of files exported (copied or "
+        "linked) concurrently.  Default: [export] threads in the "
+        "configuration file, or 1")
+    self.__parser.add_option('--sql-stats',action='store_true',
+        dest='sql_stats',help="Times every SQL call, and prints the calls, "
+        "time, latency percentiles, rows and bytes sent per operation and "
+        "table at the end of the run.")
+    self.__parser.add_option('--sql-stats-file',metavar='FILE',
+        dest='sql_stats_file',help="Writes the SQL statistics to FILE, as "
+        "JSON.  Implies --sql-stats.")
+    self.__parser.add_option('--slow-statement',metavar='MILLISECONDS',
+        type='int',dest='slow_statement',default=1000,help="SQL calls slower "
+        "than MILLISECONDS are listed in the SQL statistics; 0 to not list "
+        "calls.  Default: 1000")
     opts, args = self.__parser.parse_args(arguments)
     if __debug__:
       print ("%(debug)s__ParseArgs] options recieved: %(options)s" % 
@@ -125,13 +189,75 @@ class ExhibitOptions(object):
     if __debug__:
       print ("%(debug)s__ParseArgs] Force SQL database to be rebuilt: %(force)s"
              % {'debug':self.__DEBUG_INFO,'force':self.options['force']})
-    if not opts.link:
-      self.options['link'] = False
-    else:
-      self.options['link'] = True
+    if opts.export_only and (opts.force or opts.incremental):
+      self.__parser.exit("Export only runs cannot rebuild (-f) or update (-n) "
+                         "the SQL database!")
+    self.options['export_only'] = bool(opts.export_only)
+    if __debug__:
+      print ("%(debug)s__ParseArgs] Export only: %(export_only)s" %
+             {'debug':self.__DEBUG_INFO,
+              'export_only':self.options['export_only']})
+    self.options['link'] = opts.link
     if __debug__:
       print ("%(debug)s__ParseArgs] link image exports: %(link)s" % 
              {'debug':self.__DEBUG_INFO,'link':self.options['link']})
+    if not opts.refresh_cache:
+      self.options['refresh_cache'] = False
+    else:
+      self.options['refresh_cache'] = True
+    if not opts.cache:
+      self.options['cache'] = None
+    else:
+      self.options['cache'] = os.path.expanduser(opts.cache)
+    if not opts.incremental:
+      self.options['incremental'] = False
+    else:
+      self.options['incremental'] = True
+    if not opts.snapshot:
+      self.options['snapshot'] = None
+    else:
+      self.options['snapshot'] = os.path.expanduser(opts.snapshot)
+    if __debug__:
+      print ("%(debug)s__ParseArgs] incremental: %(incremental)s, snapshot: "
+             "%(snapshot)s" % {'debug':self.__DEBUG_INFO,
+                               'incremental':self.options['incremental'],
+                               'snapshot':self.options['snapshot']})
+    if opts.processes < 1:
+      self.__parser.exit("Number of processes must be at least 1!")
+    self.options['processes'] = opts.processes
+    if opts.max_delete is not None and not 0 <= opts.max_delete <= 100:
+      self.__parser.exit("Maximum deletion must be a percentage (0-100)!")
+    self.options['max_delete'] = opts.max_delete
+    for interval in ('commit_rows', 'commit_seconds'):
+      if getattr(opts, interval) is not None and getattr(opts, interval) < 0:
+        self.__parser.exit("Commit intervals cannot be negative!")
+      self.options[interval] = getattr(opts, interval)
+    if opts.connections is not None and opts.connections < 1:
+      self.__parser.exit("Number of connections must be at least 1!")
+    self.options['connections'] = opts.connections
+    if opts.export_threads is not None and opts.export_threads < 1:
+      self.__parser.exit("Number of export threads must be at least 1!")
+    self.options['export_threads'] = opts.export_threads
+    if not opts.sql_stats_file:
+      self.options['sql_stats_file'] = None
+    else:
+      self.options['sql_stats_file'] = os.path.expanduser(opts.sql_stats_file)
+    self.options['sql_stats'] = bool(opts.sql_stats or opts.sql_stats_file)
+    if opts.slow_statement < 0:
+      self.__parser.exit("Slow statement threshold cannot be negative!")
+    self.options['slow_statement'] = opts.slow_statement
+    if __debug__:
+      print ("%(debug)s__ParseArgs] SQL statistics: %(stats)s, file: "
+             "%(file)s, slow statements: %(slow)sms" % {
+             'debug':self.__DEBUG_INFO,
+             'stats':self.options['sql_stats'],
+             'file':self.options['sql_stats_file'],
+             'slow':self.options['slow_statement']})
+    if __debug__:
+      print ("%(debug)s__ParseArgs] library cache: %(cache)s, refresh: "
+             "%(refresh)s" % {'debug':self.__DEBUG_INFO,
+                              'cache':self.options['cache'],
+                              'refresh':self.options['refresh_cache']})
     if not opts.library:
       self.options['library'] = os.path.expanduser(
           "~/Pictures/iPhoto Library/AlbumData.xml")
@@ -192,6 +318,19 @@ class ExhibitOptions(object):
       if __debug__:
         print ("%(debug)s__ProcessConfigFile] library set to: %(library)s\n" %
                {'debug':self.__DEBUG_INFO,'library':self.options['library']})
+    if (not self.options['cache'] and 
+        self.__config_file.has_option("library","cache")):
+      self.options['cache'] = os.path.expanduser(
+          self.__config_file.get("library","cache"))
+      if __debug__:
+        print ("%(debug)s__ProcessConfigFile] library cache set to: %(cache)s" %
+               {'debug':self.__DEBUG_INFO,'cache':self.options['cache']})
+    if (not self.options['snapshot'] and
+        self.__config_file.has_option("library","snapshot")):
+      self.options['snapshot'] = os.path.expanduser(
+          self.__config_file.get("library","snapshot"))
+    if self.options['incremental'] and not self.options['snapshot']:
+      self.__parser.exit("Incremental runs need a library snapshot file!")
     try:
       self.options['sql_address'] = self.__config_file.get('sql','address')
       self.options['sql_username'] = self.__config_file.get('sql','username')
@@ -199,10 +338,51 @@ class ExhibitOptions(object):
       self.options['sql_database'] = self.__config_file.get('sql','database')
       self.options['sql_type'] = self.__config_file.get('sql','type')
       self.options['sql_prepend'] = self.__config_file.get('sql','prepend')
+      if self.options['max_delete'] is None:
+        if self.__config_file.has_option('sql','max_delete'):
+          self.options['max_delete'] = self.__config_file.getint('sql',
+                                                                 'max_delete')
+        else:
+          self.options['max_delete'] = 25
+        if not 0 <= self.options['max_delete'] <= 100:
+          self.__parser.exit("Maximum deletion must be a percentage (0-100)!")
+      for interval, default in (('commit_rows', 10000),
+                                ('commit_seconds', 60)):
+        if self.options[interval] is None:
+          if self.__config_file.has_option('sql',interval):
+            self.options[interval] = self.__config_file.getint('sql',interval)
+          else:
+            self.options[interval] = default
+          if self.options[interval] < 0:
+            self.__parser.exit("Commit intervals cannot be negative!")
+      if self.options['connections'] is None:
+        if self.__config_file.has_option('sql','connections'):
+          self.options['connections'] = self.__config_file.getint(
+              'sql','connections')
+        else:
+          self.options['connections'] = 1
+        if self.options['connections'] < 1:
+          self.__parser.exit("Number of connections must be at least 1!")
       if __debug__:
         print ("%(debug)s__ProcessConfigFile] library set to: %(library)s" %
                {'debug':self.__DEBUG_INFO,'library':self.options['library']})
       self.options['export_path'] = self.__config_file.get('export','path')
+      if self.options['link'] is None:
+        if self.__config_file.has_option('export','link'):
+          self.options['link'] = self.__config_file.get('export','link')
+        else:
+          self.options['link'] = "copy"
+        if self.options['link'] not in ('copy','symlink','hard','reflink'):
+          self.__parser.exit("Export link mode must be copy, symlink, hard or "
+                             "reflink!")
+      if self.options['export_threads'] is None:
+        if self.__config_file.has_option('export','threads'):
+          self.options['export_threads'] = self.__config_file.getint(
+              'export','threads')
+        else:
+          self.options['export_threads'] = 1
+        if self.options['export_threads'] < 1:
+          self.__parser.exit("Number of export threads must be at least 1!")
       if (len(self.options['export_path']) != 
         self.options['export_path'].rfind(os.sep)+1):
         self.options['export_path'] += os.sep
@@ -15,6 +15,31 @@ Functional Notes:
   Movies, and other image datatype will always have a thumbnail picture, with
     the actual data stored in Image data ([LibraryID][GUID].[extension])
 
+  Files are copied (or linked) by a pool of worker threads, fed through a
+  bounded queue.  Image locations are read from the SQL database in a single
+  streamed query, or one query per image when there are fewer than 100 images
+  in the library.  Files which cannot be exported are retried one at a time
+  once every worker is done; fatal errors stop all workers.
+
+  Exported files are recorded in a manifest in the export directory (see
+  ExportManifest); files whose source did not change since they were exported
+  are skipped.
+
+  Without a SQL connector (export only), image locations are taken from
+  AlbumData, and the library's database ID from the manifest, where it is
+  cached by every export with the SQL database.
+
+Export Modes:
+  copy: Files are copied.
+  symlink: Files are symlinked to the iPhoto library.
+  hard: Files are hard linked to the iPhoto library; no space is used, and
+    rsync copies them like normal files.
+  reflink: Files are cloned (copy-on-write) on file systems which support it
+    (APFS clonefile, Linux FICLONE ioctl); elsewhere on Linux they are copied
+    in the kernel (copy_file_range), i.e. server side on NFS 4.2.
+  Files which cannot be hard linked or cloned, i.e. as the export directory is
+  on another file system, are copied instead.
+
 Known Bugs:
   If the destination file has an actual '\' in the name, it will be removed as 
   all escape characters ('\') are automatically removed.  This should not happen too often, as this is a very rare case.  Export will thrown an "Export failed"
@@ -40,9 +65,24 @@ from __future__ import division
 __author__ = "Robert Pufky (github.com/r-pufky)"
 import os
 import sys
+import errno
+import Queue
 import shutil
 import commands
+import threading
+import traceback
+import ExportManifest
 import ProgressIndicator
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+try:
+  import ctypes
+  import ctypes.util
+  _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except (ImportError, OSError, TypeError):
+  _libc = None
 
 
 class Export(object):
@@ -61,10 +101,13 @@ class Export(object):
     Args:
       album_data: Dictionary from album_data processing
       db: A SQL query object with Close,DatabaseCheck,Insert,Update,Delete, 
-          and Select functions
+          Select and SelectIter functions; None to export without the SQL
+          database, from AlbumData
       export_options: Dictionary with options to use for rsync:
           {'export_path' - path to store exported albums
-           'link'}       - True if files should be symlinked, False for copy
+           'link'        - export mode: copy, symlink, hard or reflink (see
+                           Export Modes); True for symlink, False for copy
+           'threads'}    - number of files exported concurrently (optional)
 
     Kills:
       sys.exit: Invalid arugments passed to object
@@ -74,9 +117,22 @@ class Export(object):
     self.__IMAGE_TRANSLATION = (
         {'ThumbPath':"T",'OriginalPath':"O",'ImagePath':""})
     self.__escape_characters = [' ','"',"'",'`','(',')','&','<','>','-','.']
-    if not db:
-      sys.exit("%(debug)s__init__] SQL connector object not provided!" %        
-               {'debug':self.__DEBUG_INFO})
+    # files queued per worker, before looking up more images blocks
+    self.__QUEUED_FILES_PER_THREAD = 16
+    # below this many images, locations are selected one image at a time
+    # instead of loading every image's location
+    self.__BULK_LOOKUP_MINIMUM = 100
+    self.__LOCATION_COLUMNS = ('ImageID', 'GUID', 'ThumbPath', 'ImagePath',
+                               'OriginalPath')
+    self.__EXPORT_MODES = ("copy", "symlink", "hard", "reflink")
+    # ioctl cloning a whole file on Linux (FICLONE, from linux/fs.h)
+    self.__FICLONE = 0x40049409
+    # errors of a link or clone which can not be done here, but can be copied
+    self.__UNSUPPORTED_ERRORS = set([errno.EXDEV, errno.EPERM, errno.EMLINK,
+                                     errno.EINVAL, errno.ENOTTY, errno.ENOSYS,
+                                     errno.EOPNOTSUPP,
+                                     getattr(errno, "ENOTSUP",
+                                             errno.EOPNOTSUPP)])
     if not album_data:
       sys.exit("%(debug)s__init__] AlbumData dict not provided!" % 
                {'debug':self.__DEBUG_INFO})
@@ -90,51 +146,130 @@ class Export(object):
     self.__album_data = album_data
     self.__export = export_options
     self.__quiet = quiet
+    self.__threads = export_options.get('threads') or 1
+    if export_options.get('link') is True:
+      self.__mode = "symlink"
+    else:
+      self.__mode = export_options.get('link') or "copy"
+    if self.__mode not in self.__EXPORT_MODES:
+      sys.exit("%(debug)s__init__] Unknown export mode %(mode)s!" %
+               {'debug':self.__DEBUG_INFO,'mode':self.__mode})
+    if self.__threads < 1:
+      sys.exit("%(debug)s__init__] Export threads must be at least 1!" %
+               {'debug':self.__DEBUG_INFO})
+    self.__manifest = ExportManifest.ExportManifest(
+        self.__export['export_path'])
+    library_path = self.__album_data.properties['Path']
+    archive_id = self.__album_data.properties['ArchiveID']
+    if not self.__db:
+      self.__db_library_id = self.__manifest.LibraryId(library_path,
+                                                       archive_id)
+      if self.__db_library_id is None:
+        sys.exit("%(debug)s__init__] iPhotoLibraryID of this library is not "
+                 "cached in the export directory!\n"
+                 "%(debug)s__init__] Export with the SQL database once first."
+                 % {'debug':self.__DEBUG_INFO})
+      return
     self.__db_library_id = self.__db.Select(
         "iPhotoLibrary",
-        {'Path':self.__album_data.properties['Path'],
-        'ArchiveID':self.__album_data.properties['ArchiveID']},
+        {'Path':library_path,
+        'ArchiveID':archive_id},
         limit=1)
     if self.__db_library_id:
       self.__db_library_id = self.__db_library_id[0]['ID']
     else:
       sys.exit("%(debug)s__init__] iPhotoLibraryID could not be retreived!" % 
                {'debug':self.__DEBUG_INFO})
+    self.__manifest.SetLibraryId(library_path, archive_id,
+                                 self.__db_library_id)
+
+  def __LocationData(self, row=None):
+    """ Builds the location data of an image from its database row.
+
+    Args:
+      row: Dictionary Images row or AlbumData image, with at least the GUID
+          and path columns
 
-  def __VerifyImageInDatabase(self, image_key=None):
+    Returns:
+      A dictionary containing image location data; paths which are empty are
+      left out
+          {'GUID',
+          'ThumbPath',
+          'ImagePath',
+          'OriginalPath'}
+    """
+    location_data = {}
+    location_data['GUID'] = row['GUID']
+    if row.get('ThumbPath'):
+      location_data['ThumbPath'] = row['ThumbPath']
+    if row.get('ImagePath'):
+      location_data['ImagePath'] = row['ImagePath']
+    if row.get('OriginalPath'):
+      location_data['OriginalPath'] = row['OriginalPath']
+    return location_data
+
+  def __LoadImageLocations(self):
+    """ Loads the location data of every image of the library.
+
+    The locations are read in one streamed query, instead of a query per
+    image.
+
+    Kills:
+      sys.exit: Bad SQL Query
+
+    Returns:
+      A dictionary of string ImageID to location data (see __LocationData)
+    """
+    locations = {}
+    for row in self.__db.SelectIter("Images",
+                                    {'iPhotoLibraryID':self.__db_library_id},
+                                    columns=self.__LOCATION_COLUMNS):
+      locations[str(row['ImageID'])] = self.__LocationData(row)
+    if __debug__:
+      print ("%(debug)s__LoadImageLocations] Loaded %(count)s image locations."
+             % {'debug':self.__DEBUG_INFO,'count':len(locations)})
+    return locations
+
+  def __LibraryImageLocations(self):
+    """ Builds the location data of every image from AlbumData.
+
+    Used to export without the SQL database.
+
+    Returns:
+      A dictionary of string ImageID to location data (see __LocationData)
+    """
+    return dict([(str(image_key), self.__LocationData(image))
+                 for image_key, image in self.__album_data.images.iteritems()])
+
+  def __VerifyImageInDatabase(self, image_key=None, locations=None):
     """ Verifies the image  actually exists in the database.
     
     If the image does not exist, a warning is issued, and None is returned.
     
     Args:
       image_key: Integer iPhoto Library's image id
+      locations: Dictionary from __LoadImageLocations or
+          __LibraryImageLocations; None to select the image from the database
       
     Kills:
       sys.exit: Bad SQL Query, invalid argument passed
       
     Returns:
-      A dictionary containing image location data; or None
-          {'GUID',
-          'ThumbPath',
-          'ImagePath',
-          'OriginalPath'}
+      A dictionary containing image location data (see __LocationData); or
+      None
     """
     if not image_key:
       sys.exit("%(debug)s__VerifyImageInDatabase] Image ID is not valid!" % 
                {'debug':self.__DEBUG_INFO})
-    image_dict = self.__db.Select("Images",
-                                  {'iPhotoLibraryID':self.__db_library_id,
-                                  'ImageID':image_key},
-                                  limit=1)
-    if image_dict:
-      location_data = {}
-      location_data['GUID'] = image_dict[0]['GUID']
-      if image_dict[0]['ThumbPath']:
-        location_data['ThumbPath'] = image_dict[0]['ThumbPath']
-      if image_dict[0]['ImagePath']:
-        location_data['ImagePath'] = image_dict[0]['ImagePath']
-      if image_dict[0]['OriginalPath']:
-        location_data['OriginalPath'] = image_dict[0]['OriginalPath']
+    if locations is not None:
+      location_data = locations.get(str(image_key))
+    else:
+      image_dict = self.__db.Select("Images",
+                                    {'iPhotoLibraryID':self.__db_library_id,
+                                    'ImageID':image_key},
+                                    limit=1)
+      location_data = image_dict and self.__LocationData(image_dict[0])
+    if location_data:
       return location_data
     else:
       print ("%(warn)s__VerifyImageInDatabase] Image [%(key)s] not in SQL "
@@ -177,77 +312,343 @@ class Export(object):
                'dict':self.__IMAGE_TRANSLATION})
     return destination
 
+  def __HardLink(self, source=None, destination=None):
+    """ Hard links a file.
+
+    Args:
+      source: String path of the file to link
+      destination: String path of the new link
+
+    Raises:
+      OSError: The file cannot be linked
+
+    Returns:
+      Boolean True if linked; False if it cannot be linked here, and should be
+      copied instead
+    """
+    try:
+      os.link(source, destination)
+    except OSError, e:
+      if e.errno in self.__UNSUPPORTED_ERRORS:
+        return False
+      raise
+    return True
+
+  def __CopyFileRange(self, source_file=None, destination_file=None):
+    """ Copies a file in the kernel, with copy_file_range (Linux).
+
+    The file system may clone the data instead, or copy it on the server.
+
+    Args:
+      source_file: File object to copy from
+      destination_file: Empty file object to copy to
+
+    Raises:
+      OSError: The file cannot be copied
+
+    Returns:
+      Boolean True if copied; False if copy_file_range is not supported
+    """
+    copy_file_range = getattr(_libc, "copy_file_range", None)
+    if not copy_file_range:
+      return False
+    copy_file_range.restype = ctypes.c_ssize_t
+    copy_file_range.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                                ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+    remaining = os.fstat(source_file.fileno()).st_size
+    copied = 0
+    while remaining > 0:
+      count = copy_file_range(source_file.fileno(), None,
+                              destination_file.fileno(), None,
+                              min(remaining, 1 << 30), 0)
+      if count < 0:
+        error = ctypes.get_errno()
+        if not copied and error in self.__UNSUPPORTED_ERRORS:
+          return False
+        raise OSError(error, os.strerror(error))
+      if count == 0:
+        break
+      copied += count
+      remaining -= count
+    return True
+
+  def __Clone(self, source=None, destination=None):
+    """ Clones (copy-on-write) a file; see Export Modes.
+
+    Args:
+      source: String path of the file to clone
+      destination: String path of the clone, which must not exist
+
+    Raises:
+      EnvironmentError: The file cannot be cloned
+
+    Returns:
+      Boolean True if cloned; False if it cannot be cloned here, and should be
+      copied instead
+    """
+    if sys.platform == "darwin":
+      clonefile = getattr(_libc, "clonefile", None)
+      if not clonefile:
+        return False
+      clonefile.restype = ctypes.c_int
+      clonefile.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int)
+      # unicode paths would be passed as wchar_t strings; encode them
+      encoding = sys.getfilesystemencoding()
+      if isinstance(source, unicode):
+        source = source.encode(encoding)
+      if isinstance(destination, unicode):
+        destination = destination.encode(encoding)
+      if clonefile(source, destination, 0) != 0:
+        error = ctypes.get_errno()
+        if error in self.__UNSUPPORTED_ERRORS:
+          return False
+        raise OSError(error, os.strerror(error), source)
+      return True
+    if not fcntl:
+      return False
+    source_file = open(source, 'rb')
+    try:
+      destination_file = open(destination, 'wb')
+      try:
+        try:
+          fcntl.ioctl(destination_file.fileno(), self.__FICLONE,
+                      source_file.fileno())
+        except IOError, e:
+          if e.errno not in self.__UNSUPPORTED_ERRORS:
+            raise
+          if not self.__CopyFileRange(source_file, destination_file):
+            return False
+      finally:
+        destination_file.close()
+    finally:
+      source_file.close()
+    shutil.copymode(source, destination)
+    return True
+
+  def __ExportFile(self, source=None, destination=None, failed_images=None):
+    """ Exports a file to the export directory, in the export mode.
+
+    Args:
+      source: String path of the file in the iPhoto library
+      destination: String path to export the file to
+      failed_images: List to add the file to if it should be retried
+
+    Kills:
+      sys.exit: Fatal copy command error
+
+    Returns:
+      Boolean False if the file was copied, as it could not be hard linked or
+      cloned; True otherwise
+    """
+    linked = True
+    if self.__mode != "symlink" and os.path.lexists(destination):
+      # i.e. a link of another export mode; copying onto it would write
+      # through to the iPhoto library
+      try:
+        os.remove(destination)
+      except OSError, e:
+        sys.exit("%(debug)sRun] Export failed: %(error)s" %
+                 {'debug':self.__DEBUG_INFO,'error':e})
+    if self.__mode in ("hard", "reflink"):
+      try:
+        if self.__mode == "hard":
+          linked = self.__HardLink(source.replace('\\',''), destination)
+        else:
+          linked = self.__Clone(source.replace('\\',''), destination)
+      except EnvironmentError, e:
+        if e.errno == 2:
+          failed_images.append({'source':source,
+                                'destination':destination})
+          return True
+        sys.exit("%(debug)sRun] Export failed: %(error)s" %
+                 {'debug':self.__DEBUG_INFO,'error':e})
+      if linked:
+        return True
+      if __debug__:
+        print ("%(debug)sRun] Cannot %(mode)s link %(source)s, copying it." %
+               {'debug':self.__DEBUG_INFO,
+                'mode':self.__mode,
+                'source':source})
+    # try to copy files via symlinking or normal copy.  If it fails, add it to
+    # a list to get re-processed with another command later
+    if self.__mode != "symlink":
+      try:
+        shutil.copy(source.replace('\\',''), destination)
+      except Exception, e:
+        if e.errno == 2:
+          failed_images.append({'source':source,
+                                'destination':destination})
+        else:
+          sys.exit("%(debug)sRun] Export failed: %(error)s" %
+                   {'debug':self.__DEBUG_INFO,'error':e})
+      if os.path.isfile(destination):
+        if __debug__:
+          print "%sRun] Export succeeded!" % self.__DEBUG_INFO
+      else:
+        failed_images.append({'source':source,
+                              'destination':destination})
+    else:
+      try:
+        os.symlink(source.replace('\\',''), destination)
+      except OSError, e:
+        if e.errno == 17:
+          os.remove(destination)
+          try:
+            os.symlink(source.replace('\\',''), destination)
+          except Exception, e:
+            sys.exit("%(debug)sRun] Export failed: %(error)s" %
+                     {'debug':self.__DEBUG_INFO,'error':e})
+        else:
+          failed_images.append({'source':source,
+                                'destination':destination})
+    return linked
+
+  def __Worker(self, files=None, stop=None, results=None):
+    """ Exports queued files, until it takes None from the queue.
+
+    Files which are up to date in the manifest are skipped; exported files are
+    recorded in it.  Once any worker had a fatal error, the remaining files are
+    taken from the queue without being exported, so the queue never blocks.
+
+    Args:
+      files: Queue of (source, file name) tuples
+      stop: threading.Event set when a worker had a fatal error
+      results: List receiving the worker's results:
+          {'exported' - number of files exported
+           'copied'   - number of files copied, as they could not be linked
+           'current'  - number of files skipped, as they are up to date
+           'failed'   - list of files to retry, as failed_images in Run
+           'errors'}  - list of fatal error messages
+    """
+    exported = 0
+    copied = 0
+    current = 0
+    failed_images = []
+    errors = []
+    while True:
+      export_file = files.get()
+      if export_file is None:
+        break
+      if stop.isSet():
+        continue
+      source, name = export_file
+      try:
+        state = self.__manifest.SourceState(source.replace('\\',''))
+        if self.__manifest.IsCurrent(name, source, state, self.__mode):
+          current += 1
+          continue
+        failed = len(failed_images)
+        if not self.__ExportFile(source, self.__export['export_path'] + name,
+                                 failed_images):
+          copied += 1
+        if len(failed_images) == failed:
+          self.__manifest.Record(name, source, state, self.__mode)
+          exported += 1
+      except SystemExit, e:
+        errors.append(str(e.code))
+        stop.set()
+      except Exception, e:
+        errors.append(traceback.format_exc())
+        stop.set()
+    results.append({'exported':exported,
+                    'copied':copied,
+                    'current':current,
+                    'failed':failed_images,
+                    'errors':errors})
+
   def Run(self):
     """ Exports all the images in AlbumData that exist on the SQL server.
 
-    Args:
-      link: Boolean True to use symlinks in export directory, False to copy
+    Image locations are looked up on this thread, and the files are queued to
+    the export workers.  The locations of every image are loaded at once,
+    unless the library has only a few images; without the SQL database, they
+    are taken from AlbumData.  Every image is queued, also on incremental runs:
+    the manifest skips files which are up to date, and files which failed to
+    export on an earlier run are retried.
     
     Kills:
       sys.exit: Fatal copy command error, bad arugments
     """
     count = 0
-    total = len(self.__album_data.images)
+    image_keys = self.__album_data.images.keys()
+    total = len(image_keys)
     indicator = ProgressIndicator.ProgressIndicator()
     if not self.__quiet:
       print ("\nExporting images to %(path)s (%(num)s images):     " %
             {'path':self.__export['export_path'], 'num':total}),
+    locations = None
+    if not self.__db:
+      locations = self.__LibraryImageLocations()
+    elif total >= self.__BULK_LOOKUP_MINIMUM:
+      locations = self.__LoadImageLocations()
+    files = Queue.Queue(self.__threads * self.__QUEUED_FILES_PER_THREAD)
+    stop = threading.Event()
+    results = []
+    workers = []
+    for worker in xrange(self.__threads):
+      thread = threading.Thread(target=self.__Worker,
+                                args=(files, stop, results))
+      thread.start()
+      workers.append(thread)
+    queued = False
+    try:
+      for image_key in image_keys:
+        if stop.isSet():
+          break
+        if not self.__quiet:
+          count += 1
+          indicator.Tick(int(count/total*100))
+        image_data = self.__VerifyImageInDatabase(image_key, locations)
+        if image_data:
+          if __debug__:
+            print ("%(debug)sRun] Image location data: %(data)s" %
+                   {'debug':self.__DEBUG_INFO,'data':image_data})
+          for image_key in image_data:
+            if image_key != "GUID":
+              destination_name = self.__GetDestFilename(image_data['GUID'],
+                                                        image_key,
+                                                        image_data[image_key])
+              if __debug__:
+                print ("%(debug)sRun] Exporting %(data)s TO: %(path)s%(dest)s"
+                       % {'debug':self.__DEBUG_INFO,
+                          'data':image_data[image_key],
+                          'path':self.__export['export_path'],
+                          'dest':destination_name})
+              files.put((image_data[image_key], destination_name))
+      queued = True
+    finally:
+      # workers stop once they take None; on errors here they stop early
+      if not queued:
+        stop.set()
+      for thread in workers:
+        files.put(None)
+      for thread in workers:
+        thread.join()
     failed_images = []
-    for image_key in self.__album_data.images:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      image_data = self.__VerifyImageInDatabase(image_key)
-      if image_data:
-        if __debug__:
-          print ("%(debug)sRun] Image location data: %(data)s" %
-                 {'debug':self.__DEBUG_INFO,'data':image_data})
-        for image_key in image_data:
-          if image_key != "GUID":
-            destination_file = (self.__export['export_path'] + 
-                                self.__GetDestFilename(image_data['GUID'],
-                                                       image_key, 
-                                                       image_data[image_key]))
-            if __debug__:
-              print ("%(debug)sRun] Exporting %(data)s TO: %(dest)s" % {
-                     'debug':self.__DEBUG_INFO,
-                     'data':image_data[image_key],
-                     'dest':destination_file})
-            # try to copy files via symlinking or normal copy.  If it fails, add
-            # it to a list to get re-processed with another command later
-            if not self.__export['link']:
-              try:
-                shutil.copy(image_data[image_key].replace('\\',''),
-                            destination_file)
-              except Exception, e:
-                if e.errno == 2:
-                  failed_images.append({'source':image_data[image_key],
-                                       'destination':destination_file})
-                else:
-                  sys.exit("%(debug)sRun] Export failed: %(error)s" % 
-                           {'debug':self.__DEBUG_INFO,'error':e})
-              if os.path.isfile(destination_file):
-                if __debug__:
-                  print "%sRun] Export succeeded!" % self.__DEBUG_INFO
-              else:
-                failed_images.append({'source':image_data[image_key],
-                                     'destination':destination_file})
-            else:
-              try:
-                os.symlink(image_data[image_key].replace('\\',''),
-                           destination_file)
-              except OSError, e:
-                if e.errno == 17:
-                  os.remove(destination_file)
-                  try:
-                    os.symlink(image_data[image_key].replace('\\',''),
-                               destination_file)
-                  except Exception, e:
-                    sys.exit("%(debug)sRun] Export failed: %(error)s" %
-                             {'debug':self.__DEBUG_INFO,'error':e})
-                else:
-                  failed_images.append({'source':image_data[image_key],
-                                       'destination':destination_file})
+    errors = []
+    exported = 0
+    copied = 0
+    current = 0
+    for result in results:
+      failed_images.extend(result['failed'])
+      errors.extend(result['errors'])
+      exported += result['exported']
+      copied += result['copied']
+      current += result['current']
+    if not self.__quiet:
+      print ("\n%(exported)s files exported, %(current)s already up to date." %
+             {'exported':exported,'current':current})
+    if copied:
+      print ("%(warn)sRun] %(copied)s files were copied instead, as the "
+             "%(mode)s export mode is not supported for them in %(path)s." % {
+             'warn':self.__WARNING_INFO,
+             'copied':copied,
+             'mode':self.__mode,
+             'path':self.__export['export_path']})
+    if errors:
+      self.__manifest.Save()
+      sys.exit("%(debug)sRun] Export failed:\n%(errors)s" %
+               {'debug':self.__DEBUG_INFO,'errors':"\n".join(errors)})
     if failed_images:
       count = 0
       total = len(failed_images)
@@ -272,6 +673,12 @@ class Export(object):
                  {'warn':self.__WARNING_INFO,
                  'source':image['source'],
                  'dest':image['destination']})
+        else:
+          self.__manifest.Record(
+              os.path.basename(image['destination']), image['source'],
+              self.__manifest.SourceState(image['source'].replace('\\','')),
+              self.__mode)
+    self.__manifest.Save()
 
 
 
@@ -0,0 +1,312 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+#
+# Copyright 2008, Robert Pufky
+# Exhibit - export manifest Class
+#
+""" Remembers which files were exported, so unchanged files are not exported
+
+The manifest is kept in the export directory.  It records for every exported
+file its source path, size and modification time, and how it was exported
+(copied or linked).  A file is up to date if it is still in the export
+directory, and its source path, size, modification time and export mode are
+unchanged; up to date files are skipped by Export.
+
+The export directory is listed once, when the manifest is loaded, instead of
+checking every exported file.  Sources are still checked (stat) once each, to
+find changed files.
+
+The manifest also caches the SQL database ID (iPhotoLibraryID) of each
+library exported, which names the exported files, so files can be exported
+without connecting to the SQL server.
+
+Functional Notes:
+  Removing the manifest file exports every file again.  Files exported by an
+  older Exhibit, without a manifest, are exported once more to be recorded.
+
+  The manifest is shared by the export workers: IsCurrent, Record, Save and
+  the library ID methods hold a lock while they use its entries.
+
+Testing:
+  This module can be tested by running this file from the command line.  A
+  temporary export directory is used.
+
+Debugging:
+  Removing the optimization flag (-OO) from this file will turn debugging on.
+
+Attributes:
+  Class ExportManifest: Records exported files, and finds up to date ones
+"""
+__author__ = "Robert Pufky (github.com/r-pufky)"
+import os
+import sys
+import cPickle
+import threading
+
+
+
+class ExportManifest(object):
+  """ Records exported files, and finds the ones which are up to date.
+
+  Attributes:
+    MANIFEST_FILE: String name of the manifest, in the export directory
+    LibraryId(): Returns the cached database ID of a library
+    SetLibraryId(): Caches the database ID of a library
+    SourceState(): Returns the size and modification time of a source file
+    IsCurrent(): Checks if an exported file is up to date
+    Record(): Records an exported file
+    Save(): Saves the manifest for the next run
+  """
+  __author__ = "Robert Pufky (github.com/r-pufky)"
+  __version__ = "1.0"
+  MANIFEST_FILE = ".exhibit_manifest"
+
+  def __init__(self, export_path=None):
+    """ Loads the manifest of an export directory, and lists the directory.
+
+    Args:
+      export_path: String export directory
+
+    Kills:
+      sys.exit: Invalid arguments
+    """
+    self.__DEBUG_INFO = "DEBUG:[ExportManifest."
+    self.__WARNING_INFO = "WARNING:[ExportManifest."
+    self.__MANIFEST_FORMAT = 1
+    if not export_path:
+      sys.exit("%(debug)s__init__] Export directory not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    self.__manifest_file = os.path.join(export_path, self.MANIFEST_FILE)
+    self.__lock = threading.Lock()
+    try:
+      self.__present = set(os.listdir(export_path))
+    except OSError, e:
+      print ("%(warn)s__init__] Cannot list %(path)s: %(error)s" %
+             {'warn':self.__WARNING_INFO,'path':export_path,'error':e})
+      self.__present = set()
+    # library (Path, ArchiveID) to database ID
+    self.__libraries = {}
+    # entries of the previous run, not exported again (yet) in this run
+    self.__previous = self.__Load()
+    # entries of files exported, or found up to date, in this run
+    self.__current = {}
+
+  def __Load(self):
+    """ Loads the manifest of the previous run.
+
+    Returns:
+      A dictionary of file name to entry (source, size, mtime, mode); empty
+      if there is no usable manifest
+    """
+    if not os.path.exists(self.__manifest_file):
+      return {}
+    try:
+      manifest_file = open(self.__manifest_file, 'rb')
+      try:
+        manifest = cPickle.load(manifest_file)
+      finally:
+        manifest_file.close()
+    except Exception, e:
+      print ("%(warn)s__Load] Cannot read manifest %(file)s, exporting every "
+             "file: %(error)s" % {'warn':self.__WARNING_INFO,
+                                  'file':self.__manifest_file,
+                                  'error':e})
+      return {}
+    if manifest.get('format') != self.__MANIFEST_FORMAT:
+      print ("%s__Load] Manifest format changed, exporting every file." %
+             self.__WARNING_INFO)
+      return {}
+    if __debug__:
+      print ("%(debug)s__Load] Loaded %(count)s manifest entries." %
+             {'debug':self.__DEBUG_INFO,'count':len(manifest['files'])})
+    self.__libraries = manifest.get('libraries', {})
+    return manifest['files']
+
+  def LibraryId(self, path=None, archive_id=None):
+    """ Returns the cached database ID of a library.
+
+    Args:
+      path: String path of the iPhoto library (AlbumData Path property)
+      archive_id: iPhoto library ArchiveID property
+
+    Returns:
+      The iPhotoLibraryID of the library; None if it is not cached
+    """
+    self.__lock.acquire()
+    try:
+      return self.__libraries.get((path, str(archive_id)))
+    finally:
+      self.__lock.release()
+
+  def SetLibraryId(self, path=None, archive_id=None, library_id=None):
+    """ Caches the database ID of a library, saved with the manifest.
+
+    Args:
+      path: String path of the iPhoto library (AlbumData Path property)
+      archive_id: iPhoto library ArchiveID property
+      library_id: iPhotoLibraryID of the library in the SQL database
+    """
+    self.__lock.acquire()
+    try:
+      self.__libraries[(path, str(archive_id))] = library_id
+    finally:
+      self.__lock.release()
+
+  def SourceState(self, source=None):
+    """ Returns the size and modification time of a source file.
+
+    Args:
+      source: String path of the source file
+
+    Returns:
+      A tuple (size, mtime); None if the source cannot be read
+    """
+    try:
+      source_stat = os.stat(source)
+    except OSError:
+      return None
+    return (source_stat.st_size, source_stat.st_mtime)
+
+  def IsCurrent(self, name=None, source=None, state=None, mode=None):
+    """ Checks if an exported file is up to date.
+
+    A file which is not up to date loses its entry, until it is recorded again.
+
+    Args:
+      name: String name of the exported file, in the export directory
+      source: String path of the source file
+      state: Tuple (size, mtime) of the source, from SourceState
+      mode: String how the file is exported, i.e. "copy"
+
+    Returns:
+      Boolean True if the file is up to date, False otherwise
+    """
+    self.__lock.acquire()
+    try:
+      entry = self.__previous.pop(name, None)
+      if (state and name in self.__present and
+          entry == (source, state[0], state[1], mode)):
+        self.__current[name] = entry
+        return True
+      return False
+    finally:
+      self.__lock.release()
+
+  def Record(self, name=None, source=None, state=None, mode=None):
+    """ Records an exported file.
+
+    Args:
+      name: String name of the exported file, in the export directory
+      source: String path of the source file
+      state: Tuple (size, mtime) of the source, from before it was exported;
+          None if the source cannot be read, which does not record the file
+      mode: String how the file was exported, i.e. "copy"
+    """
+    if state:
+      self.__lock.acquire()
+      try:
+        self.__current[name] = (source, state[0], state[1], mode)
+      finally:
+        self.__lock.release()
+
+  def Save(self):
+    """ Saves the manifest for the next run.
+
+    Entries of the previous run which were not exported again are kept, if
+    their file is still in the export directory (i.e. files of images which
+    did not change in an incremental run).  A manifest which cannot be written
+    only causes a warning; every file is exported again on the next run.
+    """
+    self.__lock.acquire()
+    try:
+      files = dict([(name, entry) for name, entry in
+                    self.__previous.iteritems() if name in self.__present])
+      files.update(self.__current)
+      libraries = dict(self.__libraries)
+    finally:
+      self.__lock.release()
+    try:
+      manifest_file = open(self.__manifest_file + ".tmp", 'wb')
+      try:
+        cPickle.dump({'format':self.__MANIFEST_FORMAT,
+                      'libraries':libraries,
+                      'files':files},
+                     manifest_file, cPickle.HIGHEST_PROTOCOL)
+      finally:
+        manifest_file.close()
+      os.rename(self.__manifest_file + ".tmp", self.__manifest_file)
+    except EnvironmentError, e:
+      print ("%(warn)sSave] Cannot write manifest %(file)s: %(error)s" %
+             {'warn':self.__WARNING_INFO,
+              'file':self.__manifest_file,
+              'error':e})
+      return
+    if __debug__:
+      print ("%(debug)sSave] Saved %(count)s manifest entries." %
+             {'debug':self.__DEBUG_INFO,'count':len(files)})
+
+
+
+if __name__ == "__main__":
+  import shutil
+  import tempfile
+  print "Testing ExportManifest Class...\n"
+  export_path = tempfile.mkdtemp(prefix="exhibit_")
+  source = os.path.join(export_path, "source.jpg")
+  open(source, 'w').write("image")
+  print "-->Test new files are not up to date:"
+  manifest = ExportManifest(export_path)
+  state = manifest.SourceState(source)
+  if not manifest.IsCurrent("1T.jpg", source, state, "copy"):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  shutil.copy(source, os.path.join(export_path, "1T.jpg"))
+  manifest.Record("1T.jpg", source, state, "copy")
+  manifest.Save()
+  print "-->Test exported files are up to date on the next run:"
+  manifest = ExportManifest(export_path)
+  if (manifest.IsCurrent("1T.jpg", source, manifest.SourceState(source),
+                         "copy") and
+      not manifest.IsCurrent("2T.jpg", source, manifest.SourceState(source),
+                             "copy")):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  manifest.Save()
+  print "-->Test changed sources and modes are not up to date:"
+  manifest = ExportManifest(export_path)
+  if not manifest.IsCurrent("1T.jpg", source, manifest.SourceState(source),
+                            "link"):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  manifest = ExportManifest(export_path)
+  open(source, 'a').write("edited")
+  if not manifest.IsCurrent("1T.jpg", source, manifest.SourceState(source),
+                            "copy"):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test library IDs are cached:"
+  manifest = ExportManifest(export_path)
+  manifest.SetLibraryId("/Pictures/iPhoto Library", 1234, 7)
+  manifest.Save()
+  if (ExportManifest(export_path).LibraryId("/Pictures/iPhoto Library",
+                                            "1234") == 7 and
+      not ExportManifest(export_path).LibraryId("/Other Library", 1234)):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test removed files are not up to date:"
+  manifest.Record("1T.jpg", source, manifest.SourceState(source), "copy")
+  manifest.Save()
+  os.remove(os.path.join(export_path, "1T.jpg"))
+  manifest = ExportManifest(export_path)
+  if not manifest.IsCurrent("1T.jpg", source, manifest.SourceState(source),
+                            "copy"):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  shutil.rmtree(export_path)
+  print "\n\nTesting completeled successfully!\n\n"
@@ -0,0 +1,296 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+#
+# Copyright 2008, Robert Pufky
+# Exhibit - library change detection Class
+#
+""" Detects changes in an iPhoto Library since the last Exhibit run
+
+A snapshot of the library is kept after every successful run.  It holds a
+fingerprint (MD5 digest) of every image, album and roll, the keywords, and the
+image keyword, album image and album filter memberships.  Comparing the current
+library against it gives a change set, so only changed data has to be sent to
+the SQL server and exported.
+
+The snapshot records which SQL database it was uploaded to; a snapshot for a
+different database (or library) is ignored, and a full import is needed.
+
+Functional Notes:
+  The snapshot must be taken from a freshly loaded AlbumData, before it is
+  prepared for the database by ProcessData.
+
+Testing:
+  This module can be tested by running this file from the command line, with an
+  existing AlbumData.xml file in the same (current) directory.
+
+Debugging:
+  Removing the optimization flag (-OO) from this file will turn debugging on.
+
+Attributes:
+  Class LibraryDiff: Compares an AlbumData against the previous snapshot
+"""
+__author__ = "Robert Pufky (github.com/r-pufky)"
+import os
+import sys
+import cPickle
+import hashlib
+
+
+
+class LibraryDiff(object):
+  """ Compares an AlbumData against the snapshot of the previous run.
+
+  Attributes:
+    changes: Dictionary change set; None if there is no usable snapshot
+    Save(): Saves the current library as the snapshot for the next run
+
+  Change set dictionary:
+    images, albums, rolls, keywords: Dictionary of sets of IDs
+        {'added', 'modified', 'deleted'}
+    image_keywords: Dictionary of sets of (ImageID, KeywordID) tuples
+        {'added', 'deleted'}
+    album_images: Dictionary of sets of (AlbumID, ImageID) tuples
+        {'added', 'deleted'}
+    filters: Dictionary of lists of (AlbumID, Count, Operation, Type) tuples
+        {'added', 'deleted'}; every filter of an album whose filters changed
+        is deleted and added again
+
+    i.e.:
+      {'images':{'added':set([4]), 'modified':set([1]), 'deleted':set()},
+       'albums':{...},
+       'rolls':{...},
+       'keywords':{...},
+       'image_keywords':{'added':set([(4, '2')]), 'deleted':set()},
+       'album_images':{'added':set([(1, '4')]), 'deleted':set()},
+       'filters':{'added':[], 'deleted':[]}}
+  """
+  __author__ = "Robert Pufky (github.com/r-pufky)"
+  __version__ = "1.0"
+
+  def __init__(self, album_data=None, snapshot_file=None, target=None):
+    """ Takes a snapshot of the library and compares it to the previous one.
+
+    Args:
+      album_data: AlbumData object, before it is prepared by ProcessData
+      snapshot_file: String path of the snapshot of the previous run
+      target: String identifying the SQL database the library is uploaded to
+
+    Kills:
+      sys.exit: Invalid arguments
+    """
+    self.__DEBUG_INFO = "DEBUG:[LibraryDiff."
+    self.__WARNING_INFO = "WARNING:[LibraryDiff."
+    self.__SNAPSHOT_FORMAT = 1
+    self.__EXCLUDED_FIELDS = ('Keywords', 'KeyList', 'Filters')
+    if not album_data:
+      sys.exit("%(debug)s__init__] AlbumData not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    if not snapshot_file:
+      sys.exit("%(debug)s__init__] Snapshot file not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    self.__snapshot_file = os.path.expanduser(snapshot_file)
+    self.__snapshot = self.__TakeSnapshot(album_data, target)
+    self.changes = None
+    previous = self.__LoadSnapshot()
+    if previous:
+      self.changes = self.__Compare(previous, self.__snapshot)
+
+  def __Fingerprint(self, record=None):
+    """ Computes the fingerprint of an image, album or roll.
+
+    Membership lists (Keywords, KeyList, Filters) are compared separately, and
+    are not part of the fingerprint.
+
+    Args:
+      record: Dictionary (or record) to fingerprint
+
+    Returns:
+      String 16 byte MD5 digest of the record's values
+    """
+    items = [item for item in record.items()
+             if item[0] not in self.__EXCLUDED_FIELDS]
+    items.sort()
+    return hashlib.md5(repr(items)).digest()
+
+  def __TakeSnapshot(self, album_data=None, target=None):
+    """ Builds the snapshot of a library.
+
+    Args:
+      album_data: AlbumData object to take the snapshot of
+      target: String identifying the SQL database the library is uploaded to
+
+    Returns:
+      A dictionary snapshot of the library
+    """
+    snapshot = {'format':self.__SNAPSHOT_FORMAT,
+                'library':(album_data.properties['Path'],
+                           album_data.properties['ArchiveID'],
+                           target),
+                'images':{},
+                'albums':{},
+                'rolls':{},
+                'keywords':dict(album_data.properties['Keywords']),
+                'image_keywords':set(),
+                'album_images':set(),
+                'filters':{}}
+    for image_key, image in album_data.IterImages():
+      snapshot['images'][image_key] = self.__Fingerprint(image)
+      for keyword in image.get('Keywords', []):
+        snapshot['image_keywords'].add((image_key, keyword))
+    for album_key, album in album_data.IterAlbums():
+      snapshot['albums'][album_key] = self.__Fingerprint(album)
+      for image in album.get('KeyList', []):
+        snapshot['album_images'].add((album_key, image))
+      snapshot['filters'][album_key] = [
+          (album_key, filter['Count'], filter['Operation'], filter['Type'])
+          for filter in album.get('Filters', [])]
+    for roll_key, roll in album_data.IterRolls():
+      snapshot['rolls'][roll_key] = self.__Fingerprint(roll)
+    return snapshot
+
+  def __LoadSnapshot(self):
+    """ Loads the snapshot of the previous run.
+
+    Returns:
+      The previous snapshot dictionary; None if it does not exist, cannot be
+      read, or is for another library or database
+    """
+    if not os.path.exists(self.__snapshot_file):
+      return None
+    try:
+      snapshot_file = open(self.__snapshot_file, 'rb')
+      try:
+        previous = cPickle.load(snapshot_file)
+      finally:
+        snapshot_file.close()
+    except Exception, e:
+      print ("%(warn)s__LoadSnapshot] Cannot read snapshot %(file)s: %(error)s"
+             % {'warn':self.__WARNING_INFO,
+                'file':self.__snapshot_file,
+                'error':e})
+      return None
+    if (previous.get('format') != self.__SNAPSHOT_FORMAT or
+        previous.get('library') != self.__snapshot['library']):
+      print ("%s__LoadSnapshot] Snapshot is for another library or database, "
+             "ignoring it." % self.__WARNING_INFO)
+      return None
+    return previous
+
+  def __CompareKeyed(self, previous=None, current=None):
+    """ Compares two dictionaries of ID to fingerprint (or value).
+
+    Args:
+      previous: Dictionary from the previous snapshot
+      current: Dictionary from the current snapshot
+
+    Returns:
+      A dictionary of sets of IDs {'added', 'modified', 'deleted'}
+    """
+    changes = {'added':set(), 'modified':set(), 'deleted':set()}
+    for key in current:
+      if key not in previous:
+        changes['added'].add(key)
+      elif previous[key] != current[key]:
+        changes['modified'].add(key)
+    for key in previous:
+      if key not in current:
+        changes['deleted'].add(key)
+    return changes
+
+  def __Compare(self, previous=None, current=None):
+    """ Builds the change set between two snapshots.
+
+    Args:
+      previous: Dictionary snapshot of the previous run
+      current: Dictionary snapshot of the current library
+
+    Returns:
+      A dictionary change set, see class documentation
+    """
+    changes = {}
+    for section in ('images', 'albums', 'rolls', 'keywords'):
+      changes[section] = self.__CompareKeyed(previous[section],
+                                             current[section])
+    for section in ('image_keywords', 'album_images'):
+      changes[section] = {'added':current[section] - previous[section],
+                          'deleted':previous[section] - current[section]}
+    changes['filters'] = {'added':[], 'deleted':[]}
+    for album_key in set(previous['filters']) | set(current['filters']):
+      if (previous['filters'].get(album_key) !=
+          current['filters'].get(album_key)):
+        changes['filters']['deleted'].extend(
+            previous['filters'].get(album_key, []))
+        changes['filters']['added'].extend(
+            current['filters'].get(album_key, []))
+    if __debug__:
+      for section in changes:
+        print ("%(debug)s__Compare] %(section)s: %(changes)s" %
+               {'debug':self.__DEBUG_INFO,
+                'section':section,
+                'changes':dict([(change, len(changes[section][change]))
+                                for change in changes[section]])})
+    return changes
+
+  def Save(self):
+    """ Saves the current library as the snapshot for the next run.
+
+    This should only be run once the changes were uploaded successfully.
+
+    Kills:
+      sys.exit: Snapshot cannot be written
+    """
+    try:
+      snapshot_directory = os.path.dirname(self.__snapshot_file)
+      if snapshot_directory and not os.path.exists(snapshot_directory):
+        os.makedirs(snapshot_directory, 0700)
+      snapshot_file = open(self.__snapshot_file + ".tmp", 'wb')
+      try:
+        cPickle.dump(self.__snapshot, snapshot_file, cPickle.HIGHEST_PROTOCOL)
+      finally:
+        snapshot_file.close()
+      os.rename(self.__snapshot_file + ".tmp", self.__snapshot_file)
+    except EnvironmentError, e:
+      sys.exit("%(debug)sSave] Cannot write snapshot %(file)s: %(error)s" %
+               {'debug':self.__DEBUG_INFO,
+                'file':self.__snapshot_file,
+                'error':e})
+
+
+
+if __name__ == "__main__":
+  import album_data
+  print "Testing LibraryDiff Class...\n"
+  print "-->Test snapshot of an unchanged library:"
+  Album = album_data.AlbumData(iphoto_library="AlbumData.xml")
+  if os.path.exists("/tmp/exhibit_test_snapshot"):
+    os.remove("/tmp/exhibit_test_snapshot")
+  diff = LibraryDiff(album_data=Album,
+                     snapshot_file="/tmp/exhibit_test_snapshot")
+  if diff.changes is None:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  diff.Save()
+  diff = LibraryDiff(album_data=Album,
+                     snapshot_file="/tmp/exhibit_test_snapshot")
+  changed = 0
+  for section in diff.changes:
+    for change in diff.changes[section]:
+      changed += len(diff.changes[section][change])
+  if not changed:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test changed library:"
+  image_key = Album.images.keys()[0]
+  Album.images[image_key]['Rating'] = -1
+  del Album.images[Album.images.keys()[1]]
+  diff = LibraryDiff(album_data=Album,
+                     snapshot_file="/tmp/exhibit_test_snapshot")
+  if (diff.changes['images']['modified'] == set([image_key]) and
+      len(diff.changes['images']['deleted']) == 1):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  os.remove("/tmp/exhibit_test_snapshot")
+  print "\n\nTesting completeled successfully!\n\n"
@@ -0,0 +1,287 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+#
+# Copyright 2008, Robert Pufky
+# Exhibit - compact iPhoto library record Classes
+#
+""" Compact record types for iPhoto library images, albums and rolls
+
+A library holds tens of thousands of images, each of which was stored as a dict
+with around twenty keys.  Most of that memory was dict overhead.  The records
+here keep every known field in a __slots__ attribute instead, and behave like
+the dictionaries they replace (record['GUID'], 'Keywords' in record, del,
+keys(), items(), dict(record)...), so code written against dicts keeps working.
+
+Keys which are not a known field of the record are kept in a small per-record
+dictionary, which is only created when such a key is stored.
+
+Testing:
+  This module can be tested by running this file from the command line.  This
+  also runs a memory comparison between dicts and records, for a synthetic
+  library of 20,000 images.
+
+Attributes:
+  Class Record: Dictionary-like record base class
+  Class ImageRecord: An image from the Master Image List
+  Class AlbumRecord: An album from the List of Albums
+  Class RollRecord: A roll from the List of Rolls
+"""
+__author__ = "Robert Pufky (github.com/r-pufky)"
+import sys
+
+
+
+class Record(object):
+  """ Dictionary-like record storing known fields in __slots__.
+
+  Subclasses set FIELDS to the ordered tuple of known keys, __slots__ to the
+  same tuple, and INTERNED to the fields whose string values repeat across the
+  library (these are interned to share a single copy).
+
+  Attributes:
+    keys(): List of keys set in the record, known fields first
+    values(): List of values, in the same order as keys()
+    items(): List of (key, value) tuples, in the same order as keys()
+    get(): Returns the value of a key, or a default
+    update(): Stores all key/value pairs of a dictionary
+  """
+  __author__ = "Robert Pufky (github.com/r-pufky)"
+  __version__ = "1.0"
+  __slots__ = ('_extra',)
+  FIELDS = ()
+  INTERNED = ()
+
+  def __init__(self, values=None):
+    """ Initializes a record from a dictionary.
+
+    Args:
+      values: Dictionary key/value pairs to store in the record
+    """
+    self._extra = None
+    if values:
+      self.update(values)
+
+  def __Intern(self, value=None):
+    """ Interns a string, or the strings of a list.
+
+    Args:
+      value: String or list of strings to intern
+
+    Returns:
+      The interned string or list; other values are returned unchanged
+    """
+    if isinstance(value, str):
+      return intern(value)
+    if isinstance(value, list):
+      return [self.__Intern(item) for item in value]
+    return value
+
+  def __getitem__(self, key):
+    if key in self._FIELD_SET:
+      try:
+        return getattr(self, key)
+      except AttributeError:
+        raise KeyError(key)
+    if self._extra and key in self._extra:
+      return self._extra[key]
+    raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    if key in self._FIELD_SET:
+      if key in self.INTERNED:
+        value = self.__Intern(value)
+      setattr(self, key, value)
+    else:
+      if self._extra is None:
+        self._extra = {}
+      self._extra[key] = value
+
+  def __delitem__(self, key):
+    if key in self._FIELD_SET:
+      try:
+        delattr(self, key)
+      except AttributeError:
+        raise KeyError(key)
+    elif self._extra and key in self._extra:
+      del self._extra[key]
+    else:
+      raise KeyError(key)
+
+  def __contains__(self, key):
+    if key in self._FIELD_SET:
+      return hasattr(self, key)
+    return bool(self._extra) and key in self._extra
+
+  has_key = __contains__
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def __eq__(self, other):
+    if isinstance(other, (Record, dict)):
+      return dict(self.items()) == dict(other.items())
+    return NotImplemented
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    if result is NotImplemented:
+      return result
+    return not result
+
+  __hash__ = None
+
+  def __repr__(self):
+    return "%s(%r)" % (self.__class__.__name__, dict(self.items()))
+
+  def __getstate__(self):
+    return self.items()
+
+  def __setstate__(self, state):
+    self._extra = None
+    for key, value in state:
+      self[key] = value
+
+  def keys(self):
+    """ Returns a list of keys set in the record, known fields first. """
+    keys = [field for field in self.FIELDS if hasattr(self, field)]
+    if self._extra:
+      keys.extend(self._extra.keys())
+    return keys
+
+  def values(self):
+    """ Returns a list of values, in the same order as keys(). """
+    return [self[key] for key in self.keys()]
+
+  def items(self):
+    """ Returns a list of (key, value) tuples, in the same order as keys(). """
+    return [(key, self[key]) for key in self.keys()]
+
+  def iteritems(self):
+    """ Iterates over (key, value) tuples, in the same order as keys(). """
+    return iter(self.items())
+
+  def get(self, key, default=None):
+    """ Returns the value of a key, or default if the key is not set.
+
+    Args:
+      key: String key to retrieve
+      default: Value to return if key is not set
+    """
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def update(self, values=None):
+    """ Stores all key/value pairs of a dictionary (or record).
+
+    Args:
+      values: Dictionary key/value pairs to store
+    """
+    fields = self._FIELD_SET
+    interned = self.INTERNED
+    for key, value in values.iteritems():
+      if key in fields and key not in interned:
+        setattr(self, key, value)
+      else:
+        self[key] = value
+
+
+
+class ImageRecord(Record):
+  """ An image from iPhoto's Master Image List; see AlbumData for fields. """
+  FIELDS = ('iPhotoLibraryID', 'ImageID', 'GUID', 'RollID', 'Rating',
+            'Comment', 'Caption', 'MediaType', 'AspectRatio',
+            'RotationIsOnlyEdit', 'OriginalDate', 'OriginalDateAsAppleTimer',
+            'ModifiedDate', 'ModifiedDateAsAppleTimer', 'ImportDate',
+            'ImportDateAsAppleTimer', 'ThumbPath', 'ImagePath', 'OriginalPath',
+            'Keywords', 'Fingerprint')
+  INTERNED = ('MediaType', 'Keywords')
+  _FIELD_SET = frozenset(FIELDS)
+  __slots__ = FIELDS
+
+
+
+class AlbumRecord(Record):
+  """ An album from iPhoto's List of Albums; see AlbumData for fields. """
+  FIELDS = ('iPhotoLibraryID', 'AlbumID', 'AlbumName', 'AlbumType',
+            'FilterMode', 'Master', 'GUID', 'PhotoCount', 'PlayMusic',
+            'RepeatSlideShow', 'SecondsPerSlide', 'SlideShowUseTitles',
+            'SongPath', 'TransitionDirection', 'TransitionName',
+            'TransitionSpeed', 'PanAndZoom', 'ShuffleSlides', 'KeyList',
+            'Filters', 'Fingerprint')
+  INTERNED = ('AlbumType', 'FilterMode', 'TransitionName', 'SongPath',
+              'KeyList')
+  _FIELD_SET = frozenset(FIELDS)
+  __slots__ = FIELDS
+
+
+
+class RollRecord(Record):
+  """ A roll from iPhoto's List of Rolls; see AlbumData for fields. """
+  FIELDS = ('iPhotoLibraryID', 'RollID', 'RollName', 'PhotoCount', 'KeyPhoto',
+            'RollDate', 'RollDateAsAppleTimer', 'KeyList', 'Fingerprint')
+  INTERNED = ('KeyList',)
+  _FIELD_SET = frozenset(FIELDS)
+  __slots__ = FIELDS
+
+
+
+def _ContainerSize(container=None):
+  """ Returns the bytes used by a dict or record, excluding shared values. """
+  size = sys.getsizeof(container)
+  if isinstance(container, Record) and container._extra:
+    size += sys.getsizeof(container._extra)
+  return size
+
+
+
+if __name__ == "__main__":
+  print "Testing LibraryRecords Classes...\n"
+  print "-->Test dictionary behaviour:"
+  image = ImageRecord({'ImageID':1, 'GUID':"ABC", 'Unknown Key':2})
+  image['Keywords'] = ['1', '2']
+  del image['GUID']
+  if (image['ImageID'] == 1 and 'GUID' not in image and
+      image.get('Unknown Key') == 2 and
+      dict(image) == {'ImageID':1, 'Unknown Key':2, 'Keywords':['1', '2']}):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test pickling:"
+  import cPickle
+  if cPickle.loads(cPickle.dumps(image, cPickle.HIGHEST_PROTOCOL)) == image:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Memory comparison, 20000 images (container overhead only):"
+  dicts = []
+  records = []
+  for image_id in xrange(20000):
+    image = {'iPhotoLibraryID':1, 'ImageID':image_id,
+             'GUID':"%036d" % image_id, 'RollID':image_id % 100,
+             'Rating':3, 'Comment':"", 'Caption':"IMG_%d" % image_id,
+             'MediaType':"Image", 'AspectRatio':1.5,
+             'RotationIsOnlyEdit':False, 'OriginalDate':1172814275,
+             'OriginalDateAsAppleTimer':194507075.3,
+             'ModifiedDate':1185143002, 'ModifiedDateAsAppleTimer':206835802.2,
+             'ImportDate':1209069601, 'ImportDateAsAppleTimer':230762401.3,
+             'ThumbPath':"/Data/%d.jpg" % image_id,
+             'ImagePath':"/Modified/%d.jpg" % image_id,
+             'OriginalPath':"/Originals/%d.jpg" % image_id,
+             'Keywords':['1', '2']}
+    dicts.append(image)
+    records.append(ImageRecord(image))
+  dict_size = sum([_ContainerSize(container) for container in dicts])
+  record_size = sum([_ContainerSize(container) for container in records])
+  print "dict images:   %10d bytes" % dict_size
+  print "record images: %10d bytes (%d%% of dict)" % (
+      record_size, record_size * 100 / dict_size)
+  if record_size < dict_size:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "\n\nTesting completeled successfully!\n\n"
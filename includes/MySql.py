@@ -11,12 +11,33 @@ with a MySQL database.  Nuances from generic SQL commands to MySQL commands are
 dealth with automatically in this class.  Your MySQL server MUST SUPPORT UTF8,
 otherwise execution will be halted on unsupported characters.
 
+Statements:
+  Values are never written into SQL text by hand; they are bound to statement
+  placeholders and escaped by MySQLdb, for the connection's UTF8 character set.
+  The SQL text of each statement shape (statement, table and columns) is built
+  once and cached, so repeated Insert, Update, Select and Delete calls only
+  bind new values.
+
 MySQL Setup Notes:
   MySQL is not included with python, which means you will have to install it on
   your system for this class to work.  If you are receiving MySQLdb import 
   errors, read the documentation at docs/mysql_setup.txt for information on how 
   to setup this module.
 
+Transactions:
+  Autocommit is disabled.  Changes are committed by Commit(), by CommitIfDue()
+  once the interval set with SetCommitInterval() has passed, and by Close().
+
+Reconnecting:
+  Statements failing because the connection was lost, timed out or deadlocked
+  are retried with exponential backoff, on a new connection.  The statements
+  written since the last commit are kept in a journal, and replayed on the new
+  connection before the failed statement is retried, so no uncommitted change
+  is lost or applied twice.  A failed commit is not retried, as it cannot be
+  known whether the server committed it.  The journal is kept below 64MB by
+  committing early, so a large load is neither held in memory nor replayed
+  whole.
+
 Warnings:
   MySQLdb warnings are disabled, as we are catching them.  Removing this filter
   will make your output *much* more spewy.  This can be done by inserting the
@@ -38,8 +59,12 @@ Attributes:
   Class MySql: Provides a MySQL interface for Exhibit
 """
 __author__ = "Robert Pufky (github.com/r-pufky)"
+import os
 import sys
+import time
+import tempfile
 import MySQLdb
+import MySQLdb.cursors
 import warnings
 warnings.filterwarnings("ignore",".*")
 
@@ -54,15 +79,28 @@ class MySql(object):
   
   Attributes:
     Close(): Closes the SQL connection if opened
+    Fork(): Opens another connector to the same database
+    Ping(): Checks the connection, reconnecting if it was lost
+    SetCommitInterval(): Sets how often CommitIfDue commits
+    Commit(): Commits the open transaction
+    CommitIfDue(): Commits the open transaction if the commit interval passed
     CheckTableExists(): Checks if a given table exists in the database
     ResetTable(): Clears out all table rows
     CreateTable(): Creates a SQL table in the database
     EncodeString(): Escapes special DB characters, and encodes string to UTF8
     DatabaseCheck(): Checks to see if Exhibit tables exist in the database
+    BeginRebuild(): Starts rebuilding the database into staging tables
+    FinishRebuild(): Swaps the rebuilt staging tables in, atomically
     Insert(): Inserts a new row into a database table
+    InsertMany(): Inserts many new rows, in multi-row statements
+    BulkInsert(): Loads many new rows from a spool file (LOAD DATA INFILE)
+    UpsertMany(): Inserts or updates many rows, in multi-row statements
     Update(): Updates (or creates) a row in a database table
     Select(): Selects row(s) from a database table
+    SelectIter(): Selects rows from a database table, streamed as they are read
+    SelectKeys(): Selects the keys of all matching rows, streamed
     Delete(): Deletes a matched row from a database table
+    DeleteMany(): Deletes many matched rows, in multi-row statements
   """
   __author__ = "Robert Pufky (github.com/r-pufky)"
   __version__ = "1.0"
@@ -70,8 +108,8 @@ class MySql(object):
   def __init__(self, connection=None):
     """ Initializes and stores MySQL database connection to a server.
     
-    Information passed to initalize the connection is not stored in the object 
-    except for the table prepend information.  The database specified is 
+    Information passed to initalize the connection is kept in the object, to
+    reconnect and to fork new connectors.  The database specified is 
     automatically populated with the exhibit database schema - it is not 
     over-written if it already exists.
     
@@ -87,26 +125,151 @@ class MySql(object):
       sys.exit: Bad connection attempts
     """
     self.__db = None
+    self.__cursor = None
+    self.__connection = None
     self.__prepend = None
     self.__DEBUG_INFO = "DEBUG:[MySql."
     self.__WARNING_INFO = "WARNING:[MySql."
     self.__RETURN_ALL_ROWS = 0
     self.__RETURN_DICT_FORMAT = 1
     self.__DB_ESCAPE_CHARS = ['"','%']
+    self.__DEFAULT_PACKET_SIZE = 1048576
+    self.__PACKET_MARGIN = 1024
+    self.__max_statement_size = None
+    self.__FETCH_BATCH_SIZE = 1000
+    self.__SPOOL_ESCAPES = (("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"),
+                            ("\r", "\\r"), ("\0", "\\0"))
+    self.__bulk_load = True
+    self.__commit_rows = 0
+    self.__commit_seconds = 0
+    self.__uncommitted_rows = 0
+    self.__last_commit = time.time()
+    self.__STAGING_PREPEND = "new_"
+    self.__RETIRED_PREPEND = "old_"
+    self.__UNSTAGED_TABLES = ("iPhotoLibrary",)
+    self.__staging = False
+    # statement templates, completed by __Statement; %(values)s, %(set)s and
+    # %(where)s are lists of placeholders for the bound values
+    self.__INSERT = "INSERT INTO %(table)s (%(columns)s) VALUES (%(values)s)"
+    self.__UPDATE = "UPDATE %(table)s SET %(set)s WHERE %(where)s LIMIT 1"
+    self.__SELECT = "SELECT %(columns)s FROM %(table)s WHERE %(where)s"
+    self.__SELECT_ALL = "SELECT %(columns)s FROM %(table)s"
+    self.__DELETE = "DELETE FROM %(table)s WHERE %(where)s LIMIT 1"
+    self.__VALUES = "(%(values)s)"
+    self.__statements = {}
+    # lock wait timeout, deadlock, cannot connect, server has gone away, lost
+    # connection during query, lost connection
+    self.__RETRY_ERRORS = (1205, 1213, 2003, 2006, 2013, 2055)
+    self.__RETRIES = 5
+    self.__RETRY_DELAY = 1.0
+    self.__MAX_RETRY_DELAY = 30.0
+    # uncommitted statements are kept for replay up to this size (bytes of
+    # statement text and bound values); the transaction is committed early
+    # once it is exceeded
+    self.__MAX_JOURNAL_BYTES = 64 * 1024 * 1024
+    self.__journal = []
+    self.__journal_bytes = 0
+    self.__spools = []
+    # Exhibit tables, in creation order: (table, columns, primary key)
+    self.__TABLES = (
+        ("iPhotoLibrary",
+         "ID INT NOT NULL AUTO_INCREMENT, "
+         "ArchiveID INT NOT NULL, "
+         "Path TEXT NOT NULL, "
+         "iPhotoVersion VARCHAR(255) DEFAULT '', "
+         "MajorVersion INT DEFAULT 0, "
+         "MinorVersion INT DEFAULT 0",
+         "ID, ArchiveID, Path(255)"),
+        ("Albums",
+         "iPhotoLibraryID INT NOT NULL, "
+         "AlbumID INT NOT NULL, "
+         "AlbumName VARCHAR(255) DEFAULT '', "
+         "AlbumType VARCHAR(255) DEFAULT '', "
+         "FilterMode VARCHAR(255) DEFAULT '', "
+         "Master BOOL DEFAULT 0, "
+         "GUID VARCHAR(36) DEFAULT '', "
+         "PhotoCount INT DEFAULT 0, "
+         "PlayMusic BOOL DEFAULT 0, "
+         "RepeatSlideShow BOOL DEFAULT 0, "
+         "SecondsPerSlide INT DEFAULT 0, "
+         "SlideShowUseTitles BOOL DEFAULT 0, "
+         "SongPath TEXT, "
+         "TransitionDirection TINYINT DEFAULT 0, "
+         "TransitionName VARCHAR(255) DEFAULT 'Dissolve', "
+         "TransitionSpeed FLOAT DEFAULT 0.0, "
+         "PanAndZoom BOOL DEFAULT 0, "
+         "ShuffleSlides BOOL DEFAULT 0, "
+         "Fingerprint CHAR(32) DEFAULT ''",
+         "iPhotoLibraryID, AlbumID"),
+        ("Rolls",
+         "iPhotoLibraryID INT NOT NULL, "
+         "RollID INT NOT NULL, "
+         "RollName VARCHAR(255) DEFAULT '', "
+         "PhotoCount INT DEFAULT 0, "
+         "KeyPhoto INT DEFAULT 0, "
+         "RollDate DATETIME DEFAULT 0, "
+         "RollDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "Fingerprint CHAR(32) DEFAULT ''",
+         "iPhotoLibraryID, RollID"),
+        ("Images",
+         "iPhotoLibraryID INT NOT NULL, "
+         "GUID VARCHAR(36) NOT NULL, "
+         "RollID INT DEFAULT 0, "
+         "ImageID INT NOT NULL, "
+         "Rating TINYINT DEFAULT 0, "
+         "Comment VARCHAR(255) DEFAULT '', "
+         "Caption VARCHAR(255) DEFAULT '', "
+         "MediaType VARCHAR(20) DEFAULT '', "
+         "AspectRatio FLOAT DEFAULT 0.0, "
+         "RotationIsOnlyEdit BOOL DEFAULT 0, "
+         "OriginalDate DATETIME DEFAULT 0, "
+         "OriginalDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "ModifiedDate DATETIME DEFAULT 0, "
+         "ModifiedDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "ImportDate DATETIME DEFAULT 0, "
+         "ImportDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "ThumbPath TEXT, "
+         "ImagePath TEXT, "
+         "OriginalPath TEXT, "
+         "Fingerprint CHAR(32) DEFAULT ''",
+         "iPhotoLibraryID, ImageID"),
+        ("Filters",
+         "iPhotoLibraryID INT NOT NULL, "
+         "AlbumID INT NOT NULL, "
+         "Count INT DEFAULT 0, "
+         "Operation VARCHAR(255) DEFAULT '', "
+         "Type VARCHAR(255) DEFAULT ''",
+         None),
+        ("Keywords",
+         "KeywordID INT NOT NULL, "
+         "iPhotoLibraryID INT NOT NULL, "
+         "Keyword VARCHAR(255) DEFAULT ''",
+         "KeywordID, iPhotoLibraryID"),
+        ("ImageKeywords",
+         "iPhotoLibraryID INT NOT NULL, "
+         "ImageID INT NOT NULL, "
+         "KeywordID INT NOT NULL",
+         None),
+        ("AlbumImages",
+         "iPhotoLibraryID INT NOT NULL, "
+         "AlbumID INT NOT NULL, "
+         "ImageID INT NOT NULL",
+         None),
+        ("Checkpoints",
+         "iPhotoLibraryID INT NOT NULL, "
+         "TableName VARCHAR(64) NOT NULL, "
+         "LastKey VARCHAR(255) DEFAULT ''",
+         "iPhotoLibraryID, TableName"))
     if not connection:
       sys.exit("%(debug)s__init__] MySQL connection information not provided!" %
                {'debug':self.__DEBUG_INFO})
     if __debug__:
       print ("%(debug)s__init__] MySQL connection information: %(connection)s" %
              {'debug':self.__DEBUG_INFO,'connection':connection})
+    self.__connection = dict(connection)
+    self.__prepend = connection['prepend']
     try:
-      self.__db = MySQLdb.connect(host=connection['address'],
-                                  user=connection['username'],
-                                  passwd=connection['password'],
-                                  db=connection['database'])
-      self.__db.query("SET NAMES UTF8")
-      self.__prepend = connection['prepend']
-      del connection
+      self.__Connect()
       if __debug__:
         print ("%(debug)s__init__] MySQL connection created successfully!" % 
                {'debug':self.__DEBUG_INFO})
@@ -124,14 +287,225 @@ class MySql(object):
     """ Closes the SQL connection if opened. """
     if self.__db:
       self.__db.commit()
+      self.__ClearJournal()
       if __debug__:
         print ("%(debug)sClose] Committed database changes." % 
                {'debug':self.__DEBUG_INFO})
       self.__db.close()
+      self.__db = None
       if __debug__:
         print ("%(debug)sClose] Closed database connection." % 
                {'debug':self.__DEBUG_INFO})
 
+  def __Connect(self):
+    """ Opens the connection to the server.
+
+    Raises:
+      MySQLdb.Error: Connection failed
+    """
+    self.__db = MySQLdb.connect(host=self.__connection['address'],
+                                user=self.__connection['username'],
+                                passwd=self.__connection['password'],
+                                db=self.__connection['database'],
+                                charset="utf8",
+                                use_unicode=False,
+                                local_infile=1)
+    self.__db.autocommit(False)
+    self.__cursor = self.__db.cursor()
+
+  def __Reconnect(self):
+    """ Opens a new connection, and replays the uncommitted statements on it.
+
+    Raises:
+      MySQLdb.Error: Connection or replay failed
+    """
+    try:
+      self.__db.close()
+    except MySQLdb.Error:
+      pass
+    self.__Connect()
+    if __debug__:
+      print ("%(debug)s__Reconnect] Reconnected, replaying %(count)s "
+             "statements." % {'debug':self.__DEBUG_INFO,
+                              'count':len(self.__journal)})
+    for sql, parameters in self.__journal:
+      self.__cursor.execute(sql, parameters)
+
+  def __Retry(self, operation=None, *args):
+    """ Runs a statement operation, retrying it if the connection fails.
+
+    Lost connections, timeouts and deadlocks are retried with exponential
+    backoff; each retry runs on a new connection, with the journal replayed.
+
+    Args:
+      operation: Method running the statement
+      args: Arguments to pass to operation
+
+    Raises:
+      MySQLdb.Error: Statement failed, or still failed after all retries
+
+    Returns:
+      The value returned by operation
+    """
+    delay = self.__RETRY_DELAY
+    attempt = 0
+    while True:
+      try:
+        if attempt:
+          self.__Reconnect()
+        return operation(*args)
+      except MySQLdb.OperationalError, e:
+        attempt += 1
+        if e.args[0] not in self.__RETRY_ERRORS or attempt > self.__RETRIES:
+          raise
+        print ("%(warn)s__Retry] MySQL ERROR: %(error)s\n"
+               "%(warn)s__Retry] Reconnecting in %(delay)s seconds (retry "
+               "%(attempt)s of %(retries)s)." % {
+               'warn':self.__WARNING_INFO,
+               'error':e,
+               'delay':delay,
+               'attempt':attempt,
+               'retries':self.__RETRIES})
+        time.sleep(delay)
+        delay = min(delay * 2, self.__MAX_RETRY_DELAY)
+
+  def __Write(self, sql=None, parameters=None):
+    """ Executes a statement changing rows, and adds it to the journal.
+
+    If the journal grows past __MAX_JOURNAL_BYTES, the transaction is committed
+    so the journal does not hold (and replay) a whole table of rows; the
+    commit interval cannot be relied on for this, as it may be disabled, and
+    the first load of a table is a single batch.
+
+    Args:
+      sql: String SQL statement, with placeholders for parameters
+      parameters: List of values to bind; None if sql has no placeholders
+
+    Raises:
+      MySQLdb.Error: Statement failed
+    """
+    self.__cursor.execute(sql, parameters)
+    self.__journal.append((sql, parameters))
+    self.__journal_bytes += len(sql)
+    for value in parameters or ():
+      if isinstance(value, basestring):
+        self.__journal_bytes += len(value)
+      else:
+        self.__journal_bytes += 8
+    if self.__journal_bytes > self.__MAX_JOURNAL_BYTES:
+      if __debug__:
+        print ("%(debug)s__Write] Journal holds %(bytes)s bytes, committing "
+               "early." % {'debug':self.__DEBUG_INFO,
+                           'bytes':self.__journal_bytes})
+      self.Commit()
+
+  def __Ping(self):
+    """ Pings the server.
+
+    Raises:
+      MySQLdb.Error: Connection was lost
+    """
+    self.__db.ping()
+
+  def __ClearJournal(self):
+    """ Empties the journal, once its statements are committed. """
+    self.__journal = []
+    self.__journal_bytes = 0
+    for spool_path in self.__spools:
+      if os.path.exists(spool_path):
+        os.remove(spool_path)
+    self.__spools = []
+
+  def Fork(self):
+    """ Opens another connector to the same database, i.e. for a worker thread.
+
+    The new connector has its own connection and transaction, and uses the same
+    commit interval and staging tables.
+
+    Kills:
+      sys.exit: Bad connection attempts
+
+    Returns:
+      A new connector object
+    """
+    connector = self.__class__(connection=self.__connection)
+    connector.SetCommitInterval(self.__commit_rows, self.__commit_seconds)
+    connector.__staging = self.__staging
+    return connector
+
+  def Ping(self):
+    """ Checks the connection, reconnecting if it was lost.
+
+    Uncommitted statements are replayed on the new connection.
+
+    Returns:
+      Boolean True if the connection is usable, False otherwise
+    """
+    try:
+      self.__Retry(self.__Ping)
+      return True
+    except MySQLdb.Error, e:
+      print ("%(warn)sPing] MySQL ERROR: %(error)s" %
+             {'warn':self.__WARNING_INFO,'error':e})
+      return False
+
+  def SetCommitInterval(self, rows=None, seconds=None):
+    """ Sets how often CommitIfDue commits the open transaction.
+
+    Args:
+      rows: Integer rows written between commits; None or 0 to not count rows
+      seconds: Integer seconds between commits; None or 0 to not time commits
+    """
+    self.__commit_rows = rows or 0
+    self.__commit_seconds = seconds or 0
+    if __debug__:
+      print ("%(debug)sSetCommitInterval] Committing every %(rows)s rows or "
+             "%(seconds)s seconds" % {'debug':self.__DEBUG_INFO,
+                                      'rows':self.__commit_rows,
+                                      'seconds':self.__commit_seconds})
+
+  def Commit(self):
+    """ Commits the open transaction.
+
+    Kills:
+      sys.exit: Commit fails on the database
+    """
+    try:
+      self.__db.commit()
+      self.__ClearJournal()
+    except MySQLdb.Error, e:
+      sys.exit("%(debug)sCommit] MySQL ERROR: %(error)s\n"
+               "%(debug)sCommit] MySQL commit failed: %(rows)s rows may not "
+               "have been saved." % {'debug':self.__DEBUG_INFO,
+                           'error':e,
+                           'rows':self.__uncommitted_rows})
+    if __debug__:
+      print ("%(debug)sCommit] Committed %(rows)s rows." %
+             {'debug':self.__DEBUG_INFO,'rows':self.__uncommitted_rows})
+    self.__uncommitted_rows = 0
+    self.__last_commit = time.time()
+
+  def CommitIfDue(self, rows=0):
+    """ Commits the open transaction, if the commit interval has passed.
+
+    Args:
+      rows: Integer rows written since the last call
+
+    Kills:
+      sys.exit: Commit fails on the database
+
+    Returns:
+      Boolean True if the transaction was committed, False otherwise
+    """
+    self.__uncommitted_rows += rows
+    if ((self.__commit_rows and
+         self.__uncommitted_rows >= self.__commit_rows) or
+        (self.__commit_seconds and
+         time.time() - self.__last_commit >= self.__commit_seconds)):
+      self.Commit()
+      return True
+    return False
+
   def CheckTableExists(self, table=None):
     """ Checks to see if a table exists in the database.
     
@@ -190,7 +564,8 @@ class MySql(object):
   def EncodeString(self, string_data=None):
     """ Escapes special DB characters, and encodes string to UTF8.
     
-    This is automatically run before executing any MySQL command.
+    Values passed to Insert, Update, Select, Delete and the other statement
+    methods are bound by MySQLdb instead, and must not be escaped with this.
     
     Args:
       string_data: String data to escape
@@ -213,11 +588,35 @@ class MySql(object):
                  {'debug':self.__DEBUG_INFO,'string':string_data})
     return string_data
   
+  def __AddMissingColumn(self, table=None, column=None, definition=None):
+    """ Adds a column to a table created by an older version of Exhibit.
+
+    Args:
+      table: String table to check (without prepend characters)
+      column: String column name
+      definition: String SQL column definition, i.e. "CHAR(32) DEFAULT ''"
+
+    Raises:
+      MySQLdb.Error: Column check or creation failed
+    """
+    self.__db.query("SHOW COLUMNS FROM %s%s LIKE '%s'" % (self.__prepend, table,
+                                                          column))
+    if self.__db.store_result().fetch_row():
+      return
+    self.__db.query("ALTER TABLE %s%s ADD COLUMN %s %s" % (
+                    self.__prepend, table, column, definition))
+    print ("%(warn)sDatabaseCheck] Added column %(column)s to table "
+           "%(pre)s%(table)s" % {'warn':self.__WARNING_INFO,
+                                'column':column,
+                                'pre':self.__prepend,
+                                'table':table})
+
   def DatabaseCheck(self, force=False):
     """ Checks to see if the database tables for Exhibit exist already.
     
     If they don't exist, they are created.  If the force option is specified, it
-    will drop the tables that exist before re-creating them.
+    will drop the tables that exist before re-creating them.  Columns added in
+    later versions of Exhibit are added to existing tables.
     
     Args:
       force: Boolean True if forcing re-creation of tables (DATA DESTRUCTIVE)
@@ -241,120 +640,153 @@ class MySql(object):
                  "%(debug)sDatabaseCheck] MySQL database error: cannot drop "
                  "tables." % {'debug':self.__DEBUG_INFO,'error':e})
     try:
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %siPhotoLibrary "
-          "(ID INT NOT NULL AUTO_INCREMENT, "
-          "ArchiveID INT NOT NULL, "
-          "Path TEXT NOT NULL, "
-          "iPhotoVersion VARCHAR(255) DEFAULT '', "
-          "MajorVersion INT DEFAULT 0, "
-          "MinorVersion INT DEFAULT 0, "
-          "PRIMARY KEY(ID, ArchiveID, Path(255))) "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='iPhotoLibrary')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sAlbums "
-          "(iPhotoLibraryID INT NOT NULL, "
-          "AlbumID INT NOT NULL, "
-          "AlbumName VARCHAR(255) DEFAULT '', "
-          "AlbumType VARCHAR(255) DEFAULT '', "
-          "FilterMode VARCHAR(255) DEFAULT '', "
-          "Master BOOL DEFAULT 0, "
-          "GUID VARCHAR(36) DEFAULT '', "
-          "PhotoCount INT DEFAULT 0, "
-          "PlayMusic BOOL DEFAULT 0, "
-          "RepeatSlideShow BOOL DEFAULT 0, "
-          "SecondsPerSlide INT DEFAULT 0, "
-          "SlideShowUseTitles BOOL DEFAULT 0, "
-          "SongPath TEXT, "
-          "TransitionDirection TINYINT DEFAULT 0, "
-          "TransitionName VARCHAR(255) DEFAULT 'Dissolve', "
-          "TransitionSpeed FLOAT DEFAULT 0.0, "
-          "PanAndZoom BOOL DEFAULT 0, "
-          "ShuffleSlides BOOL DEFAULT 0, "
-          "PRIMARY KEY(iPhotoLibraryID, AlbumID)) "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='Albums')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sRolls "
-          "(iPhotoLibraryID INT NOT NULL, "          
-          "RollID INT NOT NULL, "
-          "RollName VARCHAR(255) DEFAULT '', "
-          "PhotoCount INT DEFAULT 0, "
-          "KeyPhoto INT DEFAULT 0, "
-          "RollDate DATETIME DEFAULT 0, "
-          "RollDateAsAppleTimer FLOAT DEFAULT 0.0, "
-          "PRIMARY KEY(iPhotoLibraryID, RollID)) "          
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='Rolls')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sImages "
-          "(iPhotoLibraryID INT NOT NULL, "
-          "GUID VARCHAR(36) NOT NULL, "
-          "RollID INT DEFAULT 0, "
-          "ImageID INT NOT NULL, "
-          "Rating TINYINT DEFAULT 0, "
-          "Comment VARCHAR(255) DEFAULT '', "
-          "Caption VARCHAR(255) DEFAULT '', "
-          "MediaType VARCHAR(20) DEFAULT '', "
-          "AspectRatio FLOAT DEFAULT 0.0, "
-          "RotationIsOnlyEdit BOOL DEFAULT 0, "
-          "OriginalDate DATETIME DEFAULT 0, "
-          "OriginalDateAsAppleTimer FLOAT DEFAULT 0.0, "
-          "ModifiedDate DATETIME DEFAULT 0, "
-          "ModifiedDateAsAppleTimer FLOAT DEFAULT 0.0, "
-          "ImportDate DATETIME DEFAULT 0, "
-          "ImportDateAsAppleTimer FLOAT DEFAULT 0.0, "
-          "ThumbPath TEXT, "
-          "ImagePath TEXT, "
-          "OriginalPath TEXT, "
-          "PRIMARY KEY(iPhotoLibraryID, ImageID)) "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='Images')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sFilters "
-          "(iPhotoLibraryID INT NOT NULL, "
-          "AlbumID INT NOT NULL, "
-          "Count INT DEFAULT 0, "
-          "Operation VARCHAR(255) DEFAULT '', "
-          "Type VARCHAR(255) DEFAULT '') "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='Filters')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sKeywords "
-          "(KeywordID INT NOT NULL, "
-          "iPhotoLibraryID INT NOT NULL, "
-          "Keyword VARCHAR(255) DEFAULT '', "
-          "PRIMARY KEY(KeywordID, iPhotoLibraryID)) "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='Keywords')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sImageKeywords "
-          "(iPhotoLibraryID INT NOT NULL, "
-          "ImageID INT NOT NULL, "
-          "KeywordID INT NOT NULL) "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='ImageKeywords')
-      self.CreateTable(query=
-          "CREATE TABLE IF NOT EXISTS %sAlbumImages "
-          "(iPhotoLibraryID INT NOT NULL, "
-          "AlbumID INT NOT NULL, "
-          "ImageID INT NOT NULL) "
-          "DEFAULT CHARSET UTF8"
-          % self.__prepend,
-          readable_name='AlbumImages')
+      for table, columns, primary_key in self.__TABLES:
+        if primary_key:
+          columns = "%s, PRIMARY KEY(%s)" % (columns, primary_key)
+        self.CreateTable(query=
+            "CREATE TABLE IF NOT EXISTS %s%s (%s) DEFAULT CHARSET UTF8" % (
+            self.__prepend, table, columns),
+            readable_name=table)
+      for table in ("Albums", "Rolls", "Images"):
+        self.__AddMissingColumn(table, "Fingerprint", "CHAR(32) DEFAULT ''")
     except MySQLdb.Error, e:
       sys.exit("%(debug)sDatabaseCheck] MySQL ERROR: %(error)s\n"
                "%(debug)sDatabaseCheck] Could not add table to database." %
                {'debug':self.__DEBUG_INFO,'error':e})
 
+  def __TableName(self, table=None):
+    """ Returns the full name of a table, as used in SQL statements.
+
+    While a rebuild is in progress, this is the name of the staging table.
+
+    Args:
+      table: String table (without prepend characters)
+
+    Returns:
+      String table name, with prepend characters
+    """
+    if self.__staging and table not in self.__UNSTAGED_TABLES:
+      return "%s%s%s" % (self.__prepend, self.__STAGING_PREPEND, table)
+    return "%s%s" % (self.__prepend, table)
+
+  def BeginRebuild(self):
+    """ Starts rebuilding the database into empty staging tables.
+
+    Staging tables are created next to the live tables (i.e. exhibit_new_Images
+    for exhibit_Images), with their primary keys: UpsertMany needs them to
+    update rows instead of adding duplicates.  Rows are loaded in primary key
+    order, so InnoDB appends to its clustered index rather than rebuilding the
+    table to add the key afterwards.  Until FinishRebuild is called, all
+    statements use the staging tables; the live tables are not touched, and
+    readers keep seeing the old data.  The iPhotoLibrary table is not staged,
+    so library IDs are kept.  Staging tables left over by an interrupted
+    rebuild are dropped.
+
+    Kills:
+      sys.exit: Table creation fails on the database
+    """
+    try:
+      for table, columns, primary_key in self.__TABLES:
+        if table in self.__UNSTAGED_TABLES:
+          continue
+        for prepend in (self.__STAGING_PREPEND, self.__RETIRED_PREPEND):
+          self.__db.query("DROP TABLE IF EXISTS %s%s%s" % (self.__prepend,
+                                                           prepend, table))
+        if primary_key:
+          columns = "%s, PRIMARY KEY(%s)" % (columns, primary_key)
+        self.CreateTable(query=
+            "CREATE TABLE %s%s%s (%s) DEFAULT CHARSET UTF8" % (
+            self.__prepend, self.__STAGING_PREPEND, table, columns),
+            readable_name=self.__STAGING_PREPEND + table)
+    except MySQLdb.Error, e:
+      sys.exit("%(debug)sBeginRebuild] MySQL ERROR: %(error)s\n"
+               "%(debug)sBeginRebuild] Could not create staging tables." %
+               {'debug':self.__DEBUG_INFO,'error':e})
+    self.__staging = True
+
+  def FinishRebuild(self):
+    """ Swaps the staging tables with the live tables.
+
+    The tables are switched with a single RENAME TABLE, so readers see either
+    the old or the new data.  The old tables are dropped afterwards.
+
+    Kills:
+      sys.exit: Swapping tables fails on the database
+    """
+    if not self.__staging:
+      sys.exit("%(debug)sFinishRebuild] No rebuild in progress!" %
+               {'debug':self.__DEBUG_INFO})
+    renames = []
+    try:
+      for table, columns, primary_key in self.__TABLES:
+        if table in self.__UNSTAGED_TABLES:
+          continue
+        renames.append("%(pre)s%(table)s TO %(pre)s%(old)s%(table)s, "
+                       "%(pre)s%(new)s%(table)s TO %(pre)s%(table)s" % {
+                       'pre':self.__prepend,
+                       'old':self.__RETIRED_PREPEND,
+                       'new':self.__STAGING_PREPEND,
+                       'table':table})
+      self.__db.query("RENAME TABLE %s" % ", ".join(renames))
+      self.__staging = False
+      for table, columns, primary_key in self.__TABLES:
+        if table not in self.__UNSTAGED_TABLES:
+          self.__db.query("DROP TABLE IF EXISTS %s%s%s" % (
+                          self.__prepend, self.__RETIRED_PREPEND, table))
+    except MySQLdb.Error, e:
+      sys.exit("%(debug)sFinishRebuild] MySQL ERROR: %(error)s\n"
+               "%(debug)sFinishRebuild] Could not swap in the rebuilt tables; "
+               "the live tables were not changed." %
+               {'debug':self.__DEBUG_INFO,'error':e})
+    if __debug__:
+      print ("%(debug)sFinishRebuild] Rebuilt tables are live." %
+             {'debug':self.__DEBUG_INFO})
+
+  def __Statement(self, template=None, table=None, columns=(),
+                  match_columns=()):
+    """ Returns the SQL text of a statement, with placeholders for its values.
+
+    The text is built once for each statement shape, and cached.  Placeholders
+    are in columns order, followed by match_columns order.
+
+    Args:
+      template: String statement template, i.e. self.__INSERT
+      table: String table to use, without prepend string
+      columns: Tuple of columns to insert, update or select
+      match_columns: Tuple of columns used to match rows
+
+    Returns:
+      String SQL statement, i.e. INSERT INTO db_test (key1) VALUES (%s)
+    """
+    if table:
+      table = self.__TableName(table)
+    key = (template, table, columns, match_columns)
+    if key not in self.__statements:
+      self.__statements[key] = template % {
+          'table':table,
+          'columns':", ".join(columns),
+          'values':", ".join(["%s"] * len(columns)),
+          'set':", ".join(["%s=%%s" % column for column in columns]),
+          'where':" AND ".join(["%s=%%s" % column
+                                for column in match_columns])}
+      if __debug__:
+        print ("%(debug)s__Statement] Cached statement: %(sql)s" %
+               {'debug':self.__DEBUG_INFO,'sql':self.__statements[key]})
+    return self.__statements[key]
+
+  def __Columns(self, values=None):
+    """ Returns the sorted columns of a dictionary, as a tuple.
+
+    Args:
+      values: Dictionary key/value pairs
+
+    Returns:
+      A tuple of the dictionary's keys, sorted
+    """
+    columns = values.keys()
+    columns.sort()
+    return tuple(columns)
+
   def Insert(self, table=None, values=None):
     """ Inserts a new entry into an existing database table.
     
@@ -372,30 +804,286 @@ class MySql(object):
       sys.exit("%(debug)sInsert] MySQL database insert failed.\n"
                "%(debug)sInsert] Cannot insert empty values or tables into "
                "database." % {'debug':self.__DEBUG_INFO})
-    # build sql insert command, wrapping data in quotes and ()
-    # i.e. INSERT INTO db_test (key1, key2) VALUES("23", "hello")
-    sql = ["INSERT INTO %s%s (" % (self.__prepend, table)]
-    for key in values.keys():
-      sql.append("%s, " % key)
-    sql[-1] = sql[-1][:-2]
-    sql.append(") VALUES(")
-    for value in values.values():
-      sql.append("\"%s\", " % self.EncodeString(value))
-    sql[-1] = sql[-1][:-2]
-    sql.append(")")
+    # i.e. INSERT INTO db_test (key1, key2) VALUES (%s, %s) with ("23", "hello")
+    columns = self.__Columns(values)
+    sql = self.__Statement(self.__INSERT, table, columns)
+    parameters = [values[column] for column in columns]
     if __debug__:
-      print ("%(debug)sInsert] SQL statement to use: %(sql)s" % 
-             {'debug':self.__DEBUG_INFO,'sql':''.join(sql)})
+      print ("%(debug)sInsert] SQL statement to use: %(sql)s %(values)s" % 
+             {'debug':self.__DEBUG_INFO,'sql':sql,'values':parameters})
     try:
-      self.__db.query(''.join(sql))
+      self.__Retry(self.__Write, sql, parameters)
     except MySQLdb.Error, e:
       sys.exit("%(debug)sInsert] MySQL ERROR: %(error)s\n"
                "%(debug)sInsert] MySQL insert failed: Could not insert "
                "values.\n"
-               "%(debug)sInsert] ==> SQL statement: %(sql)s" % {
+               "%(debug)sInsert] ==> SQL statement: %(sql)s %(values)s" % {
                'debug':self.__DEBUG_INFO,
                'error':e,
-               'sql':''.join(sql)})
+               'sql':sql,
+               'values':parameters})
+
+  def __ValuesList(self, row=None, columns=None):
+    """ Binds the values of a row to a VALUES list, i.e. ('23', 'hello').
+
+    Values are escaped by MySQLdb, as they are for a single row statement.
+
+    Args:
+      row: Dictionary key/value pairs of the row
+      columns: Tuple of columns to use, in order
+
+    Returns:
+      String SQL values list
+    """
+    return self.__Statement(self.__VALUES, None, columns) % self.__db.literal(
+        tuple([row[column] for column in columns]))
+
+  def __GroupByColumns(self, rows=None):
+    """ Groups rows by the columns they have, in first seen order.
+
+    Args:
+      rows: List of dictionaries of key/value pairs
+
+    Returns:
+      A list of tuples (columns, rows), with the sorted tuple of columns
+    """
+    groups = {}
+    order = []
+    for row in rows:
+      columns = self.__Columns(row)
+      if columns not in groups:
+        groups[columns] = []
+        order.append(columns)
+      groups[columns].append(row)
+    return [(group_columns, groups[group_columns]) for group_columns in order]
+
+  def __MaxStatementSize(self):
+    """ Returns the size of the largest statement the server will accept.
+
+    The server's max_allowed_packet is only read once.  If it cannot be read,
+    the MySQL default is assumed.
+
+    Returns:
+      Integer maximum statement size in bytes
+    """
+    if not self.__max_statement_size:
+      try:
+        self.__db.query("SELECT @@max_allowed_packet")
+        packet_size = int(self.__db.store_result().fetch_row()[0][0])
+      except (MySQLdb.Error, IndexError, TypeError, ValueError), e:
+        print ("%(warn)s__MaxStatementSize] Cannot read max_allowed_packet "
+               "(%(error)s), assuming %(size)s bytes." % {
+               'warn':self.__WARNING_INFO,
+               'error':e,
+               'size':self.__DEFAULT_PACKET_SIZE})
+        packet_size = self.__DEFAULT_PACKET_SIZE
+      self.__max_statement_size = packet_size - self.__PACKET_MARGIN
+      if __debug__:
+        print ("%(debug)s__MaxStatementSize] Maximum statement size: "
+               "%(size)s bytes" % {'debug':self.__DEBUG_INFO,
+                                   'size':self.__max_statement_size})
+    return self.__max_statement_size
+
+  def __MultiRowStatements(self, head=None, rows=None, columns=None, tail="",
+                           batch_size=None):
+    """ Splits rows into multi-row statements which fit in a server packet.
+
+    Each statement holds at most batch_size rows, and is smaller than the
+    server's max_allowed_packet.  A single row larger than the packet is still
+    sent on its own, and will be refused by the server.
+
+    Args:
+      head: String start of the statement, up to and including VALUES
+      rows: List of dictionaries of key/value pairs
+      columns: Tuple of columns to use, in order
+      tail: String end of the statement, after the values lists
+      batch_size: Integer maximum number of rows per statement
+
+    Yields:
+      A tuple (rows, sql), with the number of rows in the statement
+    """
+    max_size = self.__MaxStatementSize()
+    values = []
+    size = len(head) + len(tail)
+    for row in rows:
+      row_values = self.__ValuesList(row, columns)
+      if values and (len(values) >= batch_size or
+                     size + len(row_values) + 2 > max_size):
+        yield len(values), "%s%s%s" % (head, ", ".join(values), tail)
+        values = []
+        size = len(head) + len(tail)
+      values.append(row_values)
+      size += len(row_values) + 2
+    if values:
+      yield len(values), "%s%s%s" % (head, ", ".join(values), tail)
+
+  def InsertMany(self, table=None, rows=None, batch_size=1000):
+    """ Inserts many new rows into an existing database table.
+
+    Rows are sent as multi-row INSERT statements of up to batch_size rows,
+    kept below the server's max_allowed_packet.  Rows with different columns
+    are sent in separate statements.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs, as used by Insert
+      batch_size: Integer maximum number of rows per statement
+
+    Kills:
+      sys.exit: Insert fails on the database
+    """
+    if not table or not batch_size:
+      sys.exit("%(debug)sInsertMany] MySQL database insert failed.\n"
+               "%(debug)sInsertMany] Cannot insert without a table or batch "
+               "size." % {'debug':self.__DEBUG_INFO})
+    # build sql insert command, binding each row to a values list
+    # i.e. INSERT INTO db_test (key1, key2) VALUES ('23', 'hello'), ('24', '')
+    for columns, group in self.__GroupByColumns(rows or []):
+      head = "INSERT INTO %s (%s) VALUES " % (self.__TableName(table),
+                                              ", ".join(columns))
+      for count, sql in self.__MultiRowStatements(head, group, columns, "",
+                                                  batch_size):
+        if __debug__:
+          print ("%(debug)sInsertMany] SQL statement to use: %(sql)s" %
+                 {'debug':self.__DEBUG_INFO,'sql':sql})
+        try:
+          self.__Retry(self.__Write, sql)
+        except MySQLdb.Error, e:
+          sys.exit("%(debug)sInsertMany] MySQL ERROR: %(error)s\n"
+                   "%(debug)sInsertMany] MySQL insert failed: Could not "
+                   "insert %(rows)s rows into %(table)s." % {
+                   'debug':self.__DEBUG_INFO,
+                   'error':e,
+                   'rows':count,
+                   'table':table})
+
+  def __SpoolValue(self, value=None):
+    """ Escapes a value for a LOAD DATA spool file.
+
+    Args:
+      value: Value to escape
+
+    Returns:
+      String UTF8 value, with backslash, tab, newline, carriage return and NUL
+      escaped; None is written as \N (NULL)
+    """
+    if value is None:
+      return "\\N"
+    if isinstance(value, unicode):
+      value = value.encode("UTF8")
+    elif not isinstance(value, str):
+      value = str(value)
+    for character, escaped in self.__SPOOL_ESCAPES:
+      value = value.replace(character, escaped)
+    return value
+
+  def BulkInsert(self, table=None, rows=None):
+    """ Loads many new rows into a table with LOAD DATA LOCAL INFILE.
+
+    Rows are written to a tab separated spool file, which the server loads in
+    one statement; this is much faster than INSERT statements for large, empty
+    tables.  Rows with different columns are loaded from separate files.  If
+    the server (or client) does not allow LOCAL INFILE, rows are sent with
+    InsertMany instead, for this and later calls.  Spool files are kept until
+    the rows are committed, so the load can be replayed after a reconnect.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs, as used by Insert
+
+    Kills:
+      sys.exit: Insert fails on the database
+    """
+    if not table:
+      sys.exit("%(debug)sBulkInsert] MySQL database insert failed.\n"
+               "%(debug)sBulkInsert] Cannot insert without a table." %
+               {'debug':self.__DEBUG_INFO})
+    for columns, group in self.__GroupByColumns(rows or []):
+      if not self.__bulk_load:
+        self.InsertMany(table, group)
+        continue
+      spool_fd, spool_path = tempfile.mkstemp(prefix="exhibit_", suffix=".tsv")
+      self.__spools.append(spool_path)
+      try:
+        spool = os.fdopen(spool_fd, "wb")
+        try:
+          for row in group:
+            spool.write("\t".join([self.__SpoolValue(row[column])
+                                   for column in columns]))
+            spool.write("\n")
+        finally:
+          spool.close()
+        # i.e. LOAD DATA LOCAL INFILE '/tmp/exhibit_x.tsv' INTO TABLE db_test
+        #      CHARACTER SET UTF8 (key1, key2)
+        sql = ("LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET UTF8 "
+               "(%s)" % (spool_path.replace("\\", "\\\\").replace("'", "\\'"),
+                         self.__TableName(table), ", ".join(columns)))
+        if __debug__:
+          print ("%(debug)sBulkInsert] SQL statement to use: %(sql)s" %
+                 {'debug':self.__DEBUG_INFO,'sql':sql})
+        self.__Retry(self.__Write, sql)
+      except (MySQLdb.Error, EnvironmentError), e:
+        print ("%(warn)sBulkInsert] Bulk load of %(table)s failed: "
+               "%(error)s\n"
+               "%(warn)sBulkInsert] Using multi-row inserts instead." % {
+               'warn':self.__WARNING_INFO,
+               'table':table,
+               'error':e})
+        self.__spools.remove(spool_path)
+        if os.path.exists(spool_path):
+          os.remove(spool_path)
+        self.__bulk_load = False
+        self.InsertMany(table, group)
+
+  def UpsertMany(self, table=None, rows=None, key_columns=None, 
+                 batch_size=500):
+    """ Inserts rows, updating existing rows with the same key instead.
+
+    Rows are sent as multi-row INSERT ... ON DUPLICATE KEY UPDATE statements of
+    up to batch_size rows, kept below the server's max_allowed_packet, instead
+    of a SELECT and an INSERT or UPDATE per row.  Rows with different columns
+    are sent in separate statements.  Only the columns present in a row are
+    updated.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs, as used by Insert
+      key_columns: List of the columns in the table's primary key
+      batch_size: Integer maximum number of rows per statement
+
+    Kills:
+      sys.exit: Upsert fails on the database
+    """
+    if not table or not key_columns or not batch_size:
+      sys.exit("%(debug)sUpsertMany] MySQL database upsert failed.\n"
+               "%(debug)sUpsertMany] Cannot upsert without a table, key "
+               "columns or batch size." % {'debug':self.__DEBUG_INFO})
+    # build sql insert command, updating non-key columns on duplicate keys
+    # i.e. INSERT INTO db_test (key1, key2) VALUES ('23', 'hello'), ('24', '')
+    #      ON DUPLICATE KEY UPDATE key2=VALUES(key2)
+    for columns, group in self.__GroupByColumns(rows or []):
+      updates = [column for column in columns if column not in key_columns]
+      if not updates:
+        updates = [key_columns[0]]
+      head = "INSERT INTO %s (%s) VALUES " % (self.__TableName(table),
+                                              ", ".join(columns))
+      tail = " ON DUPLICATE KEY UPDATE %s" % ", ".join(
+          ["%s=VALUES(%s)" % (column, column) for column in updates])
+      for count, sql in self.__MultiRowStatements(head, group, columns, tail,
+                                                  batch_size):
+        if __debug__:
+          print ("%(debug)sUpsertMany] SQL statement to use: %(sql)s" % 
+                 {'debug':self.__DEBUG_INFO,'sql':sql})
+        try:
+          self.__Retry(self.__Write, sql)
+        except MySQLdb.Error, e:
+          sys.exit("%(debug)sUpsertMany] MySQL ERROR: %(error)s\n"
+                   "%(debug)sUpsertMany] MySQL upsert failed: Could not "
+                   "upsert %(rows)s rows into %(table)s." % {
+                   'debug':self.__DEBUG_INFO,
+                   'error':e,
+                   'rows':count,
+                   'table':table})
           
   def Update(self, table=None, match_keys=None, update_values=None):
     """ Updates an existing database entry with given information.
@@ -420,31 +1108,48 @@ class MySql(object):
                "rows.\n"
                "%(debug)sUpdate] Empty values, tables or match keys were "
                "provided." % {'debug':self.__DEBUG_INFO})
-    # build mysql update command, wrapping data in quotes
-    # i.e. UPDATE db_test SET key1="23", key2="hello" WHERE 
-    #      key3="1" AND key4="2" LIMIT 1
-    sql = ["UPDATE %s%s SET " % (self.__prepend, table)]
-    for value_key in update_values:
-      sql.append("%s=\"%s\", " % (value_key, 
-                 self.EncodeString(update_values[value_key])))
-    sql[-1] = sql[-1][:-2]
-    sql.append(" WHERE ")
-    for key in match_keys:
-      sql.append("%s=\"%s\" AND " % (key, self.EncodeString(match_keys[key])))
-    sql[-1] = sql[-1][:-4]
-    sql.append("LIMIT 1")
+    # build mysql update command, binding values to placeholders
+    # i.e. UPDATE db_test SET key1=%s, key2=%s WHERE key3=%s AND key4=%s LIMIT 1
+    columns = self.__Columns(update_values)
+    match_columns = self.__Columns(match_keys)
+    sql = self.__Statement(self.__UPDATE, table, columns, match_columns)
+    parameters = ([update_values[column] for column in columns] +
+                  [match_keys[column] for column in match_columns])
     if __debug__:
-      print ("%(debug)sUpdate] SQL statement to use: %(sql)s" % 
-             {'debug':self.__DEBUG_INFO,'sql':''.join(sql)})
+      print ("%(debug)sUpdate] SQL statement to use: %(sql)s %(values)s" % 
+             {'debug':self.__DEBUG_INFO,'sql':sql,'values':parameters})
     try:
-      self.__db.query(''.join(sql))
+      self.__Retry(self.__Write, sql, parameters)
     except MySQLdb.Error, e:
       sys.exit("%(debug)sUpdate] MySQL ERROR: %(error)s\n"
                "%(debug)sUpdate] MySQL update failed: Could not update "
                "values.\n"
-               "%(debug)sUpdate] ==> SQL statement: %(sql)s" % 
-               {'debug':self.__DEBUG_INFO,'error':e,'sql':''.join(sql)})
+               "%(debug)sUpdate] ==> SQL statement: %(sql)s %(values)s" % 
+               {'debug':self.__DEBUG_INFO,
+                'error':e,
+                'sql':sql,
+                'values':parameters})
     
+  def __FetchAll(self, sql=None, parameters=None):
+    """ Executes a select statement, and fetches all rows.
+
+    Args:
+      sql: String SQL statement, with placeholders for parameters
+      parameters: List of values to bind
+
+    Raises:
+      MySQLdb.Error: Statement failed
+
+    Returns:
+      A tuple of dictionaries of column/value pairs
+    """
+    cursor = self.__db.cursor(MySQLdb.cursors.DictCursor)
+    try:
+      cursor.execute(sql, parameters)
+      return cursor.fetchall()
+    finally:
+      cursor.close()
+
   def Select(self, table=None, match_keys=None, limit=None):
     """ Selects information from the database.
     
@@ -468,30 +1173,28 @@ class MySql(object):
       sys.exit("%(debug)sSelect] MySQL database select failed.\n"
                "%(debug)sSelect] Cannot select with empty table or match "
                "keys." % {'debug':self.__DEBUG_INFO})
-    # build sql select command, wrapping data in quotes
-    # i.e. SELECT * FROM db_test WHERE key1="23" AND key2="hello" LIMIT 1 
-    sql = ["SELECT * FROM %s%s WHERE " % (self.__prepend, table)]
-    for key in match_keys:
-      sql.append("%s=\"%s\" AND " % (key, self.EncodeString(match_keys[key])))
-    sql[-1] = sql[-1][:-4]    
+    # build sql select command, binding values to placeholders
+    # i.e. SELECT * FROM db_test WHERE key1=%s AND key2=%s LIMIT 1
+    match_columns = self.__Columns(match_keys)
+    sql = self.__Statement(self.__SELECT, table, ("*",), match_columns)
     if limit and isinstance(limit, int):
-      sql.append("LIMIT %s" % limit)
+      sql = "%s LIMIT %d" % (sql, limit)
+    parameters = [match_keys[column] for column in match_columns]
     if __debug__:
-      print ("%(debug)sSelect] MySQL statement to use: %(sql)s" % 
-             {'debug':self.__DEBUG_INFO,'sql':''.join(sql)})
+      print ("%(debug)sSelect] MySQL statement to use: %(sql)s %(values)s" % 
+             {'debug':self.__DEBUG_INFO,'sql':sql,'values':parameters})
     try:
-      self.__db.query(''.join(sql))
-      rows = self.__db.store_result()
+      rows = self.__Retry(self.__FetchAll, sql, parameters)
     except MySQLdb.Error, e:
       sys.exit("%(debug)sSelect] MySQL ERROR: %(error)s\n"
                "%(debug)sSelect] MySQL Select failed: could not select\n"
-               "%(dbeug)sSelect] ==> SQL statment: %(sql)s" % {
+               "%(debug)sSelect] ==> SQL statment: %(sql)s %(values)s" % {
                'debug':self.__DEBUG_INFO, 
                'error':e, 
-               'sql':''.join(sql)})
+               'sql':sql,
+               'values':parameters})
     results = []
-    for row in rows.fetch_row(maxrows=self.__RETURN_ALL_ROWS, 
-                              how=self.__RETURN_DICT_FORMAT):
+    for row in rows:
       results.append(row)
       if __debug__:
         print ("%(debug)sSelect] Added to SQL result list: %(row)s" % 
@@ -501,6 +1204,189 @@ class MySql(object):
     else:
       return None
 
+  def __OpenStream(self, sql=None, parameters=None):
+    """ Executes a select statement on a server-side cursor.
+
+    Args:
+      sql: String SQL statement, with placeholders for parameters
+      parameters: List of values to bind
+
+    Raises:
+      MySQLdb.Error: Statement failed
+
+    Returns:
+      A server-side dictionary cursor; rows are fetched from the server as they
+      are read from it
+    """
+    cursor = self.__db.cursor(MySQLdb.cursors.SSDictCursor)
+    try:
+      cursor.execute(sql, parameters)
+    except MySQLdb.Error:
+      cursor.close()
+      raise
+    return cursor
+
+  def SelectIter(self, table=None, match_keys=None, columns=None,
+                 fetch_size=None):
+    """ Selects rows from the database, streamed as they are read.
+
+    Unlike Select, rows are not stored on the client: they stay on the server
+    (server-side cursor) and are fetched fetch_size rows at a time, so tables
+    of any size are read in constant memory.  The connection cannot run other
+    statements until every row was read, or the generator was closed.  A lost
+    connection is only retried before the first row is read.
+
+    Args:
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs that will be used to match rows;
+          None to select every row
+      columns: List of columns to select; None for all columns
+      fetch_size: Integer rows fetched from the server at a time; None for the
+          default (1000)
+
+    Kills:
+      sys.exit: Select fails on the database
+
+    Yields:
+      A dictionary of column/value pairs for each row
+    """
+    if not table:
+      sys.exit("%(debug)sSelectIter] MySQL database select failed.\n"
+               "%(debug)sSelectIter] Cannot select with an empty table." %
+               {'debug':self.__DEBUG_INFO})
+    fetch_size = fetch_size or self.__FETCH_BATCH_SIZE
+    # build sql select command, binding values to placeholders
+    # i.e. SELECT key1, key2 FROM db_test WHERE key3=%s
+    columns = tuple(columns or ("*",))
+    if match_keys:
+      match_columns = self.__Columns(match_keys)
+      sql = self.__Statement(self.__SELECT, table, columns, match_columns)
+      parameters = [match_keys[column] for column in match_columns]
+    else:
+      sql = self.__Statement(self.__SELECT_ALL, table, columns)
+      parameters = None
+    if __debug__:
+      print ("%(debug)sSelectIter] SQL statement to use: %(sql)s %(values)s" %
+             {'debug':self.__DEBUG_INFO,'sql':sql,'values':parameters})
+    try:
+      cursor = self.__Retry(self.__OpenStream, sql, parameters)
+    except MySQLdb.Error, e:
+      sys.exit("%(debug)sSelectIter] MySQL ERROR: %(error)s\n"
+               "%(debug)sSelectIter] MySQL select failed: could not select\n"
+               "%(debug)sSelectIter] ==> SQL statement: %(sql)s %(values)s" %
+               {'debug':self.__DEBUG_INFO,
+                'error':e,
+                'sql':sql,
+                'values':parameters})
+    try:
+      while True:
+        try:
+          batch = cursor.fetchmany(fetch_size)
+        except MySQLdb.Error, e:
+          sys.exit("%(debug)sSelectIter] MySQL ERROR: %(error)s\n"
+                   "%(debug)sSelectIter] MySQL select failed while reading "
+                   "rows from %(table)s." % {'debug':self.__DEBUG_INFO,
+                                             'error':e,
+                                             'table':table})
+        if not batch:
+          break
+        for row in batch:
+          yield row
+    finally:
+      cursor.close()
+
+  def __FetchKeys(self, sql=None, parameters=None, key_count=None,
+                  value_column=None):
+    """ Executes a select statement, and streams the keys of the rows.
+
+    Args:
+      sql: String SQL statement, with placeholders for parameters
+      parameters: List of values to bind
+      key_count: Integer number of key columns, selected first
+      value_column: String column selected after the keys; None for keys only
+
+    Raises:
+      MySQLdb.Error: Statement failed
+
+    Returns:
+      A set of keys, or a dictionary of key to value; see SelectKeys
+    """
+    if value_column:
+      results = {}
+    else:
+      results = set()
+    cursor = self.__db.cursor(MySQLdb.cursors.SSCursor)
+    try:
+      cursor.execute(sql, parameters)
+      while True:
+        batch = cursor.fetchmany(self.__FETCH_BATCH_SIZE)
+        if not batch:
+          break
+        for row in batch:
+          if key_count == 1:
+            key = str(row[0])
+          else:
+            key = tuple([str(value) for value in row[:key_count]])
+          if value_column:
+            results[key] = row[key_count]
+          else:
+            results.add(key)
+    finally:
+      cursor.close()
+    return results
+
+  def SelectKeys(self, table=None, match_keys=None, key_columns=None,
+                 value_column=None):
+    """ Selects the keys of all matching rows, in one streamed query.
+
+    Rows are streamed from the server in batches, instead of being stored on
+    the client first, so this can be used on tables of any size to find out
+    which rows exist without a query per row.
+
+    Args:
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs that will be used to match rows
+      key_columns: List of columns making up a row's key
+      value_column: String column to return for each key; None for keys only
+
+    Kills:
+      sys.exit: Select fails on the database
+
+    Returns:
+      A set of keys; a dictionary of key to value if value_column is given.
+      Keys are strings for a single key column, tuples of strings otherwise.
+    """
+    if not table or not match_keys or not key_columns:
+      sys.exit("%(debug)sSelectKeys] MySQL database select failed.\n"
+               "%(debug)sSelectKeys] Cannot select with empty table, match "
+               "keys or key columns." % {'debug':self.__DEBUG_INFO})
+    # build sql select command, binding values to placeholders
+    # i.e. SELECT key1, key2 FROM db_test WHERE key3=%s
+    columns = tuple(key_columns)
+    if value_column:
+      columns += (value_column,)
+    match_columns = self.__Columns(match_keys)
+    sql = self.__Statement(self.__SELECT, table, columns, match_columns)
+    parameters = [match_keys[column] for column in match_columns]
+    if __debug__:
+      print ("%(debug)sSelectKeys] SQL statement to use: %(sql)s %(values)s" % 
+             {'debug':self.__DEBUG_INFO,'sql':sql,'values':parameters})
+    try:
+      results = self.__Retry(self.__FetchKeys, sql, parameters,
+                             len(key_columns), value_column)
+    except MySQLdb.Error, e:
+      sys.exit("%(debug)sSelectKeys] MySQL ERROR: %(error)s\n"
+               "%(debug)sSelectKeys] MySQL select failed: could not select\n"
+               "%(debug)sSelectKeys] ==> SQL statement: %(sql)s %(values)s" %
+               {'debug':self.__DEBUG_INFO, 
+                'error':e, 
+                'sql':sql,
+                'values':parameters})
+    if __debug__:
+      print ("%(debug)sSelectKeys] Selected %(count)s keys from %(table)s" %
+             {'debug':self.__DEBUG_INFO,'count':len(results),'table':table})
+    return results
+
   def Delete(self, table=None, match_keys=None):
     """ Deletes a specified database entry with the given information.
     
@@ -520,25 +1406,67 @@ class MySql(object):
       sys.exit("%(debug)sDelete] MySQL database delete failed.\n"
                "%(debug)sDelete] Cannot delete with empty table or match keys."
                % {'debug':self.__DEBUG_INFO})
-    # build sql delete command, wrapping data in quotes
-    # i.e. DELETE FROM db_test WHERE key1="23" AND key2="hello" LIMIT 1
-    sql = ["DELETE FROM %s%s WHERE " % (self.__prepend, table)]
-    for key in match_keys:
-      sql.append("%s=\"%s\" AND " % (key, self.EncodeString(match_keys[key])))
-    sql[-1] = sql[-1][:-4]
-    sql.append("LIMIT 1")
+    # build sql delete command, binding values to placeholders
+    # i.e. DELETE FROM db_test WHERE key1=%s AND key2=%s LIMIT 1
+    match_columns = self.__Columns(match_keys)
+    sql = self.__Statement(self.__DELETE, table, (), match_columns)
+    parameters = [match_keys[column] for column in match_columns]
     if __debug__:
-      print ("%(debug)sDelete] SQL statement to use: %(sql)s" % 
-             {'debug':self.__DEBUG_INFO,'sql':''.join(sql)})
+      print ("%(debug)sDelete] SQL statement to use: %(sql)s %(values)s" % 
+             {'debug':self.__DEBUG_INFO,'sql':sql,'values':parameters})
     try:
-      self.__db.query(''.join(sql))
+      self.__Retry(self.__Write, sql, parameters)
     except MySQLdb.Error, e:
       sys.exit("%(debug)sDelete] MySQL ERROR: %(error)s\n"
                "%(debug)sDelete] MySQL delete failed: Could not update "
                "values.\n"
-               "%(debug)sDelete] ==> SQL statement: %(sql)s" % 
-               {'debug':self.__DEBUG_INFO,'error':e,'sql':''.join(sql)})
+               "%(debug)sDelete] ==> SQL statement: %(sql)s %(values)s" % 
+               {'debug':self.__DEBUG_INFO,
+                'error':e,
+                'sql':sql,
+                'values':parameters})
           
+  def DeleteMany(self, table=None, rows=None, batch_size=1000):
+    """ Deletes many rows, matched on all of their columns.
+
+    Rows are sent as multi-row DELETE ... WHERE (columns) IN (...) statements
+    of up to batch_size rows, kept below the server's max_allowed_packet.  Rows
+    with different columns are sent in separate statements.  Unlike Delete,
+    every matching row is deleted, not only the first one.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs used to match rows
+      batch_size: Integer maximum number of rows per statement
+
+    Kills:
+      sys.exit: Delete fails on the database
+    """
+    if not table or not batch_size:
+      sys.exit("%(debug)sDeleteMany] MySQL database delete failed.\n"
+               "%(debug)sDeleteMany] Cannot delete without a table or batch "
+               "size." % {'debug':self.__DEBUG_INFO})
+    # build sql delete command, matching rows on all columns
+    # i.e. DELETE FROM db_test WHERE (key1, key2) IN (('23', 'hi'), ('24', ''))
+    for columns, group in self.__GroupByColumns(rows or []):
+      head = "DELETE FROM %s WHERE (%s) IN (" % (self.__TableName(table),
+                                                 ", ".join(columns))
+      for count, sql in self.__MultiRowStatements(head, group, columns, ")",
+                                                  batch_size):
+        if __debug__:
+          print ("%(debug)sDeleteMany] SQL statement to use: %(sql)s" %
+                 {'debug':self.__DEBUG_INFO,'sql':sql})
+        try:
+          self.__Retry(self.__Write, sql)
+        except MySQLdb.Error, e:
+          sys.exit("%(debug)sDeleteMany] MySQL ERROR: %(error)s\n"
+                   "%(debug)sDeleteMany] MySQL delete failed: Could not "
+                   "delete %(rows)s rows from %(table)s." % {
+                   'debug':self.__DEBUG_INFO,
+                   'error':e,
+                   'rows':count,
+                   'table':table})
+
 
 
 if __name__ == "__main__":
@@ -579,7 +1507,26 @@ if __name__ == "__main__":
     print "-->FAIL!\n"
   else:
     print "-->PASS!\n"
+  print "-->Test quotes and percent signs are stored unchanged:"
+  album_name = '50% off "sale" \\ it\'s %s'
+  sql.Insert("Albums",{'iPhotoLibraryID':'1',
+                       'AlbumID':'3',
+                       'AlbumName':album_name})
+  select_results = sql.Select("Albums",{'AlbumID':'3',
+                                        'AlbumName':album_name})
+  if select_results and select_results[0]['AlbumName'] == album_name:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test SelectIter:"
+  albums = [int(row['AlbumID']) for row in sql.SelectIter(
+                "Albums",{'iPhotoLibraryID':'1'},['AlbumID'],fetch_size=1)]
+  if albums == [3]:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
   print "-->Test Delete:"
   sql.Delete("Albums",{'AlbumID':'2'})
+  sql.Delete("Albums",{'AlbumID':'3'})
   print "-->PASS!\n"
   print "\n\nTesting completeled successfully!\n\n"
@@ -23,6 +23,11 @@ from __future__ import division
 __author__ = "Robert Pufky (github.com/r-pufky)"
 import sys
 import time
+import Queue
+import hashlib
+import threading
+import traceback
+import ConnectionPool
 import ProgressIndicator
 
 
@@ -32,6 +37,7 @@ class ProcessData(object):
   
   Attributes:
     FullImport(): imports full AlbumData to SQL
+    IncrementalImport(): imports only the changes in a LibraryDiff change set
     ProcessImages(): imports only images from AlbumData to SQL
     ProcessAlbums(): imports only albums from AlbumData to SQL
     ProcessRolls(): imports only rolls from AlbumData to SQL
@@ -39,7 +45,8 @@ class ProcessData(object):
   __author__ = "Robert Pufky (github.com/r-pufky)"
   __version__ = "1.0"
   
-  def __init__(self, album_data=None, db=None, quiet=False):
+  def __init__(self, album_data=None, db=None, quiet=False, max_delete=25,
+               connections=1):
     """ Initalizes and prepares ProcessData for data processing
 
     This will setup internal pointers to album_data and SQL objects, as well as
@@ -51,15 +58,28 @@ class ProcessData(object):
     
     Args:
       album_data: Dictionary from album_data processing
-      db: A SQL query object with Close,DatabaseCheck,Insert,Update,Delete, 
-          and Select functions
+      db: A SQL query object with Close,DatabaseCheck,Insert,InsertMany,
+          BulkInsert,UpsertMany,Update,Delete,DeleteMany,Select,SelectIter,
+          SelectKeys,Commit,CommitIfDue, and (for more than one connection)
+          Fork and Ping functions
       quiet: Boolean True to suppress status messages, but not ERROR or WARNING 
           messages, False for full reporting
+      max_delete: Integer largest percentage of a table's rows which may be
+          deleted in one run, because they are no longer in the library
+      connections: Integer number of database connections a full import runs
+          on; with more than one, tables are loaded concurrently
           
     Kills:
       sys.exit: Invalid arguments, iPhotoLibrary's DBID not retrievable
     """
     self.__DEBUG_INFO = "DEBUG:[ProcessData."
+    self.__WARNING_INFO = "WARNING:[ProcessData."
+    self.__BATCH_SIZE = 500
+    self.__INSERT_BATCH_SIZE = 5000
+    # deletions of fewer rows are always allowed, whatever the percentage
+    self.__DELETE_FLOOR = 10
+    self.__FINGERPRINTED_TABLES = ("Images", "Albums", "Rolls")
+    self.__TABLE_DONE = "*"
     if not album_data:
       sys.exit("%(debug)s__init__] AlbumData dict not provided!" % 
                {'debug':self.__DEBUG_INFO})
@@ -69,9 +89,19 @@ class ProcessData(object):
     if not isinstance(quiet, bool):
       sys.exit("%(debug)s__init__] quiet option must be boolean!" %
                {'debug':self.__DEBUG_INFO})
+    if not isinstance(max_delete, int) or not 0 <= max_delete <= 100:
+      sys.exit("%(debug)s__init__] max_delete must be a percentage!" %
+               {'debug':self.__DEBUG_INFO})
+    if not isinstance(connections, int) or connections < 1:
+      sys.exit("%(debug)s__init__] connections must be at least 1!" %
+               {'debug':self.__DEBUG_INFO})
     self.__album_data = album_data
     self.__db = db    
     self.__quiet = quiet
+    self.__max_delete = max_delete
+    self.__connections = connections
+    self.__output_lock = threading.Lock()
+    self.__checkpoints = None
     self.__image_keywords = []
     self.__album_images = []
     self.__filters = []
@@ -106,73 +136,49 @@ class ProcessData(object):
     del self.__keywords_dict
     if not self.__quiet:
       print "--> Prepared properties."
-    for image_key in self.__album_data.images:
-      self.__album_data.images[image_key]['iPhotoLibraryID'] = (
-          self.__db_library_id)
-      self.__album_data.images[image_key]['OriginalDate'] = (
-          self.__UnixEpochAsDateString(
-          self.__album_data.images[image_key]['OriginalDate']))
-      self.__album_data.images[image_key]['ImportDate'] = (
-          self.__UnixEpochAsDateString(
-          self.__album_data.images[image_key]['ImportDate']))
-      if "ModifiedDate" in self.__album_data.images[image_key]:
-        self.__album_data.images[image_key]['ModifiedDate'] = (
-            self.__UnixEpochAsDateString(
-            self.__album_data.images[image_key]['ModifiedDate']))
-      if "RotationIsOnlyEdit" in self.__album_data.images[image_key]:
-        self.__album_data.images[image_key]['RotationIsOnlyEdit'] = (
-            int(self.__album_data.images[image_key]['RotationIsOnlyEdit']))
-      if "Keywords" in self.__album_data.images[image_key]:
-        for keyword in self.__album_data.images[image_key]['Keywords']:
+    for image_key, image in self.__album_data.IterImages():
+      image['iPhotoLibraryID'] = self.__db_library_id
+      image['OriginalDate'] = (
+          self.__UnixEpochAsDateString(image['OriginalDate']))
+      image['ImportDate'] = self.__UnixEpochAsDateString(image['ImportDate'])
+      if "ModifiedDate" in image:
+        image['ModifiedDate'] = (
+            self.__UnixEpochAsDateString(image['ModifiedDate']))
+      if "RotationIsOnlyEdit" in image:
+        image['RotationIsOnlyEdit'] = int(image['RotationIsOnlyEdit'])
+      if "Keywords" in image:
+        for keyword in image['Keywords']:
           self.__image_keywords.append({'ImageID':image_key,
                                        'iPhotoLibraryID':self.__db_library_id,
                                        'KeywordID':keyword})
-        del self.__album_data.images[image_key]['Keywords']
+        del image['Keywords']
     if not self.__quiet:
       print "--> Prepared images."
-    for album_key in self.__album_data.albums:
-      self.__album_data.albums[album_key]['iPhotoLibraryID'] = (
-          self.__db_library_id)
-      if "Master" in self.__album_data.albums[album_key]:
-        self.__album_data.albums[album_key]['Master'] = (
-            int(self.__album_data.albums[album_key]['Master']))
-      if "PlayMusic" in self.__album_data.albums[album_key]:
-        self.__album_data.albums[album_key]['PlayMusic'] = (
-            int(self.__album_data.albums[album_key]['PlayMusic']))
-      if "RepeatSlideShow" in self.__album_data.albums[album_key]:
-        self.__album_data.albums[album_key]['RepeatSlideShow'] = (
-            int(self.__album_data.albums[album_key]['RepeatSlideShow']))
-      if "SlideShowUseTitles" in self.__album_data.albums[album_key]:
-        self.__album_data.albums[album_key]['SlideShowUseTitles'] = (
-            int(self.__album_data.albums[album_key]['SlideShowUseTitles']))
-      if "PanAndZoom" in self.__album_data.albums[album_key]:
-        self.__album_data.albums[album_key]['PanAndZoom'] = (
-            int(self.__album_data.albums[album_key]['PanAndZoom']))
-      if "ShuffleSlides" in self.__album_data.albums[album_key]:
-        self.__album_data.albums[album_key]['ShuffleSlides'] = (
-            int(self.__album_data.albums[album_key]['ShuffleSlides']))
-      for image in self.__album_data.albums[album_key]['KeyList']:
+    for album_key, album in self.__album_data.IterAlbums():
+      album['iPhotoLibraryID'] = self.__db_library_id
+      for boolean in ("Master", "PlayMusic", "RepeatSlideShow",
+                      "SlideShowUseTitles", "PanAndZoom", "ShuffleSlides"):
+        if boolean in album:
+          album[boolean] = int(album[boolean])
+      for image in album['KeyList']:
         self.__album_images.append({'iPhotoLibraryID':self.__db_library_id,
                                    'AlbumID':album_key,
                                    'ImageID':image})
-      del self.__album_data.albums[album_key]['KeyList']
-      if "Filters" in self.__album_data.albums[album_key]:
-        for filter in self.__album_data.albums[album_key]['Filters']:
+      del album['KeyList']
+      if "Filters" in album:
+        for filter in album['Filters']:
           self.__filters.append({'iPhotoLibraryID':self.__db_library_id,
                                 'AlbumID':album_key,
                                 'Count':filter['Count'],
                                 'Operation':filter['Operation'],
                                 'Type':filter['Type']})
-        del self.__album_data.albums[album_key]['Filters']
+        del album['Filters']
     if not self.__quiet:
       print "--> Prepared albums."
-    for roll_key in self.__album_data.rolls:
-      self.__album_data.rolls[roll_key]['iPhotoLibraryID'] = (
-          self.__db_library_id)
-      self.__album_data.rolls[roll_key]['RollDate'] = (
-          self.__UnixEpochAsDateString(
-          self.__album_data.rolls[roll_key]['RollDate']))
-      del self.__album_data.rolls[roll_key]['KeyList']
+    for roll_key, roll in self.__album_data.IterRolls():
+      roll['iPhotoLibraryID'] = self.__db_library_id
+      roll['RollDate'] = self.__UnixEpochAsDateString(roll['RollDate'])
+      del roll['KeyList']
     if not self.__quiet:
       print "--> Prepared rolls."
 
@@ -200,160 +206,744 @@ class ProcessData(object):
     Automatically runs a complete import session for the given album.  This
     allows for an easy 'full' import, while also allowing individual sections to
     be imported if a future case exists.
+
+    Progress is committed with checkpoints as it goes; if a previous full
+    import was interrupted, this one resumes from its checkpoints.  They are
+    cleared once the import completes.  With more than one connection, the
+    tables are loaded concurrently (see __ParallelImport).
+
+    Kills:
+      sys.exit: Bad SQL statements
+    """
+    self.__LoadCheckpoints()
+    if self.__connections > 1:
+      self.__ParallelImport()
+    else:
+      self.ProcessImages()
+      self.ProcessAlbums()
+      self.ProcessRolls()
+    self.__db.DeleteMany("Checkpoints",
+                         [{'iPhotoLibraryID':self.__db_library_id}])
+    self.__checkpoints = None
+    self.__db.Commit()
+
+  def __InsertRows(self, table=None, rows=None, indicator=None, done=0,
+                   total=None, bulk=False, db=None):
+    """ Inserts new rows, in batches of multi-row statements.
+
+    Args:
+      table: String table to use
+      rows: List of dictionaries (or records) to insert
+      indicator: ProgressIndicator to tick after each batch; None for no ticks
+      done: Integer rows already processed, for the progress indicator
+      total: Integer total rows, for the progress indicator; defaults to rows
+      bulk: Boolean True to load all rows at once with the connector's bulk
+          loader, used when the library has no rows in the table yet
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+    """
+    db = db or self.__db
+    total = total or len(rows)
+    if bulk and rows:
+      if __debug__:
+        print ("%(debug)s__InsertRows] Bulk loading %(rows)s rows into "
+               "%(table)s" % {'debug':self.__DEBUG_INFO,
+                              'rows':len(rows),
+                              'table':table})
+      db.BulkInsert(table, rows)
+      db.CommitIfDue(len(rows))
+      if indicator and not self.__quiet:
+        indicator.Tick(int((done + len(rows))/total*100))
+      return
+    for start in xrange(0, len(rows), self.__INSERT_BATCH_SIZE):
+      batch = rows[start:start + self.__INSERT_BATCH_SIZE]
+      db.InsertMany(table, batch, self.__INSERT_BATCH_SIZE)
+      db.CommitIfDue(len(batch))
+      if indicator and not self.__quiet:
+        indicator.Tick(int((done + start + len(batch))/total*100))
+
+  def __Fingerprint(self, row=None):
+    """ Computes the fingerprint of a row, as prepared for the database.
+
+    Args:
+      row: Dictionary (or record) to fingerprint
+
+    Returns:
+      String 32 character hex MD5 digest of the row's values
+    """
+    items = [item for item in row.items() if item[0] != "Fingerprint"]
+    items.sort()
+    return hashlib.md5(repr(items)).hexdigest()
+
+  def __DeletionAllowed(self, table=None, deleted=None, stored=None):
+    """ Checks that a deletion stays below the max_delete safety threshold.
+
+    A truncated or wrong AlbumData.xml looks like a library where most images
+    were deleted; refusing large deletions keeps it from wiping the database.
+    Deletions of fewer than __DELETE_FLOOR rows are always allowed, so small
+    tables (i.e. Keywords) are not stuck with rows they no longer need.
+
+    Args:
+      table: String table rows would be deleted from
+      deleted: Integer number of rows which would be deleted
+      stored: Integer number of rows stored for the library in the table
+
+    Returns:
+      Boolean True if the rows may be deleted, False otherwise
+    """
+    if (deleted < self.__DELETE_FLOOR or
+        deleted * 100 <= stored * self.__max_delete):
+      return True
+    print ("%(warn)s__DeletionAllowed] Not deleting %(deleted)s of %(stored)s "
+           "%(table)s rows which are no longer in the library; this is more "
+           "than %(max)s%% of the table.\n"
+           "%(warn)s__DeletionAllowed] Check the iPhoto library, or raise "
+           "--max-delete." % {'warn':self.__WARNING_INFO,
+                              'deleted':deleted,
+                              'stored':stored,
+                              'table':table,
+                              'max':self.__max_delete})
+    return False
+
+  def __DeleteMissingRows(self, table=None, rows=None, id_column=None,
+                          existing_ids=None, db=None):
+    """ Deletes the library's rows which are no longer in the library.
+
+    Args:
+      table: String table to use
+      rows: List of dictionaries (or records) of every row in the library
+      id_column: String column holding the row ID, within the library
+      existing_ids: Set (or dictionary) of the row IDs stored in the table
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+
+    Returns:
+      Integer number of rows deleted
+    """
+    current_ids = set([str(row[id_column]) for row in rows])
+    missing_ids = [row_id for row_id in existing_ids
+                   if row_id not in current_ids]
+    if not self.__DeletionAllowed(table, len(missing_ids), len(existing_ids)):
+      return 0
+    if __debug__:
+      print ("%(debug)s__DeleteMissingRows] %(table)s: %(deleted)s rows to "
+             "delete" % {'debug':self.__DEBUG_INFO,
+                         'table':table,
+                         'deleted':len(missing_ids)})
+    self.__DeleteRows(table, [{'iPhotoLibraryID':self.__db_library_id,
+                               id_column:row_id} for row_id in missing_ids],
+                      db)
+    return len(missing_ids)
+
+  def __LoadCheckpoints(self):
+    """ Loads the checkpoints left by an interrupted full import.
+
+    Checkpoints record, per table, the last row ID which was committed (or
+    that the table was completed), so an import which failed can resume where
+    it stopped instead of starting over.
+    """
+    self.__checkpoints = self.__db.SelectKeys(
+        "Checkpoints", {'iPhotoLibraryID':self.__db_library_id},
+        ['TableName'], "LastKey")
+    if self.__checkpoints and not self.__quiet:
+      print "Resuming the interrupted import of a previous run."
+    if __debug__:
+      print ("%(debug)s__LoadCheckpoints] Checkpoints: %(checkpoints)s" %
+             {'debug':self.__DEBUG_INFO,'checkpoints':self.__checkpoints})
+
+  def __ResumePoint(self, table=None):
+    """ Returns where the import of a table should resume.
+
+    Args:
+      table: String table to check
+
+    Returns:
+      Integer last row ID committed; the table done marker if the table was
+      completed; None if the table has no checkpoint
+    """
+    if not self.__checkpoints or table not in self.__checkpoints:
+      return None
+    if self.__checkpoints[table] == self.__TABLE_DONE:
+      return self.__TABLE_DONE
+    return int(self.__checkpoints[table])
+
+  def __Checkpoint(self, table=None, last_key=None, rows=0, db=None):
+    """ Records the progress of a table's import, and commits if it is due.
+
+    The checkpoint is written in the same transaction as the rows it covers.
+    Checkpoints are only kept during a full import.
+
+    Args:
+      table: String table (or table shard) which was imported
+      last_key: Last row ID written, or the table done marker
+      rows: Integer rows written since the last checkpoint
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+    """
+    db = db or self.__db
+    if self.__checkpoints is not None:
+      checkpoint = {'iPhotoLibraryID':self.__db_library_id, 'TableName':table}
+      db.Delete("Checkpoints", checkpoint)
+      checkpoint['LastKey'] = last_key
+      db.Insert("Checkpoints", checkpoint)
+      self.__checkpoints[table] = str(last_key)
+    db.CommitIfDue(rows)
+
+  def __ExistingRows(self, table=None, id_column=None, db=None):
+    """ Fetches the IDs of the library's rows stored in a table.
+
+    Args:
+      table: String table to use
+      id_column: String column holding the row ID, within the library
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+
+    Returns:
+      A dictionary of row ID to stored fingerprint for Images, Albums and
+      Rolls; a set of row IDs for other tables
+    """
+    db = db or self.__db
+    if table in self.__FINGERPRINTED_TABLES:
+      return db.SelectKeys(table, {'iPhotoLibraryID':self.__db_library_id},
+                           [id_column], "Fingerprint")
+    return db.SelectKeys(table, {'iPhotoLibraryID':self.__db_library_id},
+                         [id_column])
+
+  def __SaveRows(self, table=None, rows=None, id_column=None, indicator=None,
+                 delete_missing=False, existing_ids=None, checkpoint=None,
+                 db=None):
+    """ Inserts new rows, and updates rows which changed in the database.
+
+    The IDs of the library's rows in the table are fetched in one query up
+    front, so new rows can be sent as plain inserts and existing rows as
+    updates, without probing the database for each row.  If the library has
+    no rows in the table yet, new rows are bulk loaded.  For Images, Albums
+    and Rolls the stored fingerprint of each row is fetched as well, and rows
+    whose fingerprint did not change are not sent at all.
+
+    Rows are saved in ID order, and a checkpoint is recorded after each batch.
+    When resuming an interrupted import, rows up to the checkpoint are skipped.
+
+    Args:
+      table: String table to use
+      rows: List of dictionaries (or records) to save
+      id_column: String column holding the row ID, within the library
+      indicator: ProgressIndicator to tick after each batch; None for no ticks
+      delete_missing: Boolean True if rows is the whole library, and stored
+          rows which are not in it should be deleted
+      existing_ids: Dictionary (or set) of the library's stored row IDs (and
+          fingerprints), as returned by __ExistingRows; None to fetch them
+      checkpoint: String checkpoint name; None to use the table name
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+
+    Returns:
+      A tuple (skipped, deleted), with the number of unchanged (or already
+      imported) rows which were skipped and the number of rows deleted
+    """
+    db = db or self.__db
+    checkpoint = checkpoint or table
+    resume_id = self.__ResumePoint(checkpoint)
+    if resume_id == self.__TABLE_DONE:
+      if not self.__quiet:
+        print " (already imported)",
+      return len(rows), 0
+    if resume_id is not None and not self.__quiet:
+      print " (resuming after ID %s)" % resume_id,
+    fingerprinted = table in self.__FINGERPRINTED_TABLES
+    if existing_ids is None:
+      existing_ids = self.__ExistingRows(table, id_column, db)
+    rows = list(rows)
+    rows.sort(key=lambda row: int(row[id_column]))
+    batch_size = self.__BATCH_SIZE
+    if not existing_ids:
+      batch_size = len(rows) or 1
+    skipped = 0
+    for start in xrange(0, len(rows), batch_size):
+      batch = rows[start:start + batch_size]
+      new_rows = []
+      changed_rows = []
+      for row in batch:
+        if resume_id is not None and int(row[id_column]) <= resume_id:
+          skipped += 1
+          continue
+        if fingerprinted:
+          row['Fingerprint'] = self.__Fingerprint(row)
+        row_id = str(row[id_column])
+        if row_id not in existing_ids:
+          new_rows.append(row)
+        elif fingerprinted and existing_ids[row_id] == row['Fingerprint']:
+          skipped += 1
+        else:
+          changed_rows.append(row)
+      if __debug__:
+        print ("%(debug)s__SaveRows] %(table)s: %(new)s new rows, "
+               "%(changed)s changed rows" % {'debug':self.__DEBUG_INFO,
+                                             'table':table,
+                                             'new':len(new_rows),
+                                             'changed':len(changed_rows)})
+      if new_rows and not existing_ids:
+        db.BulkInsert(table, new_rows)
+      elif new_rows:
+        db.InsertMany(table, new_rows, self.__INSERT_BATCH_SIZE)
+      if changed_rows:
+        db.UpsertMany(table, changed_rows, ['iPhotoLibraryID', id_column],
+                      self.__BATCH_SIZE)
+      if new_rows or changed_rows:
+        self.__Checkpoint(checkpoint, batch[-1][id_column],
+                          len(new_rows) + len(changed_rows), db)
+      if indicator and not self.__quiet:
+        indicator.Tick(int((start + len(batch))/len(rows)*100))
+    deleted = 0
+    if delete_missing:
+      deleted = self.__DeleteMissingRows(table, rows, id_column, existing_ids,
+                                         db)
+    self.__Checkpoint(checkpoint, self.__TABLE_DONE, deleted, db)
+    return skipped, deleted
+
+  def __DeleteRows(self, table=None, rows=None, db=None):
+    """ Deletes rows matched on all of their columns, in multi-row statements.
+
+    Args:
+      table: String table to use
+      rows: List of dictionaries of the rows to delete
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+    """
+    db = db or self.__db
+    for start in xrange(0, len(rows), self.__INSERT_BATCH_SIZE):
+      batch = rows[start:start + self.__INSERT_BATCH_SIZE]
+      db.DeleteMany(table, batch, self.__INSERT_BATCH_SIZE)
+      db.CommitIfDue(len(batch))
+
+  def __KeyString(self, value=None):
+    """ Converts a value to a string, as returned by SelectKeys.
+
+    Args:
+      value: Value to convert
+
+    Returns:
+      String value; unicode strings are encoded to UTF8
+    """
+    if isinstance(value, unicode):
+      return value.encode("UTF8")
+    return str(value)
+
+  def __SyncRows(self, table=None, rows=None, columns=None, indicator=None,
+                 db=None):
+    """ Brings a table without row IDs in line with the library.
+
+    The rows stored for the library are fetched in one query, and compared to
+    the rows wanted.  Only the difference is sent: rows which are no longer
+    wanted are deleted, and missing rows are inserted, so the table is never
+    emptied while it is being updated.  Deletions above the max_delete
+    threshold are skipped.  Identical rows (i.e. repeated album filters) are
+    counted, and stored as many times as they are wanted; a row stored more
+    often than wanted is deleted, and inserted again as often as wanted.
+
+    Args:
+      table: String table to use
+      rows: List of dictionaries of the rows wanted in the table
+      columns: List of the columns identifying a row, besides iPhotoLibraryID
+      indicator: ProgressIndicator to tick after each batch; None for no ticks
+      db: SQL connector to use; None for the main connector
+
+    Kills:
+      sys.exit: Bad SQL statements
+
+    Returns:
+      A tuple (added, deleted) with the number of rows inserted and deleted
+    """
+    db = db or self.__db
+    if self.__ResumePoint(table) == self.__TABLE_DONE:
+      if not self.__quiet:
+        print " (already imported)",
+      return 0, 0
+    stored = {}
+    for row in db.SelectIter(table, {'iPhotoLibraryID':self.__db_library_id},
+                             columns):
+      key = tuple([self.__KeyString(row[column]) for column in columns])
+      stored[key] = stored.get(key, 0) + 1
+    wanted = {}
+    for row in rows:
+      key = tuple([self.__KeyString(row[column]) for column in columns])
+      wanted.setdefault(key, []).append(row)
+    added = []
+    deleted = []
+    # keys stored more often than wanted, deleted and inserted again
+    replaced = []
+    for key, key_rows in wanted.iteritems():
+      count = stored.get(key, 0)
+      if count > len(key_rows):
+        replaced.append((key, key_rows))
+      elif count < len(key_rows):
+        added.extend(key_rows[count:])
+    for key in stored:
+      if key not in wanted:
+        deleted.append(key)
+    deleted_count = (sum([stored[key] for key in deleted]) +
+                     sum([stored[key] for key, key_rows in replaced]))
+    if __debug__:
+      print ("%(debug)s__SyncRows] %(table)s: %(added)s rows to add, "
+             "%(deleted)s rows to delete" % {'debug':self.__DEBUG_INFO,
+                                             'table':table,
+                                             'added':len(added),
+                                             'deleted':deleted_count})
+    if not self.__DeletionAllowed(table, deleted_count,
+                                  sum(stored.itervalues())):
+      deleted = []
+      replaced = []
+      deleted_count = 0
+    for key, key_rows in replaced:
+      deleted.append(key)
+      added.extend(key_rows)
+    rows = []
+    for key in deleted:
+      row = dict(zip(columns, key))
+      row['iPhotoLibraryID'] = self.__db_library_id
+      rows.append(row)
+    self.__DeleteRows(table, rows, db)
+    self.__InsertRows(table, added, indicator, 0, None, not stored, db)
+    self.__Checkpoint(table, self.__TABLE_DONE, 0, db)
+    if not added and indicator and not self.__quiet:
+      indicator.Tick(100)
+    return len(added), deleted_count
+
+  def __ParallelImport(self):
+    """ Loads all tables concurrently, on a pool of database connections.
+
+    Images are split into one ImageID range (shard) per connection.  The image
+    shards and every other table are queued as jobs, which worker threads run
+    on connections borrowed from the pool; each job is committed on its own
+    connection, with its own checkpoint.  Shard checkpoints are named by the
+    shard's first and last ImageID: resuming with another shard layout (i.e.
+    other --connections) starts the shards over, where rows committed before
+    are skipped as unchanged.  Images which are no longer in the library are
+    deleted once every shard is loaded.  The throughput of each job, and of
+    each worker, is reported.
+
+    Kills:
+      sys.exit: Bad SQL statements
+    """
+    if not self.__quiet:
+      print ("Uploading metadata to SQL server on %s connections..." %
+             self.__connections)
+    jobs = Queue.Queue()
+    images = self.__album_data.images.values()
+    images_done = self.__ResumePoint("Images") == self.__TABLE_DONE
+    if images_done:
+      if not self.__quiet:
+        print "--> Images already imported."
+    else:
+      images.sort(key=lambda image: int(image['ImageID']))
+      image_ids = self.__ExistingRows("Images", "ImageID")
+      shard_size = max(self.__BATCH_SIZE,
+                       (len(images) + self.__connections - 1) //
+                       self.__connections)
+      for start in xrange(0, len(images), shard_size):
+        rows = images[start:start + shard_size]
+        shard = "%s-%s" % (rows[0]['ImageID'], rows[-1]['ImageID'])
+        jobs.put(("Images %s" % shard, len(rows), self.__SaveRows,
+                  ("Images", rows, "ImageID", None, False, image_ids,
+                   "Images:%s" % shard)))
+    for label, rows, method, args in (
+        ("ImageKeywords", self.__image_keywords, self.__SyncRows,
+         ("ImageKeywords", self.__image_keywords, ['ImageID', 'KeywordID'])),
+        ("AlbumImages", self.__album_images, self.__SyncRows,
+         ("AlbumImages", self.__album_images, ['AlbumID', 'ImageID'])),
+        ("Albums", self.__album_data.albums, self.__SaveRows,
+         ("Albums", self.__album_data.albums.values(), "AlbumID", None,
+          True)),
+        ("Rolls", self.__album_data.rolls, self.__SaveRows,
+         ("Rolls", self.__album_data.rolls.values(), "RollID", None, True)),
+        ("Keywords", self.__keywords, self.__SyncRows,
+         ("Keywords", self.__keywords, ['KeywordID', 'Keyword'])),
+        ("Filters", self.__filters, self.__SyncRows,
+         ("Filters", self.__filters,
+          ['AlbumID', 'Count', 'Operation', 'Type']))):
+      jobs.put((label, len(rows), method, args))
+    # nothing the workers load may wait on the main connection's transaction
+    self.__db.Commit()
+    pool = ConnectionPool.ConnectionPool(self.__db, self.__connections)
+    results = {'errors':[]}
+    workers = []
+    for worker in xrange(1, min(self.__connections, jobs.qsize()) + 1):
+      thread = threading.Thread(target=self.__Worker,
+                                args=(worker, pool, jobs, results))
+      thread.start()
+      workers.append(thread)
+    for thread in workers:
+      thread.join()
+    pool.Close()
+    if results['errors']:
+      sys.exit("%(debug)s__ParallelImport] Import failed, it will resume from "
+               "its checkpoints on the next run:\n%(errors)s" % {
+               'debug':self.__DEBUG_INFO,
+               'errors':"\n".join(results['errors'])})
+    if not images_done:
+      deleted = self.__DeleteMissingRows("Images", images, "ImageID",
+                                         image_ids)
+      self.__Checkpoint("Images", self.__TABLE_DONE, deleted)
+      if deleted and not self.__quiet:
+        print "--> %s images which left the library deleted." % deleted
+    if not self.__quiet:
+      for worker in xrange(1, len(workers) + 1):
+        job_count, rows, seconds = results[worker]
+        print ("--> Worker %(worker)s: %(jobs)s jobs, %(rows)s rows in "
+               "%(seconds).1fs (%(rate)d rows/s)" % {
+               'worker':worker,
+               'jobs':job_count,
+               'rows':rows,
+               'seconds':seconds,
+               'rate':rows / max(seconds, 0.001)})
+
+  def __Worker(self, worker=None, pool=None, jobs=None, results=None):
+    """ Runs import jobs on borrowed connections, until none are left.
+
+    A job is a tuple (label, rows, method, args): method is called with args
+    and the borrowed connector (db), which is committed and given back after
+    the job.  Workers stop taking jobs once any job failed.
+
+    Args:
+      worker: Integer worker number, used to report throughput
+      pool: ConnectionPool to borrow connections from
+      jobs: Queue of jobs
+      results: Dictionary receiving the worker's (jobs, rows, seconds) tuple
+          under its number, and the errors of failed jobs in 'errors'
     """
-    self.ProcessImages()
-    self.ProcessAlbums()
-    self.ProcessRolls()
+    job_count = 0
+    total_rows = 0
+    total_seconds = 0.0
+    while not results['errors']:
+      try:
+        label, rows, method, args = jobs.get_nowait()
+      except Queue.Empty:
+        break
+      started = time.time()
+      try:
+        db = pool.Borrow()
+        method(*args, db=db)
+        pool.Return(db)
+      except SystemExit, e:
+        results['errors'].append("%s: %s" % (label, e.code))
+        break
+      except Exception, e:
+        results['errors'].append("%s: %s" % (label, traceback.format_exc()))
+        break
+      seconds = time.time() - started
+      job_count += 1
+      total_rows += rows
+      total_seconds += seconds
+      if not self.__quiet:
+        self.__output_lock.acquire()
+        try:
+          print ("--> %(label)s: %(rows)s rows in %(seconds).1fs (%(rate)d "
+                 "rows/s, worker %(worker)s)" % {
+                 'label':label,
+                 'rows':rows,
+                 'seconds':seconds,
+                 'rate':rows / max(seconds, 0.001),
+                 'worker':worker})
+        finally:
+          self.__output_lock.release()
+    results[worker] = (job_count, total_rows, total_seconds)
+
+  def IncrementalImport(self, changes=None):
+    """ Imports only the changes since the last run to the SQL database.
+
+    Images, albums, rolls and keywords which were added or modified are saved
+    in multi-row inserts and upserts, and those which were deleted are removed.
+    Keyword, album image and filter memberships are removed and added in
+    multi-row statements.  Deletions are subject to the max_delete threshold,
+    against the number of rows stored by the previous run.
+
+    Args:
+      changes: Dictionary change set from LibraryDiff
+
+    Kills:
+      sys.exit: Bad SQL statements, change set not provided
+
+    Returns:
+      Boolean True if every change was applied, False if deletions were
+      refused; the library snapshot should then not be saved
+    """
+    if not changes:
+      sys.exit("%(debug)sIncrementalImport] Change set not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    keywords = {}
+    for keyword in self.__keywords:
+      keywords[keyword['KeywordID']] = keyword
+    sections = (("Images", "ImageID", changes['images'],
+                 self.__album_data.images),
+                ("Albums", "AlbumID", changes['albums'],
+                 self.__album_data.albums),
+                ("Rolls", "RollID", changes['rolls'],
+                 self.__album_data.rolls),
+                ("Keywords", "KeywordID", changes['keywords'], keywords))
+    applied = True
+    for table, id_column, section_changes, rows in sections:
+      if not self.__quiet:
+        print ("Uploading %(table)s changes to SQL server (%(added)s added, "
+               "%(modified)s modified, %(deleted)s deleted)." % {
+               'table':table,
+               'added':len(section_changes['added']),
+               'modified':len(section_changes['modified']),
+               'deleted':len(section_changes['deleted'])})
+      skipped, deleted = self.__SaveRows(
+          table,
+          [rows[key] for key in
+           section_changes['added'] | section_changes['modified']],
+          id_column)
+      if skipped and not self.__quiet:
+        print "--> %s unchanged rows skipped." % skipped
+      stored = (len(rows) - len(section_changes['added']) +
+                len(section_changes['deleted']))
+      if self.__DeletionAllowed(table, len(section_changes['deleted']),
+                                stored):
+        self.__DeleteRows(table, [{'iPhotoLibraryID':self.__db_library_id,
+                                   id_column:key}
+                                  for key in section_changes['deleted']])
+      else:
+        applied = False
+    memberships = (("ImageKeywords", ('ImageID', 'KeywordID'),
+                    changes['image_keywords'], self.__image_keywords),
+                   ("AlbumImages", ('AlbumID', 'ImageID'),
+                    changes['album_images'], self.__album_images),
+                   ("Filters", ('AlbumID', 'Count', 'Operation', 'Type'),
+                    changes['filters'], self.__filters))
+    for table, columns, section_changes, current in memberships:
+      if not self.__quiet:
+        print ("Uploading %(table)s changes to SQL server (%(added)s added, "
+               "%(deleted)s deleted)." % {
+               'table':table,
+               'added':len(section_changes['added']),
+               'deleted':len(section_changes['deleted'])})
+      stored = (len(current) - len(section_changes['added']) +
+                len(section_changes['deleted']))
+      if self.__DeletionAllowed(table, len(section_changes['deleted']),
+                                stored):
+        rows = []
+        for membership in section_changes['deleted']:
+          row = dict(zip(columns, membership))
+          row['iPhotoLibraryID'] = self.__db_library_id
+          rows.append(row)
+        self.__DeleteRows(table, rows)
+      else:
+        applied = False
+      rows = []
+      for membership in section_changes['added']:
+        row = dict(zip(columns, membership))
+        row['iPhotoLibraryID'] = self.__db_library_id
+        rows.append(row)
+      self.__InsertRows(table, rows)
+    self.__db.Commit()
+    return applied
 
   def ProcessImages(self):
     """ Uploads image data/metadata to SQL database.
     
     This data includes building the Images, ImageKeywords and Keywords tables.
+    Images which are no longer in the library are deleted.
+    ImageKeywords and Keywords are synced: only rows which changed are deleted
+    or inserted.
 
     Kills:
       sys.exit: Bad SQL statements
     """
-    count = 0
     total = len(self.__album_data.images)
     indicator = ProgressIndicator.ProgressIndicator()
     if not self.__quiet:
       print "Uploading Image metadata to SQL server (%s images):     " % total,
-    for image_key in self.__album_data.images:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      db_image = self.__db.Select("Images",
-                                  {'iPhotoLibraryID':self.__db_library_id,
-                                  'ImageID':image_key},
-                                  limit=1)
-      if db_image:
-        if __debug__:
-          print ("%(debug)sProcessImages] Existing Image: %(key)s updating..." %
-                 {'debug':self.__DEBUG_INFO,'key':image_key})
-        self.__db.Update("Images",
-                         {'iPhotoLibraryID':self.__db_library_id,
-                         'ImageID':image_key},
-                         self.__album_data.images[image_key])
-      else:
-        if __debug__:
-          print ("%(debug)sProcessImages] New Image to add: %(key)s" % 
-                 {'debug':self.__DEBUG_INFO,'key':image_key})
-        self.__db.Insert("Images",self.__album_data.images[image_key])
-    count = 0
+    skipped, deleted = self.__SaveRows("Images",
+                                       self.__album_data.images.values(),
+                                       "ImageID", indicator, True)
+    if not self.__quiet:
+      print " (%s unchanged images skipped, %s deleted)" % (skipped, deleted),
     total = len(self.__image_keywords)
     if not self.__quiet:
       print ("\nUploading Image Keyword pair metadata to SQL server "
              "(%s pairs):     " % total),
-    self.__db.ResetTable("ImageKeywords")
-    self.__db.ResetTable("Keywords")
-    for image_keyword in self.__image_keywords:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      self.__db.Insert("ImageKeywords",image_keyword)
-    count = 0
+    added, deleted = self.__SyncRows("ImageKeywords", self.__image_keywords,
+                                     ['ImageID', 'KeywordID'], indicator)
+    if not self.__quiet:
+      print " (%s added, %s removed)" % (added, deleted),
     total = len(self.__keywords)
     if not self.__quiet:
       print ("\nUploading Keyword metadata to SQL server (%s keywords):     " %
              total),
-    for keyword in self.__keywords:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-        self.__db.Insert("Keywords",keyword)
+    added, deleted = self.__SyncRows("Keywords", self.__keywords,
+                                     ['KeywordID', 'Keyword'], indicator)
+    if not self.__quiet:
+      print " (%s added, %s removed)" % (added, deleted),
 
   def ProcessAlbums(self):
     """ Uploads album data/metadata to SQL database.
 
     This data includes building the Albums, AlbumImages, and Filters tables.
+    Albums which are no longer in the library are deleted.
+    AlbumImages and Filters are synced: only rows which changed are deleted or
+    inserted.
     
     Kills:
       sys.exit: Bad SQL statements
     """
-    count = 0
     total = len(self.__album_data.albums)
     indicator = ProgressIndicator.ProgressIndicator()
     if not self.__quiet:
       print ("\nUploading Album metadata to SQL server (%s albums):     " %
              total),
-    for album_key in self.__album_data.albums:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      db_album = self.__db.Select("Albums",
-                                  {'iPhotoLibraryID':self.__db_library_id,
-                                  'AlbumID':album_key},
-                                  limit=1)
-      if db_album:
-        if __debug__:
-          print ("%(debug)sProcessAlbums] Existing Album: %(key)s updating..." %
-                 {'debug':self.__DEBUG_INFO,'key':album_key})
-        self.__db.Update("Albums",
-                         {'iPhotoLibraryID':self.__db_library_id,
-                         'AlbumID':album_key},
-                         self.__album_data.albums[album_key])
-      else:
-        if __debug__:
-          print ("%(debug)sProcessAlbums] New Album to add: %(key)s" %
-                 {'debug':self.__DEBUG_INFO,'key':album_key})
-        self.__db.Insert("Albums",self.__album_data.albums[album_key])
-    count = 0
+    skipped, deleted = self.__SaveRows("Albums",
+                                       self.__album_data.albums.values(),
+                                       "AlbumID", indicator, True)
+    if not self.__quiet:
+      print " (%s unchanged albums skipped, %s deleted)" % (skipped, deleted),
     total = len(self.__album_images)
     if not self.__quiet:
       print ("\nUploading Album Image metadata to SQL server (%s Album Images)"
              ":     " % total),
-    self.__db.ResetTable("AlbumImages")
-    self.__db.ResetTable("Filters")
-    for album_image in self.__album_images:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      self.__db.Insert("AlbumImages",album_image)
-    count = 0
+    added, deleted = self.__SyncRows("AlbumImages", self.__album_images,
+                                     ['AlbumID', 'ImageID'], indicator)
+    if not self.__quiet:
+      print " (%s added, %s removed)" % (added, deleted),
     total = len(self.__filters)
     if not self.__quiet:
       print ("\nUploading Album Filter metadata to SQL server (%s Filters):"
              "     " % total),
-    for filter in self.__filters:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      self.__db.Insert("Filters",filter)
+    added, deleted = self.__SyncRows("Filters", self.__filters,
+                                     ['AlbumID', 'Count', 'Operation', 'Type'],
+                                     indicator)
+    if not self.__quiet:
+      print " (%s added, %s removed)" % (added, deleted),
 
   def ProcessRolls(self):
     """ Uploads album data/metadata to SQL database.
 
+    Rolls which are no longer in the library are deleted.
+
     Kills:
       sys.exit: Bad SQL statements
     """
-    count = 0
     total = len(self.__album_data.rolls)
     indicator = ProgressIndicator.ProgressIndicator()
     if not self.__quiet:
       print "\nUploading Roll metadata to SQL server (%s rolls):     " % total,
-    for roll_key in self.__album_data.rolls:
-      if not self.__quiet:
-        count += 1
-        indicator.Tick(int(count/total*100))
-      db_roll = self.__db.Select("Rolls",
-                                 {'iPhotoLibraryID':self.__db_library_id,
-                                 'RollID':roll_key},
-                                 limit=1)
-      if db_roll:
-        if __debug__:
-          print ("%(debug)sProcessRolls] Existing Roll: %(key)s updating..." % {
-                 'debug':self.__DEBUG_INFO,
-                 'key':roll_key})
-        self.__db.Update("Rolls",
-                         {'iPhotoLibraryID':self.__db_library_id,
-                         'RollID':roll_key},
-                         self.__album_data.rolls[roll_key])
-      else:
-        if __debug__:
-          print ("%(debug)sProcessRolls] New Roll to add: %(key)s" % {
-                 'debug':self.__DEBUG_INFO,
-                 'key':roll_key})
-        self.__db.Insert("Rolls",self.__album_data.rolls[roll_key])
+    skipped, deleted = self.__SaveRows("Rolls",
+                                       self.__album_data.rolls.values(),
+                                       "RollID", indicator, True)
+    if not self.__quiet:
+      print " (%s unchanged rolls skipped, %s deleted)" % (skipped, deleted),
 
 
 
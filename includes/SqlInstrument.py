@@ -0,0 +1,449 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+#
+# Copyright 2008, Robert Pufky
+# Exhibit - SQL connector instrumentation Class
+#
+""" Times the statements of a SQL connector, for Exhibit
+
+Wraps a connector (i.e. MySql), and records for each operation and table the
+number of calls, their total time and latency percentiles, the rows and the
+bytes of values sent.  Calls slower than a threshold are kept in a slow
+statement log.  A summary is printed at the end of a run, and can be written
+as JSON.
+
+Functional Notes:
+  The instrument behaves like the connector it wraps; methods which are not
+  timed are passed through.  Connectors forked from it (i.e. by a connection
+  pool) are instrumented too, and add to the same statistics.  Bytes sent are
+  the bytes of the values passed to the connector, not of the SQL text.
+
+  SelectIter is timed while rows are read, not while the caller uses them.
+
+Testing:
+  This module can be tested by running this file from the command line.  A
+  stand-in connector is used, no database is needed.
+
+Debugging:
+  Removing the optimization flag (-OO) from this file will turn debugging on.
+
+Attributes:
+  Class SqlInstrument: Times the statements of a SQL connector
+"""
+__author__ = "Robert Pufky (github.com/r-pufky)"
+import sys
+import time
+import threading
+try:
+  import json
+except ImportError:
+  try:
+    import simplejson as json
+  except ImportError:
+    json = None
+
+
+
+class SqlInstrument(object):
+  """ Times the statements of a SQL connector.
+
+  Attributes:
+    Fork(): Forks the connector, instrumenting the new connector
+    Statistics(): Returns the statistics recorded so far
+    Summary(): Returns a printable summary of the statistics
+    WriteJson(): Writes the statistics to a JSON file
+  """
+  __author__ = "Robert Pufky (github.com/r-pufky)"
+  __version__ = "1.0"
+  # connector methods which are timed; other methods are passed through
+  TIMED = ('Insert', 'InsertMany', 'BulkInsert', 'UpsertMany', 'Update',
+           'Select', 'SelectIter', 'SelectKeys', 'Delete', 'DeleteMany',
+           'ResetTable', 'Commit', 'FinishRebuild')
+  # arguments holding the values sent with each timed method, by position
+  VALUE_ARGUMENTS = {'Insert':(1, 'values'),
+                     'InsertMany':(1, 'rows'),
+                     'BulkInsert':(1, 'rows'),
+                     'UpsertMany':(1, 'rows'),
+                     'Update':(1, 'match_keys', 2, 'update_values'),
+                     'Select':(1, 'match_keys'),
+                     'SelectIter':(1, 'match_keys'),
+                     'SelectKeys':(1, 'match_keys'),
+                     'Delete':(1, 'match_keys'),
+                     'DeleteMany':(1, 'rows')}
+  SLOW_LOG_SIZE = 1000
+
+  def __init__(self, connector=None, slow_seconds=1.0, statistics=None):
+    """ Instruments a connector.
+
+    Args:
+      connector: Connector object to instrument
+      slow_seconds: Float seconds above which a call is logged as slow
+      statistics: Dictionary statistics shared with the connector this was
+          forked from; None to start new statistics
+
+    Kills:
+      sys.exit: Connector not provided
+    """
+    self.__connector = connector
+    self.__DEBUG_INFO = "DEBUG:[SqlInstrument."
+    self.__WARNING_INFO = "WARNING:[SqlInstrument."
+    if not connector:
+      sys.exit("%(debug)s__init__] Connector not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    self.__slow_seconds = slow_seconds
+    if statistics is None:
+      statistics = {'lock':threading.Lock(),
+                    'started':time.time(),
+                    'operations':{},
+                    'slow':[],
+                    'slow_count':0}
+    self.__statistics = statistics
+
+  def __getattr__(self, name):
+    """ Returns a connector attribute, timing it if it is a timed method. """
+    attribute = getattr(self.__connector, name)
+    if name not in self.TIMED:
+      return attribute
+    def Timed(*args, **kwargs):
+      start = time.time()
+      result = attribute(*args, **kwargs)
+      if name == 'SelectIter':
+        return self.__TimedIter(name, args, kwargs, result,
+                                time.time() - start)
+      self.__Record(name, args, kwargs, time.time() - start,
+                    self.__Rows(name, args, kwargs, result))
+      return result
+    return Timed
+
+  def Fork(self):
+    """ Forks the connector, instrumenting the new connector.
+
+    Returns:
+      A new SqlInstrument, adding to the same statistics
+    """
+    return self.__class__(connector=self.__connector.Fork(),
+                          slow_seconds=self.__slow_seconds,
+                          statistics=self.__statistics)
+
+  def __Argument(self, args=None, kwargs=None, position=None, name=None):
+    """ Returns an argument of a call, passed by position or by name. """
+    if len(args) > position:
+      return args[position]
+    return kwargs.get(name)
+
+  def __Rows(self, name=None, args=None, kwargs=None, result=None):
+    """ Returns the number of rows sent or returned by a call.
+
+    Args:
+      name: String connector method called
+      args: Tuple positional arguments of the call
+      kwargs: Dictionary keyword arguments of the call
+      result: Value returned by the call
+
+    Returns:
+      Integer number of rows
+    """
+    if name in ('InsertMany', 'BulkInsert', 'UpsertMany', 'DeleteMany'):
+      return len(self.__Argument(args, kwargs, 1, 'rows') or ())
+    if name in ('Select', 'SelectKeys'):
+      return len(result or ())
+    if name in ('Insert', 'Update', 'Delete'):
+      return 1
+    return 0
+
+  def __Bytes(self, value=None):
+    """ Returns the bytes of a value sent to the database.
+
+    Args:
+      value: Value, or dictionary or list of values
+
+    Returns:
+      Integer bytes of the value, and of the keys of dictionaries
+    """
+    if value is None:
+      return 0
+    if isinstance(value, str):
+      return len(value)
+    if isinstance(value, unicode):
+      return len(value.encode("UTF8"))
+    if isinstance(value, dict):
+      return sum([self.__Bytes(key) + self.__Bytes(item)
+                  for key, item in value.iteritems()])
+    if isinstance(value, (list, tuple)):
+      return sum([self.__Bytes(item) for item in value])
+    return len(str(value))
+
+  def __Record(self, name=None, args=None, kwargs=None, seconds=0.0, rows=0):
+    """ Adds a call to the statistics, and to the slow log if it was slow.
+
+    Args:
+      name: String connector method called
+      args: Tuple positional arguments of the call
+      kwargs: Dictionary keyword arguments of the call
+      seconds: Float seconds the call took
+      rows: Integer rows sent or returned
+    """
+    table = self.__Argument(args, kwargs, 0, 'table') or '-'
+    arguments = self.VALUE_ARGUMENTS.get(name, ())
+    sent = 0
+    for index in xrange(0, len(arguments), 2):
+      sent += self.__Bytes(self.__Argument(args, kwargs, arguments[index],
+                                           arguments[index + 1]))
+    statistics = self.__statistics
+    statistics['lock'].acquire()
+    try:
+      operation = statistics['operations'].setdefault((name, table), {
+          'count':0, 'seconds':0.0, 'rows':0, 'bytes':0, 'latencies':[]})
+      operation['count'] += 1
+      operation['seconds'] += seconds
+      operation['rows'] += rows
+      operation['bytes'] += sent
+      operation['latencies'].append(seconds)
+      if self.__slow_seconds and seconds >= self.__slow_seconds:
+        statistics['slow_count'] += 1
+        if len(statistics['slow']) < self.SLOW_LOG_SIZE:
+          match_keys = None
+          if name in ('Update', 'Select', 'SelectIter', 'SelectKeys',
+                      'Delete'):
+            match_keys = self.__Argument(args, kwargs, 1, 'match_keys')
+          statistics['slow'].append({'operation':name,
+                                     'table':table,
+                                     'seconds':seconds,
+                                     'rows':rows,
+                                     'match_keys':match_keys,
+                                     'time':time.time()})
+    finally:
+      statistics['lock'].release()
+    if __debug__ and self.__slow_seconds and seconds >= self.__slow_seconds:
+      print ("%(debug)s__Record] Slow %(name)s on %(table)s: %(seconds).3fs" %
+             {'debug':self.__DEBUG_INFO,
+              'name':name,
+              'table':table,
+              'seconds':seconds})
+
+  def __TimedIter(self, name=None, args=None, kwargs=None, iterator=None,
+                  seconds=0.0):
+    """ Times the rows read from an iterator, recording them once it ends.
+
+    Args:
+      name: String connector method called
+      args: Tuple positional arguments of the call
+      kwargs: Dictionary keyword arguments of the call
+      iterator: Iterator returned by the call
+      seconds: Float seconds already taken by the call
+
+    Yields:
+      The rows of the iterator
+    """
+    rows = 0
+    try:
+      while True:
+        start = time.time()
+        try:
+          row = iterator.next()
+        except StopIteration:
+          seconds += time.time() - start
+          break
+        seconds += time.time() - start
+        rows += 1
+        yield row
+    finally:
+      if hasattr(iterator, 'close'):
+        iterator.close()
+      self.__Record(name, args, kwargs, seconds, rows)
+
+  def __Percentile(self, latencies=None, percent=None):
+    """ Returns a percentile of sorted latencies, by nearest rank.
+
+    Args:
+      latencies: List of float seconds, sorted
+      percent: Integer percentile (0-100)
+
+    Returns:
+      Float seconds
+    """
+    rank = int(round(percent / 100.0 * len(latencies) + 0.5)) - 1
+    return latencies[max(0, min(rank, len(latencies) - 1))]
+
+  def Statistics(self):
+    """ Returns the statistics recorded so far.
+
+    Returns:
+      A dictionary of statistics, slowest operations first:
+          {'elapsed':seconds since the connector was instrumented,
+           'slow_threshold':seconds above which calls are logged,
+           'slow_count':number of slow calls,
+           'slow':[slow calls, oldest first (first 1000)],
+           'operations':[{'operation','table','count','seconds','rows','bytes',
+                          'mean','p50','p95','p99','max'}]}
+    """
+    statistics = self.__statistics
+    statistics['lock'].acquire()
+    try:
+      operations = []
+      for (name, table), operation in statistics['operations'].iteritems():
+        latencies = sorted(operation['latencies'])
+        operations.append({'operation':name,
+                           'table':table,
+                           'count':operation['count'],
+                           'seconds':operation['seconds'],
+                           'rows':operation['rows'],
+                           'bytes':operation['bytes'],
+                           'mean':operation['seconds'] / operation['count'],
+                           'p50':self.__Percentile(latencies, 50),
+                           'p95':self.__Percentile(latencies, 95),
+                           'p99':self.__Percentile(latencies, 99),
+                           'max':latencies[-1]})
+      slow = [dict(entry) for entry in statistics['slow']]
+      slow_count = statistics['slow_count']
+    finally:
+      statistics['lock'].release()
+    operations.sort(key=lambda operation: operation['seconds'], reverse=True)
+    return {'elapsed':time.time() - statistics['started'],
+            'slow_threshold':self.__slow_seconds,
+            'slow_count':slow_count,
+            'slow':slow,
+            'operations':operations}
+
+  def Summary(self, slow_entries=10):
+    """ Returns a printable summary of the statistics.
+
+    Args:
+      slow_entries: Integer number of the slowest calls to list
+
+    Returns:
+      String summary, one line per operation and table
+    """
+    statistics = self.Statistics()
+    lines = ["SQL statements (%.1fs since connecting):" %
+             statistics['elapsed'],
+             "  %-13s %-24s %8s %9s %8s %8s %8s %8s %9s %11s" % (
+             "operation", "table", "calls", "total s", "p50 ms", "p95 ms",
+             "p99 ms", "max ms", "rows", "bytes sent")]
+    for operation in statistics['operations']:
+      lines.append("  %-13s %-24s %8d %9.2f %8.1f %8.1f %8.1f %8.1f %9d %11d"
+                   % (operation['operation'],
+                      operation['table'],
+                      operation['count'],
+                      operation['seconds'],
+                      operation['p50'] * 1000,
+                      operation['p95'] * 1000,
+                      operation['p99'] * 1000,
+                      operation['max'] * 1000,
+                      operation['rows'],
+                      operation['bytes']))
+    if statistics['slow_threshold']:
+      lines.append("%d calls took over %dms." % (
+          statistics['slow_count'], statistics['slow_threshold'] * 1000))
+      slowest = sorted(statistics['slow'], key=lambda entry: entry['seconds'],
+                       reverse=True)[:slow_entries]
+      for entry in slowest:
+        lines.append(("  %8.1fms %s %s %s" % (entry['seconds'] * 1000,
+                                             entry['operation'],
+                                             entry['table'],
+                                             entry['match_keys'] or '')
+                      ).rstrip())
+    return "\n".join(lines)
+
+  def WriteJson(self, file_name=None):
+    """ Writes the statistics to a JSON file.
+
+    Args:
+      file_name: String file to write
+
+    Returns:
+      Boolean True if the file was written, False otherwise
+    """
+    if not json:
+      print ("%(warn)sWriteJson] JSON is not supported by this python; "
+             "statistics not written." % {'warn':self.__WARNING_INFO})
+      return False
+    try:
+      json_file = open(file_name, "w")
+      try:
+        json.dump(self.Statistics(), json_file, indent=2, default=repr)
+      finally:
+        json_file.close()
+    except IOError, e:
+      print ("%(warn)sWriteJson] Could not write %(file)s: %(error)s" %
+             {'warn':self.__WARNING_INFO,'file':file_name,'error':e})
+      return False
+    if __debug__:
+      print ("%(debug)sWriteJson] Wrote statistics to %(file)s" %
+             {'debug':self.__DEBUG_INFO,'file':file_name})
+    return True
+
+
+
+class _TestConnector(object):
+  """ Stand-in connector, sleeping on Update. """
+
+  def Fork(self):
+    return _TestConnector()
+
+  def Insert(self, table=None, values=None):
+    pass
+
+  def InsertMany(self, table=None, rows=None, batch_size=1000):
+    pass
+
+  def Update(self, table=None, match_keys=None, update_values=None):
+    time.sleep(0.05)
+
+  def Select(self, table=None, match_keys=None, limit=None):
+    return [{'ImageID':1}, {'ImageID':2}]
+
+  def SelectIter(self, table=None, match_keys=None, columns=None,
+                 fetch_size=None):
+    for image_id in xrange(3):
+      yield {'ImageID':image_id}
+
+  def Ping(self):
+    return True
+
+
+
+if __name__ == "__main__":
+  import os
+  import tempfile
+  print "Testing SqlInstrument Class...\n"
+  print "-->Test calls are counted per operation and table:"
+  sql = SqlInstrument(connector=_TestConnector(), slow_seconds=0.02)
+  sql.Insert("Images", {'ImageID':12, 'Caption':u'caf\xe9'})
+  sql.InsertMany(table="Images", rows=[{'ImageID':1}, {'ImageID':2}])
+  sql.Fork().Select("Images", {'ImageID':1})
+  operations = dict([((operation['operation'], operation['table']), operation)
+                     for operation in sql.Statistics()['operations']])
+  if (operations[('Insert', 'Images')]['bytes'] == 21 and
+      operations[('InsertMany', 'Images')]['rows'] == 2 and
+      operations[('Select', 'Images')]['rows'] == 2 and sql.Ping()):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test SelectIter is recorded once read:"
+  rows = list(sql.SelectIter("Images"))
+  operations = dict([((operation['operation'], operation['table']), operation)
+                     for operation in sql.Statistics()['operations']])
+  if len(rows) == 3 and operations[('SelectIter', 'Images')]['rows'] == 3:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test slow calls are logged:"
+  sql.Update("Albums", {'AlbumID':3}, {'AlbumName':'slow'})
+  statistics = sql.Statistics()
+  if (statistics['slow_count'] == 1 and
+      statistics['slow'][0]['match_keys'] == {'AlbumID':3} and
+      statistics['operations'][0]['operation'] == 'Update'):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print sql.Summary()
+  print "\n-->Test JSON output:"
+  json_file = tempfile.mktemp(suffix=".json")
+  if (sql.WriteJson(json_file) and
+      len(json.load(open(json_file))['operations']) == 5):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  os.remove(json_file)
+  print "\n\nTesting completeled successfully!\n\n"
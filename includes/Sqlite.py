@@ -0,0 +1,1214 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+#
+# Copyright 2008, Robert Pufky
+# Exhibit - SQLite Database Connector Class
+#
+""" SQLite database connector class for Exhibit
+
+This supports all of the SQL operations needed by Exhibit, on a local SQLite
+database file instead of a database server.  It implements the connector
+interface of docs/SqlTemplate.py, and the same tables as the MySql connector,
+so a library database can be built locally (i.e. to be shipped elsewhere), or
+imports can be benchmarked, without a MySQL server.
+
+SQLite Setup Notes:
+  SQLite is included with python (sqlite3).  Set type=Sqlite in the [sql]
+  section of the configuration file; database is the path of the database
+  file, which is created if it does not exist.  The address, username and
+  password options are ignored.
+
+Statements:
+  Values are bound to statement placeholders by sqlite3.  The SQL text of each
+  statement shape (statement, table and columns) is built once and cached.
+  Multi-row operations use executemany.
+
+Transactions:
+  The database is in WAL mode, so readers are not blocked while Exhibit
+  writes.  Changes are committed by Commit(), by CommitIfDue() once the
+  interval set with SetCommitInterval() has passed, and by Close().  Each
+  transaction takes the write lock when it starts; SQLite has a single writer,
+  so connectors forked for parallel imports take turns, and waiting on the
+  lock is not an error.
+
+Testing:
+  This module can be tested by running this file from the command line.  A
+  test database is created in the system's temporary directory.
+
+Debugging:
+  Removing the optimization flag (-OO) from this file will turn debugging on.
+
+Attributes:
+  Class Sqlite: Provides a SQLite interface for Exhibit
+"""
+__author__ = "Robert Pufky (github.com/r-pufky)"
+import os
+import sys
+import time
+import sqlite3
+
+
+
+class Sqlite(object):
+  """ Provides a SQLite interface for Exhibit.
+
+  This provides the same SQL functionality as the MySql connector, on a local
+  SQLite database file.
+
+  Attributes:
+    Close(): Closes the SQL connection if opened
+    Fork(): Opens another connector to the same database
+    Ping(): Checks the connection
+    SetCommitInterval(): Sets how often CommitIfDue commits
+    Commit(): Commits the open transaction
+    CommitIfDue(): Commits the open transaction if the commit interval passed
+    CheckTableExists(): Checks if a given table exists in the database
+    ResetTable(): Clears out all table rows
+    CreateTable(): Creates a SQL table in the database
+    EncodeString(): Escapes special DB characters, and encodes string to UTF8
+    DatabaseCheck(): Checks to see if Exhibit tables exist in the database
+    BeginRebuild(): Starts rebuilding the database into staging tables
+    FinishRebuild(): Swaps the rebuilt staging tables in, atomically
+    Insert(): Inserts a new row into a database table
+    InsertMany(): Inserts many new rows, with executemany
+    BulkInsert(): Loads many new rows into an empty table
+    UpsertMany(): Inserts or updates many rows, with executemany
+    Update(): Updates (or creates) a row in a database table
+    Select(): Selects row(s) from a database table
+    SelectIter(): Selects rows from a database table, streamed as they are read
+    SelectKeys(): Selects the keys of all matching rows, streamed
+    Delete(): Deletes a matched row from a database table
+    DeleteMany(): Deletes many matched rows, with executemany
+  """
+  __author__ = "Robert Pufky (github.com/r-pufky)"
+  __version__ = "1.0"
+
+  def __init__(self, connection=None):
+    """ Opens (or creates) a SQLite database file.
+
+    Information passed to initalize the connection is kept in the object, to
+    fork new connectors.  The database is automatically populated with the
+    exhibit database schema - it is not over-written if it already exists.
+
+    Args:
+      connection: Dictionary with connection information:
+          {'database' - path of the SQLite database file
+           'prepend'} - prepend string to use for all tables created
+          Other keys (address, username, password) are ignored.
+
+    Kills:
+      sys.exit: Database cannot be opened
+    """
+    self.__db = None
+    self.__cursor = None
+    self.__connection = None
+    self.__prepend = None
+    self.__DEBUG_INFO = "DEBUG:[Sqlite."
+    self.__WARNING_INFO = "WARNING:[Sqlite."
+    self.__DB_ESCAPE_CHARS = ['"','%']
+    self.__FETCH_BATCH_SIZE = 1000
+    self.__LOCK_TIMEOUT = 300
+    self.__commit_rows = 0
+    self.__commit_seconds = 0
+    self.__uncommitted_rows = 0
+    # rows written since the last commit, as counted by SQLite (for messages)
+    self.__written_rows = 0
+    self.__last_commit = time.time()
+    self.__STAGING_PREPEND = "new_"
+    self.__RETIRED_PREPEND = "old_"
+    self.__UNSTAGED_TABLES = ("iPhotoLibrary",)
+    self.__staging = False
+    # ON CONFLICT ... DO UPDATE is only supported from SQLite 3.24
+    self.__native_upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
+    # statement templates, completed by __Statement; %(values)s, %(set)s and
+    # %(where)s are lists of placeholders for the bound values.  SQLite does
+    # not support LIMIT on UPDATE and DELETE, so the first matching rowid is
+    # used instead.
+    self.__INSERT = "INSERT INTO %(table)s (%(columns)s) VALUES (%(values)s)"
+    self.__INSERT_IGNORE = ("INSERT OR IGNORE INTO %(table)s (%(columns)s) "
+                            "VALUES (%(values)s)")
+    self.__UPDATE = ("UPDATE %(table)s SET %(set)s WHERE rowid IN (SELECT "
+                     "rowid FROM %(table)s WHERE %(where)s LIMIT 1)")
+    self.__UPDATE_ALL = "UPDATE %(table)s SET %(set)s WHERE %(where)s"
+    self.__SELECT = "SELECT %(columns)s FROM %(table)s WHERE %(where)s"
+    self.__SELECT_ALL = "SELECT %(columns)s FROM %(table)s"
+    self.__DELETE = ("DELETE FROM %(table)s WHERE rowid IN (SELECT rowid FROM "
+                     "%(table)s WHERE %(where)s LIMIT 1)")
+    self.__DELETE_ALL = "DELETE FROM %(table)s WHERE %(where)s"
+    self.__statements = {}
+    # Exhibit tables, in creation order: (table, columns, primary key); the
+    # same tables as the MySql connector, in SQLite types
+    self.__TABLES = (
+        ("iPhotoLibrary",
+         "ID INTEGER PRIMARY KEY AUTOINCREMENT, "
+         "ArchiveID INT NOT NULL, "
+         "Path TEXT NOT NULL, "
+         "iPhotoVersion VARCHAR(255) DEFAULT '', "
+         "MajorVersion INT DEFAULT 0, "
+         "MinorVersion INT DEFAULT 0",
+         None),
+        ("Albums",
+         "iPhotoLibraryID INT NOT NULL, "
+         "AlbumID INT NOT NULL, "
+         "AlbumName VARCHAR(255) DEFAULT '', "
+         "AlbumType VARCHAR(255) DEFAULT '', "
+         "FilterMode VARCHAR(255) DEFAULT '', "
+         "Master BOOL DEFAULT 0, "
+         "GUID VARCHAR(36) DEFAULT '', "
+         "PhotoCount INT DEFAULT 0, "
+         "PlayMusic BOOL DEFAULT 0, "
+         "RepeatSlideShow BOOL DEFAULT 0, "
+         "SecondsPerSlide INT DEFAULT 0, "
+         "SlideShowUseTitles BOOL DEFAULT 0, "
+         "SongPath TEXT, "
+         "TransitionDirection TINYINT DEFAULT 0, "
+         "TransitionName VARCHAR(255) DEFAULT 'Dissolve', "
+         "TransitionSpeed FLOAT DEFAULT 0.0, "
+         "PanAndZoom BOOL DEFAULT 0, "
+         "ShuffleSlides BOOL DEFAULT 0, "
+         "Fingerprint CHAR(32) DEFAULT ''",
+         "iPhotoLibraryID, AlbumID"),
+        ("Rolls",
+         "iPhotoLibraryID INT NOT NULL, "
+         "RollID INT NOT NULL, "
+         "RollName VARCHAR(255) DEFAULT '', "
+         "PhotoCount INT DEFAULT 0, "
+         "KeyPhoto INT DEFAULT 0, "
+         "RollDate DATETIME DEFAULT 0, "
+         "RollDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "Fingerprint CHAR(32) DEFAULT ''",
+         "iPhotoLibraryID, RollID"),
+        ("Images",
+         "iPhotoLibraryID INT NOT NULL, "
+         "GUID VARCHAR(36) NOT NULL, "
+         "RollID INT DEFAULT 0, "
+         "ImageID INT NOT NULL, "
+         "Rating TINYINT DEFAULT 0, "
+         "Comment VARCHAR(255) DEFAULT '', "
+         "Caption VARCHAR(255) DEFAULT '', "
+         "MediaType VARCHAR(20) DEFAULT '', "
+         "AspectRatio FLOAT DEFAULT 0.0, "
+         "RotationIsOnlyEdit BOOL DEFAULT 0, "
+         "OriginalDate DATETIME DEFAULT 0, "
+         "OriginalDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "ModifiedDate DATETIME DEFAULT 0, "
+         "ModifiedDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "ImportDate DATETIME DEFAULT 0, "
+         "ImportDateAsAppleTimer FLOAT DEFAULT 0.0, "
+         "ThumbPath TEXT, "
+         "ImagePath TEXT, "
+         "OriginalPath TEXT, "
+         "Fingerprint CHAR(32) DEFAULT ''",
+         "iPhotoLibraryID, ImageID"),
+        ("Filters",
+         "iPhotoLibraryID INT NOT NULL, "
+         "AlbumID INT NOT NULL, "
+         "Count INT DEFAULT 0, "
+         "Operation VARCHAR(255) DEFAULT '', "
+         "Type VARCHAR(255) DEFAULT ''",
+         None),
+        ("Keywords",
+         "KeywordID INT NOT NULL, "
+         "iPhotoLibraryID INT NOT NULL, "
+         "Keyword VARCHAR(255) DEFAULT ''",
+         "KeywordID, iPhotoLibraryID"),
+        ("ImageKeywords",
+         "iPhotoLibraryID INT NOT NULL, "
+         "ImageID INT NOT NULL, "
+         "KeywordID INT NOT NULL",
+         None),
+        ("AlbumImages",
+         "iPhotoLibraryID INT NOT NULL, "
+         "AlbumID INT NOT NULL, "
+         "ImageID INT NOT NULL",
+         None),
+        ("Checkpoints",
+         "iPhotoLibraryID INT NOT NULL, "
+         "TableName VARCHAR(64) NOT NULL, "
+         "LastKey VARCHAR(255) DEFAULT ''",
+         "iPhotoLibraryID, TableName"))
+    if not connection or not connection.get('database'):
+      sys.exit("%(debug)s__init__] SQLite database file not provided!" %
+               {'debug':self.__DEBUG_INFO})
+    if __debug__:
+      print ("%(debug)s__init__] SQLite connection information: "
+             "%(connection)s" % {'debug':self.__DEBUG_INFO,
+                                 'connection':connection})
+    self.__connection = dict(connection)
+    self.__connection['database'] = os.path.expanduser(connection['database'])
+    self.__prepend = connection['prepend']
+    try:
+      self.__Connect()
+      if __debug__:
+        print ("%(debug)s__init__] SQLite database opened successfully!" %
+               {'debug':self.__DEBUG_INFO})
+    except sqlite3.Error, e:
+      sys.exit("%(debug)s__init__] SQLite ERROR: %(error)s\n"
+               "%(debug)s__init__] Cannot open SQLite database %(file)s." %
+               {'debug':self.__DEBUG_INFO,
+                'error':e,
+                'file':self.__connection['database']})
+    self.DatabaseCheck(force=False)
+
+  def __del__(self):
+    """ Runs any cleanup needed when object is deleted. """
+    self.Close()
+
+  def Close(self):
+    """ Closes the SQL connection if opened. """
+    if self.__db:
+      self.__db.commit()
+      if __debug__:
+        print ("%(debug)sClose] Committed database changes." %
+               {'debug':self.__DEBUG_INFO})
+      self.__db.close()
+      self.__db = None
+      if __debug__:
+        print ("%(debug)sClose] Closed database connection." %
+               {'debug':self.__DEBUG_INFO})
+
+  def __Connect(self):
+    """ Opens the database file, in WAL mode.
+
+    Rows are returned as UTF8 byte strings, as they are by the MySql
+    connector.  The connection may be handed between threads, but must only be
+    used by one thread at a time.
+
+    Raises:
+      sqlite3.Error: Database cannot be opened
+    """
+    self.__db = sqlite3.connect(self.__connection['database'],
+                                timeout=self.__LOCK_TIMEOUT,
+                                isolation_level="IMMEDIATE",
+                                check_same_thread=False)
+    self.__db.text_factory = str
+    self.__cursor = self.__db.cursor()
+    self.__cursor.execute("PRAGMA journal_mode=WAL")
+    self.__cursor.execute("PRAGMA synchronous=NORMAL")
+
+  def Fork(self):
+    """ Opens another connector to the same database, i.e. for a worker thread.
+
+    The new connector has its own connection and transaction, and uses the same
+    commit interval and staging tables.
+
+    Kills:
+      sys.exit: Database cannot be opened
+
+    Returns:
+      A new connector object
+    """
+    connector = self.__class__(connection=self.__connection)
+    connector.SetCommitInterval(self.__commit_rows, self.__commit_seconds)
+    connector.__staging = self.__staging
+    return connector
+
+  def Ping(self):
+    """ Checks the connection.
+
+    A local database cannot be lost like a server connection; this only checks
+    the database can still be read.
+
+    Returns:
+      Boolean True if the connection is usable, False otherwise
+    """
+    try:
+      self.__db.execute("SELECT 1").fetchall()
+      return True
+    except sqlite3.Error, e:
+      print ("%(warn)sPing] SQLite ERROR: %(error)s" %
+             {'warn':self.__WARNING_INFO,'error':e})
+      return False
+
+  def SetCommitInterval(self, rows=None, seconds=None):
+    """ Sets how often CommitIfDue commits the open transaction.
+
+    Args:
+      rows: Integer rows written between commits; None or 0 to not count rows
+      seconds: Integer seconds between commits; None or 0 to not time commits
+    """
+    self.__commit_rows = rows or 0
+    self.__commit_seconds = seconds or 0
+    if __debug__:
+      print ("%(debug)sSetCommitInterval] Committing every %(rows)s rows or "
+             "%(seconds)s seconds" % {'debug':self.__DEBUG_INFO,
+                                      'rows':self.__commit_rows,
+                                      'seconds':self.__commit_seconds})
+
+  def Commit(self):
+    """ Commits the open transaction.
+
+    Kills:
+      sys.exit: Commit fails on the database
+    """
+    try:
+      self.__db.commit()
+    except sqlite3.Error, e:
+      sys.exit("%(debug)sCommit] SQLite ERROR: %(error)s\n"
+               "%(debug)sCommit] SQLite commit failed: %(rows)s rows were not "
+               "saved." % {'debug':self.__DEBUG_INFO,
+                           'error':e,
+                           'rows':self.__written_rows})
+    if __debug__:
+      print ("%(debug)sCommit] Committed %(rows)s rows." %
+             {'debug':self.__DEBUG_INFO,'rows':self.__written_rows})
+    self.__uncommitted_rows = 0
+    self.__written_rows = 0
+    self.__last_commit = time.time()
+
+  def CommitIfDue(self, rows=0):
+    """ Commits the open transaction, if the commit interval has passed.
+
+    Args:
+      rows: Integer rows written since the last call
+
+    Kills:
+      sys.exit: Commit fails on the database
+
+    Returns:
+      Boolean True if the transaction was committed, False otherwise
+    """
+    self.__uncommitted_rows += rows
+    if ((self.__commit_rows and
+         self.__uncommitted_rows >= self.__commit_rows) or
+        (self.__commit_seconds and
+         time.time() - self.__last_commit >= self.__commit_seconds)):
+      self.Commit()
+      return True
+    return False
+
+  def __TableNames(self):
+    """ Returns the names of the tables matching the prepend string.
+
+    Raises:
+      sqlite3.Error: Tables cannot be listed
+
+    Returns:
+      A list of string table names, with prepend characters
+    """
+    self.__cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    return [row[0] for row in self.__cursor.fetchall()
+            if row[0].startswith(self.__prepend)]
+
+  def CheckTableExists(self, table=None):
+    """ Checks to see if a table exists in the database.
+
+    Restricts query to only tables matching the prepend string.
+
+    Args:
+      table: String table to check (without prepend characters)
+
+    Returns:
+      A boolean True if table exists, False otherwise
+    """
+    if not table:
+      return False
+    return "%s%s" % (self.__prepend, table) in self.__TableNames()
+
+  def ResetTable(self, table=None):
+    """ Clears out all rows of a table, if it the table exists.
+
+    This automatically runs CheckTableExists, and will clear the table if it
+    exists; does not change the column labels (if they are outdated).
+
+    Args:
+      table: String table to check (without prepend characters)
+
+    Returns:
+      A boolean True if successful, False otherwise
+    """
+    if not table or not self.CheckTableExists(table):
+      return False
+    self.__cursor.execute("DELETE FROM %s%s" % (self.__prepend, table))
+    self.__db.commit()
+    return True
+
+  def CreateTable(self, query=None, readable_name=None):
+    """ Creates a SQL table in the database.
+
+    Args:
+      query: String SQL query to use to create the table
+      readable_name: String human readable name to use if debugging
+
+    Raises:
+      sqlite3.Error: Table creation failed
+    """
+    self.__cursor.execute(query)
+    if __debug__:
+      print ("%(debug)sDatabaseCheck] Created table %(pre)s%(name)s" % {
+            'debug':self.__DEBUG_INFO,
+            'pre':self.__prepend,
+            'name':readable_name})
+
+  def EncodeString(self, string_data=None):
+    """ Escapes special DB characters, and encodes string to UTF8.
+
+    Values passed to Insert, Update, Select, Delete and the other statement
+    methods are bound by sqlite3 instead, and must not be escaped with this.
+
+    Args:
+      string_data: String data to escape
+
+    Raises:
+      UnicodeEncodeError: UTF8 encoding is not supported
+
+    Returns:
+      String escaped string, or original value if not a string
+    """
+    if string_data:
+      if isinstance(string_data, str) or isinstance(string_data, unicode):
+        for escapee in self.__DB_ESCAPE_CHARS:
+          string_data = string_data.replace(escapee,"\%s" % escapee)
+        string_data = string_data.encode("UTF8")
+        if __debug__:
+          print ("%(debug)sEncodeString] converted: %(string)s" %
+                 {'debug':self.__DEBUG_INFO,'string':string_data})
+    return string_data
+
+  def __AddMissingColumn(self, table=None, column=None, definition=None):
+    """ Adds a column to a table created by an older version of Exhibit.
+
+    Args:
+      table: String table to check (without prepend characters)
+      column: String column name
+      definition: String SQL column definition, i.e. "CHAR(32) DEFAULT ''"
+
+    Raises:
+      sqlite3.Error: Column check or creation failed
+    """
+    self.__cursor.execute("PRAGMA table_info(%s%s)" % (self.__prepend, table))
+    if column in [row[1] for row in self.__cursor.fetchall()]:
+      return
+    self.__cursor.execute("ALTER TABLE %s%s ADD COLUMN %s %s" % (
+                          self.__prepend, table, column, definition))
+    print ("%(warn)sDatabaseCheck] Added column %(column)s to table "
+           "%(pre)s%(table)s" % {'warn':self.__WARNING_INFO,
+                                'column':column,
+                                'pre':self.__prepend,
+                                'table':table})
+
+  def __CreateStatement(self, table=None, columns=None, primary_key=None):
+    """ Builds the CREATE TABLE statement of an Exhibit table.
+
+    Args:
+      table: String full table name, with prepend characters
+      columns: String SQL column definitions
+      primary_key: String primary key columns; None for no primary key
+
+    Returns:
+      String SQL statement
+    """
+    if primary_key:
+      columns = "%s, PRIMARY KEY(%s)" % (columns, primary_key)
+    return "CREATE TABLE IF NOT EXISTS %s (%s)" % (table, columns)
+
+  def DatabaseCheck(self, force=False):
+    """ Checks to see if the database tables for Exhibit exist already.
+
+    If they don't exist, they are created.  If the force option is specified, it
+    will drop the tables that exist before re-creating them.  Columns added in
+    later versions of Exhibit are added to existing tables.
+
+    Args:
+      force: Boolean True if forcing re-creation of tables (DATA DESTRUCTIVE)
+
+    Kills:
+      sys.exit: Table creation fails on the database
+    """
+    try:
+      if force:
+        if __debug__:
+          print ("%(debug)sDatabaseCheck] Force option specified, dropping "
+                 "tables..." % {'debug':self.__DEBUG_INFO})
+        for table in self.__TableNames():
+          self.__cursor.execute("DROP TABLE IF EXISTS %s" % table)
+          print ("%(warn)sDatabaseCheck] Dropped table %(table)s" %
+                 {'warn':self.__WARNING_INFO,'table':table})
+      for table, columns, primary_key in self.__TABLES:
+        self.CreateTable(query=self.__CreateStatement(
+            "%s%s" % (self.__prepend, table), columns, primary_key),
+            readable_name=table)
+      for table in ("Albums", "Rolls", "Images"):
+        self.__AddMissingColumn(table, "Fingerprint", "CHAR(32) DEFAULT ''")
+      self.__db.commit()
+    except sqlite3.Error, e:
+      sys.exit("%(debug)sDatabaseCheck] SQLite ERROR: %(error)s\n"
+               "%(debug)sDatabaseCheck] Could not add table to database." %
+               {'debug':self.__DEBUG_INFO,'error':e})
+
+  def __TableName(self, table=None):
+    """ Returns the full name of a table, as used in SQL statements.
+
+    While a rebuild is in progress, this is the name of the staging table.
+
+    Args:
+      table: String table (without prepend characters)
+
+    Returns:
+      String table name, with prepend characters
+    """
+    if self.__staging and table not in self.__UNSTAGED_TABLES:
+      return "%s%s%s" % (self.__prepend, self.__STAGING_PREPEND, table)
+    return "%s%s" % (self.__prepend, table)
+
+  def BeginRebuild(self):
+    """ Starts rebuilding the database into empty staging tables.
+
+    Staging tables are created next to the live tables (i.e. exhibit_new_Images
+    for exhibit_Images).  SQLite cannot add a primary key to an existing table,
+    so staging tables are created with theirs.  Until FinishRebuild is called,
+    all statements use the staging tables; the live tables are not touched, and
+    readers keep seeing the old data.  The iPhotoLibrary table is not staged,
+    so library IDs are kept.  Staging tables left over by an interrupted
+    rebuild are dropped.
+
+    Kills:
+      sys.exit: Table creation fails on the database
+    """
+    try:
+      for table, columns, primary_key in self.__TABLES:
+        if table in self.__UNSTAGED_TABLES:
+          continue
+        for prepend in (self.__STAGING_PREPEND, self.__RETIRED_PREPEND):
+          self.__cursor.execute("DROP TABLE IF EXISTS %s%s%s" % (
+                                self.__prepend, prepend, table))
+        self.CreateTable(query=self.__CreateStatement(
+            "%s%s%s" % (self.__prepend, self.__STAGING_PREPEND, table),
+            columns, primary_key),
+            readable_name=self.__STAGING_PREPEND + table)
+      self.__db.commit()
+    except sqlite3.Error, e:
+      sys.exit("%(debug)sBeginRebuild] SQLite ERROR: %(error)s\n"
+               "%(debug)sBeginRebuild] Could not create staging tables." %
+               {'debug':self.__DEBUG_INFO,'error':e})
+    self.__staging = True
+
+  def FinishRebuild(self):
+    """ Swaps the staging tables with the live tables.
+
+    The tables are renamed in a single transaction, so readers see either the
+    old or the new data.  The old tables are dropped afterwards.
+
+    Kills:
+      sys.exit: Swapping tables fails on the database
+    """
+    if not self.__staging:
+      sys.exit("%(debug)sFinishRebuild] No rebuild in progress!" %
+               {'debug':self.__DEBUG_INFO})
+    self.Commit()
+    # sqlite3 commits before each ALTER TABLE on its own; the transaction is
+    # managed here instead, so all renames commit together
+    self.__db.isolation_level = None
+    try:
+      try:
+        self.__cursor.execute("BEGIN IMMEDIATE")
+        for table, columns, primary_key in self.__TABLES:
+          if table in self.__UNSTAGED_TABLES:
+            continue
+          self.__cursor.execute("ALTER TABLE %(pre)s%(table)s RENAME TO "
+                                "%(pre)s%(old)s%(table)s" % {
+                                'pre':self.__prepend,
+                                'old':self.__RETIRED_PREPEND,
+                                'table':table})
+          self.__cursor.execute("ALTER TABLE %(pre)s%(new)s%(table)s RENAME "
+                                "TO %(pre)s%(table)s" % {
+                                'pre':self.__prepend,
+                                'new':self.__STAGING_PREPEND,
+                                'table':table})
+        self.__cursor.execute("COMMIT")
+      except sqlite3.Error, e:
+        self.__cursor.execute("ROLLBACK")
+        sys.exit("%(debug)sFinishRebuild] SQLite ERROR: %(error)s\n"
+                 "%(debug)sFinishRebuild] Could not swap in the rebuilt "
+                 "tables; the live tables were not changed." %
+                 {'debug':self.__DEBUG_INFO,'error':e})
+    finally:
+      self.__db.isolation_level = "IMMEDIATE"
+    self.__staging = False
+    try:
+      for table, columns, primary_key in self.__TABLES:
+        if table not in self.__UNSTAGED_TABLES:
+          self.__cursor.execute("DROP TABLE IF EXISTS %s%s%s" % (
+                                self.__prepend, self.__RETIRED_PREPEND, table))
+      self.__db.commit()
+    except sqlite3.Error, e:
+      print ("%(warn)sFinishRebuild] Could not drop the old tables: "
+             "%(error)s" % {'warn':self.__WARNING_INFO,'error':e})
+    if __debug__:
+      print ("%(debug)sFinishRebuild] Rebuilt tables are live." %
+             {'debug':self.__DEBUG_INFO})
+
+  def __Statement(self, template=None, table=None, columns=(),
+                  match_columns=()):
+    """ Returns the SQL text of a statement, with placeholders for its values.
+
+    The text is built once for each statement shape, and cached.  Placeholders
+    are in columns order, followed by match_columns order.
+
+    Args:
+      template: String statement template, i.e. self.__INSERT
+      table: String table to use, without prepend string
+      columns: Tuple of columns to insert, update or select
+      match_columns: Tuple of columns used to match rows
+
+    Returns:
+      String SQL statement, i.e. INSERT INTO db_test (key1) VALUES (?)
+    """
+    if table:
+      table = self.__TableName(table)
+    key = (template, table, columns, match_columns)
+    if key not in self.__statements:
+      self.__statements[key] = template % {
+          'table':table,
+          'columns':", ".join(columns),
+          'values':", ".join(["?"] * len(columns)),
+          'set':", ".join(["%s=?" % column for column in columns]),
+          'where':" AND ".join(["%s=?" % column
+                                for column in match_columns])}
+      if __debug__:
+        print ("%(debug)s__Statement] Cached statement: %(sql)s" %
+               {'debug':self.__DEBUG_INFO,'sql':self.__statements[key]})
+    return self.__statements[key]
+
+  def __Columns(self, values=None):
+    """ Returns the sorted columns of a dictionary, as a tuple.
+
+    Args:
+      values: Dictionary key/value pairs
+
+    Returns:
+      A tuple of the dictionary's keys, sorted
+    """
+    columns = values.keys()
+    columns.sort()
+    return tuple(columns)
+
+  def __GroupByColumns(self, rows=None):
+    """ Groups rows by the columns they have, in first seen order.
+
+    Args:
+      rows: List of dictionaries of key/value pairs
+
+    Returns:
+      A list of tuples (columns, rows), with the sorted tuple of columns
+    """
+    groups = {}
+    order = []
+    for row in rows:
+      columns = self.__Columns(row)
+      if columns not in groups:
+        groups[columns] = []
+        order.append(columns)
+      groups[columns].append(row)
+    return [(group_columns, groups[group_columns]) for group_columns in order]
+
+  def __ExecuteMany(self, caller=None, table=None, sql=None, columns=None,
+                    rows=None, batch_size=None):
+    """ Executes a statement for many rows, with executemany.
+
+    Args:
+      caller: String name of the calling method, for error messages
+      table: String table used, for error messages
+      sql: String SQL statement, with placeholders for columns
+      columns: Tuple of the columns bound to the placeholders, in order
+      rows: List of dictionaries of key/value pairs
+      batch_size: Integer maximum number of rows per executemany call
+
+    Kills:
+      sys.exit: Statement fails on the database
+    """
+    if __debug__:
+      print ("%(debug)s%(caller)s] SQL statement to use: %(sql)s (%(rows)s "
+             "rows)" % {'debug':self.__DEBUG_INFO,
+                        'caller':caller,
+                        'sql':sql,
+                        'rows':len(rows)})
+    for start in xrange(0, len(rows), batch_size):
+      batch = rows[start:start + batch_size]
+      try:
+        self.__cursor.executemany(sql, [[row[column] for column in columns]
+                                        for row in batch])
+        self.__written_rows += max(self.__cursor.rowcount, 0)
+      except sqlite3.Error, e:
+        sys.exit("%(debug)s%(caller)s] SQLite ERROR: %(error)s\n"
+                 "%(debug)s%(caller)s] SQLite statement failed for %(rows)s "
+                 "rows of %(table)s.\n"
+                 "%(debug)s%(caller)s] ==> SQL statement: %(sql)s" % {
+                 'debug':self.__DEBUG_INFO,
+                 'caller':caller,
+                 'error':e,
+                 'rows':len(batch),
+                 'table':table,
+                 'sql':sql})
+
+  def __Execute(self, caller=None, sql=None, parameters=None):
+    """ Executes a statement on the connector's cursor.
+
+    Args:
+      caller: String name of the calling method, for error messages
+      sql: String SQL statement, with placeholders for parameters
+      parameters: List of values to bind
+
+    Kills:
+      sys.exit: Statement fails on the database
+    """
+    if __debug__:
+      print ("%(debug)s%(caller)s] SQL statement to use: %(sql)s %(values)s" %
+             {'debug':self.__DEBUG_INFO,
+              'caller':caller,
+              'sql':sql,
+              'values':parameters})
+    try:
+      self.__cursor.execute(sql, parameters)
+      self.__written_rows += max(self.__cursor.rowcount, 0)
+    except sqlite3.Error, e:
+      sys.exit("%(debug)s%(caller)s] SQLite ERROR: %(error)s\n"
+               "%(debug)s%(caller)s] SQLite statement failed.\n"
+               "%(debug)s%(caller)s] ==> SQL statement: %(sql)s %(values)s" % {
+               'debug':self.__DEBUG_INFO,
+               'caller':caller,
+               'error':e,
+               'sql':sql,
+               'values':parameters})
+
+  def Insert(self, table=None, values=None):
+    """ Inserts a new entry into an existing database table.
+
+    Args:
+      table: String table to use, without prepend string
+      values: Dictionary key/value pairs to be inserted
+          {'MyKey':253,
+          'SomeData':"data for column 'SomeData'",
+          'MoreData':"data for column 'MoreData'"}
+
+    Kills:
+      sys.exit: Insert fails on the database
+    """
+    if not table or not values:
+      sys.exit("%(debug)sInsert] SQLite database insert failed.\n"
+               "%(debug)sInsert] Cannot insert empty values or tables into "
+               "database." % {'debug':self.__DEBUG_INFO})
+    # i.e. INSERT INTO db_test (key1, key2) VALUES (?, ?) with ("23", "hello")
+    columns = self.__Columns(values)
+    self.__Execute("Insert", self.__Statement(self.__INSERT, table, columns),
+                   [values[column] for column in columns])
+
+  def InsertMany(self, table=None, rows=None, batch_size=1000):
+    """ Inserts many new rows into an existing database table.
+
+    Rows are sent with executemany, up to batch_size rows per call.  Rows with
+    different columns are sent in separate statements.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs, as used by Insert
+      batch_size: Integer maximum number of rows per call
+
+    Kills:
+      sys.exit: Insert fails on the database
+    """
+    if not table or not batch_size:
+      sys.exit("%(debug)sInsertMany] SQLite database insert failed.\n"
+               "%(debug)sInsertMany] Cannot insert without a table or batch "
+               "size." % {'debug':self.__DEBUG_INFO})
+    for columns, group in self.__GroupByColumns(rows or []):
+      self.__ExecuteMany("InsertMany", table,
+                         self.__Statement(self.__INSERT, table, columns),
+                         columns, group, batch_size)
+
+  def BulkInsert(self, table=None, rows=None):
+    """ Loads many new rows into a table.
+
+    SQLite has no bulk loader; executemany in a single transaction is the
+    fastest way to load rows, so this is the same as InsertMany.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs, as used by Insert
+
+    Kills:
+      sys.exit: Insert fails on the database
+    """
+    if not table:
+      sys.exit("%(debug)sBulkInsert] SQLite database insert failed.\n"
+               "%(debug)sBulkInsert] Cannot insert without a table." %
+               {'debug':self.__DEBUG_INFO})
+    rows = rows or []
+    self.InsertMany(table, rows, len(rows) or 1)
+
+  def UpsertMany(self, table=None, rows=None, key_columns=None,
+                 batch_size=500):
+    """ Inserts rows, updating existing rows with the same key instead.
+
+    Rows are sent with executemany as INSERT ... ON CONFLICT DO UPDATE
+    statements, up to batch_size rows per call.  SQLite older than 3.24 does
+    not support this, and rows are updated, then inserted if missing, instead.
+    Rows with different columns are sent in separate statements.  Only the
+    columns present in a row are updated.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs, as used by Insert
+      key_columns: List of the columns in the table's primary key
+      batch_size: Integer maximum number of rows per call
+
+    Kills:
+      sys.exit: Upsert fails on the database
+    """
+    if not table or not key_columns or not batch_size:
+      sys.exit("%(debug)sUpsertMany] SQLite database upsert failed.\n"
+               "%(debug)sUpsertMany] Cannot upsert without a table, key "
+               "columns or batch size." % {'debug':self.__DEBUG_INFO})
+    key_columns = tuple(key_columns)
+    for columns, group in self.__GroupByColumns(rows or []):
+      updates = tuple([column for column in columns
+                       if column not in key_columns])
+      if self.__native_upsert:
+        # i.e. INSERT INTO db_test (key1, key2) VALUES (?, ?)
+        #      ON CONFLICT(key1) DO UPDATE SET key2=excluded.key2
+        sql = self.__Statement(self.__INSERT, table, columns)
+        if updates:
+          sql += " ON CONFLICT(%s) DO UPDATE SET %s" % (
+              ", ".join(key_columns),
+              ", ".join(["%s=excluded.%s" % (column, column)
+                         for column in updates]))
+        else:
+          sql += " ON CONFLICT(%s) DO NOTHING" % ", ".join(key_columns)
+        self.__ExecuteMany("UpsertMany", table, sql, columns, group,
+                           batch_size)
+        continue
+      if updates:
+        self.__ExecuteMany("UpsertMany", table,
+                           self.__Statement(self.__UPDATE_ALL, table, updates,
+                                            key_columns),
+                           updates + key_columns, group, batch_size)
+      self.__ExecuteMany("UpsertMany", table,
+                         self.__Statement(self.__INSERT_IGNORE, table,
+                                          columns),
+                         columns, group, batch_size)
+
+  def Update(self, table=None, match_keys=None, update_values=None):
+    """ Updates an existing database entry with given information.
+
+    A query limit of 1 record change is automatically imposed on the query.
+    Keys passed must exist in the database as columns.
+
+    Args:
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs that are used to match updates
+          {'MyKey':253,
+          'SomeData':"data for column 'SomeData'"}
+      update_values: Dictionarykey/value pairs to insert into the database
+          {'MoreData':"new data for column 'MoreData'",
+          'EvenMoreData':"new data for column 'EvenMoreData'"}
+
+    Kills:
+      sys.exit: Update fails on the database
+    """
+    if not table or not match_keys or not update_values:
+      sys.exit("%(debug)sUpdate] SQLite database update failed.  Cannot "
+               "update rows.\n"
+               "%(debug)sUpdate] Empty values, tables or match keys were "
+               "provided." % {'debug':self.__DEBUG_INFO})
+    columns = self.__Columns(update_values)
+    match_columns = self.__Columns(match_keys)
+    self.__Execute("Update",
+                   self.__Statement(self.__UPDATE, table, columns,
+                                    match_columns),
+                   [update_values[column] for column in columns] +
+                   [match_keys[column] for column in match_columns])
+
+  def __OpenCursor(self, caller=None, table=None, match_keys=None,
+                   columns=("*",)):
+    """ Executes a select statement on a new cursor.
+
+    SQLite reads rows as they are fetched, so the rows are not stored on the
+    client until they are fetched from the cursor.
+
+    Args:
+      caller: String name of the calling method, for error messages
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs used to match rows; None for all
+      columns: Tuple of columns to select
+
+    Kills:
+      sys.exit: Select fails on the database
+
+    Returns:
+      A sqlite3 cursor, positioned before the first row
+    """
+    if match_keys:
+      match_columns = self.__Columns(match_keys)
+      sql = self.__Statement(self.__SELECT, table, columns, match_columns)
+      parameters = [match_keys[column] for column in match_columns]
+    else:
+      sql = self.__Statement(self.__SELECT_ALL, table, columns)
+      parameters = []
+    if __debug__:
+      print ("%(debug)s%(caller)s] SQL statement to use: %(sql)s %(values)s" %
+             {'debug':self.__DEBUG_INFO,
+              'caller':caller,
+              'sql':sql,
+              'values':parameters})
+    try:
+      return self.__db.execute(sql, parameters)
+    except sqlite3.Error, e:
+      sys.exit("%(debug)s%(caller)s] SQLite ERROR: %(error)s\n"
+               "%(debug)s%(caller)s] SQLite select failed: could not select\n"
+               "%(debug)s%(caller)s] ==> SQL statement: %(sql)s %(values)s" % {
+               'debug':self.__DEBUG_INFO,
+               'caller':caller,
+               'error':e,
+               'sql':sql,
+               'values':parameters})
+
+  def Select(self, table=None, match_keys=None, limit=None):
+    """ Selects information from the database.
+
+    This is a very basic select interface for Exhibit, there is no need to
+    support the more advanced select attributes as they are not used here.
+
+    Args:
+      table: String table to use, without prepend string
+      keys: Dictionary key/value pairs that will be used to match selection
+          {'MyKey':253,
+          'SomeData':"data for column 'SomeData'"}
+      limit: Integer maximum number of results to retrieve
+
+    Kills:
+      sys.exit: Select fails on the database
+
+    Returns:
+      A list of dict's containing result values; None if no results
+    """
+    if not table or not match_keys:
+      sys.exit("%(debug)sSelect] SQLite database select failed.\n"
+               "%(debug)sSelect] Cannot select with empty table or match "
+               "keys." % {'debug':self.__DEBUG_INFO})
+    results = []
+    for row in self.SelectIter(table, match_keys):
+      results.append(row)
+      if limit and isinstance(limit, int) and len(results) >= limit:
+        break
+    if results:
+      return results
+    else:
+      return None
+
+  def SelectIter(self, table=None, match_keys=None, columns=None,
+                 fetch_size=None):
+    """ Selects rows from the database, streamed as they are read.
+
+    Rows are read from the database file fetch_size rows at a time, so tables
+    of any size are read in constant memory.  The connector cannot commit
+    until every row was read, or the generator was closed.
+
+    Args:
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs that will be used to match rows;
+          None to select every row
+      columns: List of columns to select; None for all columns
+      fetch_size: Integer rows fetched at a time; None for the default (1000)
+
+    Kills:
+      sys.exit: Select fails on the database
+
+    Yields:
+      A dictionary of column/value pairs for each row
+    """
+    if not table:
+      sys.exit("%(debug)sSelectIter] SQLite database select failed.\n"
+               "%(debug)sSelectIter] Cannot select with an empty table." %
+               {'debug':self.__DEBUG_INFO})
+    fetch_size = fetch_size or self.__FETCH_BATCH_SIZE
+    cursor = self.__OpenCursor("SelectIter", table, match_keys,
+                               tuple(columns or ("*",)))
+    try:
+      names = [description[0] for description in cursor.description]
+      while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+          break
+        for row in batch:
+          yield dict(zip(names, row))
+    finally:
+      cursor.close()
+
+  def SelectKeys(self, table=None, match_keys=None, key_columns=None,
+                 value_column=None):
+    """ Selects the keys of all matching rows, in one streamed query.
+
+    Rows are read in batches, instead of being stored first, so this can be
+    used on tables of any size to find out which rows exist without a query
+    per row.
+
+    Args:
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs that will be used to match rows
+      key_columns: List of columns making up a row's key
+      value_column: String column to return for each key; None for keys only
+
+    Kills:
+      sys.exit: Select fails on the database
+
+    Returns:
+      A set of keys; a dictionary of key to value if value_column is given.
+      Keys are strings for a single key column, tuples of strings otherwise.
+    """
+    if not table or not match_keys or not key_columns:
+      sys.exit("%(debug)sSelectKeys] SQLite database select failed.\n"
+               "%(debug)sSelectKeys] Cannot select with empty table, match "
+               "keys or key columns." % {'debug':self.__DEBUG_INFO})
+    columns = tuple(key_columns)
+    if value_column:
+      columns += (value_column,)
+    key_count = len(key_columns)
+    if value_column:
+      results = {}
+    else:
+      results = set()
+    cursor = self.__OpenCursor("SelectKeys", table, match_keys, columns)
+    try:
+      while True:
+        batch = cursor.fetchmany(self.__FETCH_BATCH_SIZE)
+        if not batch:
+          break
+        for row in batch:
+          if key_count == 1:
+            key = str(row[0])
+          else:
+            key = tuple([str(value) for value in row[:key_count]])
+          if value_column:
+            results[key] = row[key_count]
+          else:
+            results.add(key)
+    finally:
+      cursor.close()
+    if __debug__:
+      print ("%(debug)sSelectKeys] Selected %(count)s keys from %(table)s" %
+             {'debug':self.__DEBUG_INFO,'count':len(results),'table':table})
+    return results
+
+  def Delete(self, table=None, match_keys=None):
+    """ Deletes a specified database entry with the given information.
+
+    A query limit of 1 record change is automatically imposed on the query.
+    Keys passed must exist in the database as columns.
+
+    Args:
+      table: String table to use, without prepend string
+      match_keys: Dictionary key/value pairs used to match row to delete
+          {'MyKey':253,
+          'SomeData':"data for column 'SomeData'"}
+
+    Kills:
+      sys.exit: Delete fails on the database
+    """
+    if not table or not match_keys:
+      sys.exit("%(debug)sDelete] SQLite database delete failed.\n"
+               "%(debug)sDelete] Cannot delete with empty table or match keys."
+               % {'debug':self.__DEBUG_INFO})
+    match_columns = self.__Columns(match_keys)
+    self.__Execute("Delete",
+                   self.__Statement(self.__DELETE, table, (), match_columns),
+                   [match_keys[column] for column in match_columns])
+
+  def DeleteMany(self, table=None, rows=None, batch_size=1000):
+    """ Deletes many rows, matched on all of their columns.
+
+    Rows are sent with executemany, up to batch_size rows per call.  Rows with
+    different columns are sent in separate statements.  Unlike Delete, every
+    matching row is deleted, not only the first one.
+
+    Args:
+      table: String table to use, without prepend string
+      rows: List of dictionaries of key/value pairs used to match rows
+      batch_size: Integer maximum number of rows per call
+
+    Kills:
+      sys.exit: Delete fails on the database
+    """
+    if not table or not batch_size:
+      sys.exit("%(debug)sDeleteMany] SQLite database delete failed.\n"
+               "%(debug)sDeleteMany] Cannot delete without a table or batch "
+               "size." % {'debug':self.__DEBUG_INFO})
+    for columns, group in self.__GroupByColumns(rows or []):
+      self.__ExecuteMany("DeleteMany", table,
+                         self.__Statement(self.__DELETE_ALL, table, (),
+                                          columns),
+                         columns, group, batch_size)
+
+
+
+if __name__ == "__main__":
+  import tempfile
+  print "Testing Sqlite Connector Class...\n"
+  print "-->Test database creation:"
+  test_directory = tempfile.mkdtemp(prefix="exhibit_")
+  sql_connection = {'database':os.path.join(test_directory, "exhibit.db"),
+                    'prepend':'exhibit_test_'}
+  sql = Sqlite(connection=sql_connection)
+  print "-->PASS!\n"
+  print "-->Test forced database reset:"
+  sql.DatabaseCheck(force=True)
+  print "-->PASS!\n"
+  print "-->Test Insert:"
+  sql.Insert("Albums",{'iPhotoLibraryID':'1',
+                       'GUID':'asdf-asdf-asdf-asdf',
+                       'AlbumID':'2'})
+  print "-->PASS!\n"
+  print "-->Test CheckTableExists:"
+  if sql.CheckTableExists("Albums"):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test Update:"
+  sql.Update("Albums",{'AlbumID':'2'},{'iPhotoLibraryID':'123123'})
+  print "-->PASS!\n"
+  print "-->Test Select:"
+  print sql.Select("Albums",{'iPhotoLibraryID':'123123'},limit=1)
+  select_results = sql.Select("Albums",{'iPhotoLibraryID':'555555'})
+  if select_results:
+    print "-->FAIL!\n"
+  else:
+    print "-->PASS!\n"
+  print "-->Test quotes and percent signs are stored unchanged:"
+  album_name = '50% off "sale" \\ it\'s %s'
+  sql.Insert("Albums",{'iPhotoLibraryID':'1',
+                       'AlbumID':'3',
+                       'AlbumName':album_name})
+  select_results = sql.Select("Albums",{'AlbumID':'3',
+                                        'AlbumName':album_name})
+  if select_results and select_results[0]['AlbumName'] == album_name:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test UpsertMany and SelectKeys:"
+  sql.UpsertMany("Albums",[{'iPhotoLibraryID':1,'AlbumID':3,'AlbumName':'a'},
+                           {'iPhotoLibraryID':1,'AlbumID':4,'AlbumName':'b'}],
+                 ['iPhotoLibraryID','AlbumID'])
+  if (sql.SelectKeys("Albums",{'iPhotoLibraryID':1},['AlbumID'],'AlbumName')
+      == {'3':'a','4':'b'}):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test rebuild:"
+  sql.BeginRebuild()
+  sql.BulkInsert("Albums",[{'iPhotoLibraryID':1,'AlbumID':5}])
+  sql.FinishRebuild()
+  if sql.SelectKeys("Albums",{'iPhotoLibraryID':1},['AlbumID']) == set(['5']):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test Delete:"
+  sql.Delete("Albums",{'AlbumID':'5'})
+  sql.DeleteMany("Albums",[{'AlbumID':'2'}])
+  if not sql.Select("Albums",{'iPhotoLibraryID':1}):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  sql.Close()
+  for file_name in os.listdir(test_directory):
+    os.remove(os.path.join(test_directory, file_name))
+  os.rmdir(test_directory)
+  print "\n\nTesting completeled successfully!\n\n"
@@ -10,6 +10,20 @@ Processes a given AlbumData.xml file from iPhoto and stores it in the
 instantiated AlbumData class.  Data is stored as easy to use dict's, and can be
 retrieved from this class.
 
+The library is read with an event driven (iterparse) parser, so the whole plist
+is never held in memory at once; images, albums and rolls are stored as they
+are read.  A lazy AlbumData can be iterated while it is still being read.
+
+Parsed libraries can be kept in a binary cache file.  The cache is only used
+when the size, modification time and MD5 digest of AlbumData.xml match the
+values recorded when it was written; otherwise the library is parsed again and
+the cache is rewritten.
+
+The Master Image List, which is most of a library, can also be parsed by a pool
+of worker processes.  The section is split into byte ranges on image boundaries
+and each range is parsed and normalized by a worker, while the rest of the
+library is parsed in this process.
+
 Testing:
   This module can be tested  by running this file from the command line, with an
   existing AlbumData.xml file in the same (current) directory.  This will catch
@@ -21,11 +35,27 @@ Debugging:
 
 Attributes:
   Class AlbumData: Processes and Holds a given AlbumData.xml file
+  _ParseImageRange(): Worker process entry point for a parallel image parse
 """
 __author__ = "Robert Pufky (github.com/r-pufky)"
 import os
+import re
 import sys
+import mmap
+import base64
+import cPickle
+import hashlib
+import datetime
 import plistlib
+import LibraryRecords
+try:
+  import xml.etree.cElementTree as ElementTree
+except ImportError:
+  import xml.etree.ElementTree as ElementTree
+try:
+  import multiprocessing
+except ImportError:
+  multiprocessing = None
 
 
 
@@ -36,7 +66,8 @@ class AlbumData(object):
   an easy to use dictionary format.  A more in-depth explanation of each 
   attribute is listed below the attributes section.  Please note that NOT ALL 
   dictionary entries are guaranteed to exist; you should check to make sure a 
-  key exists before using it.
+  key exists before using it.  Images, albums and rolls are stored as compact
+  LibraryRecords records, which are used exactly like the dictionaries below.
   
   Apple Terminology:
     Rolls: iPhoto's EVENTS.  These can be considered the album for most people.
@@ -45,10 +76,13 @@ class AlbumData(object):
 
   Attributes:
     properties: Dictionary iPhotoLibrary's properties
-    rolls: Dictionary of dictionaries of iPhotoLibrary's Roll information
-    albums: Dictionary of dictionaries of iPhotoLibrary's Album information
-    images: Dictionary iPhotoLibrary's image information
+    rolls: Dictionary of RollRecords of iPhotoLibrary's Roll information
+    albums: Dictionary of AlbumRecords of iPhotoLibrary's Album information
+    images: Dictionary of ImageRecords of iPhotoLibrary's image information
     GetUnixEpochTime(): Converts Apple Timer to standard UNIX time
+    IterImages(): Iterates over images, reading the library as needed
+    IterAlbums(): Iterates over albums, reading the library as needed
+    IterRolls(): Iterates over rolls, reading the library as needed
 
   Properties dictionary:
     MinorVersion: Integer AlbumData minor version
@@ -194,12 +228,20 @@ class AlbumData(object):
   __author__ = "Robert Pufky (github.com/r-pufky)"
   __version__ = "1.1"
   
-  def __init__(self, iphoto_library=None):
+  def __init__(self, iphoto_library=None, lazy=False, cache_file=None,
+               refresh_cache=False, processes=1):
     """ Initalizes AlbumData with a given iPhoto AlbumData.xml file.
     
     Args:
       iphoto_library: String path to an iPhoto AlbumData.xml file, defaults to 
           current users default iPhoto library
+      lazy: Boolean True to defer reading the library until it is iterated
+          with IterImages(), IterAlbums() or IterRolls(); False to read the
+          whole library now
+      cache_file: String path to the parsed library cache; None disables
+      refresh_cache: Boolean True to ignore an existing cache and rebuild it
+      processes: Integer number of processes used to parse the Master Image
+          List; 1 parses the whole library in this process
       
     Raises:
       SyntaxError: Invalid arguments specified
@@ -209,7 +251,29 @@ class AlbumData(object):
     self.__WARNING_INFO = "WARNING:[AlbumData."
     self.__TESTED_VERSION = {'major': ['7', '1', '5'], 'minor': '378'}
     self.__UNIX_EPOCH_ADJUSTMENT = 978307200
-    self.__library = None
+    self.__PROPERTY_KEYS = {'Minor Version':'MinorVersion',
+                            'Major Version':'MajorVersion',
+                            'List of Keywords':'Keywords',
+                            'Archive Path':'Path',
+                            'Application Version':'iPhotoVersion',
+                            'ArchiveId':'ArchiveID'}
+    self.__STREAMED_SECTIONS = {'Master Image List':'images',
+                                'List of Albums':'albums',
+                                'List of Rolls':'rolls'}
+    self.__CACHE_FORMAT = 2
+    self.__RECORD_TYPES = {'images':LibraryRecords.ImageRecord,
+                           'albums':LibraryRecords.AlbumRecord,
+                           'rolls':LibraryRecords.RollRecord}
+    self.__CACHE_BUFFER = 1048576
+    self.__lazy = lazy
+    self.__stream = None
+    self.__cache_file = None
+    if cache_file:
+      self.__cache_file = os.path.expanduser(cache_file)
+    self.__refresh_cache = refresh_cache
+    self.__IMAGE_LIST_KEY = "<key>Master Image List</key>"
+    self.__CHUNKS_PER_PROCESS = 4
+    self.__processes = processes
     self._library_version = {}
     self.rolls = None
     self.albums = None
@@ -288,10 +352,576 @@ class AlbumData(object):
            'test': self.__TESTED_VERSION})
       return False
 
+  def __PlistValue(self, element=None):
+    """ Converts a parsed plist element into the matching python value.
+
+    Args:
+      element: ElementTree element for a plist value (dict, array, string...)
+
+    Raises:
+      EnvironmentError: Unknown plist value type
+
+    Returns:
+      The python value for the element, converted the same way as plistlib
+    """
+    if element.tag == "dict":
+      value = {}
+      key = None
+      for child in element:
+        if child.tag == "key":
+          key = child.text or ''
+        else:
+          value[key] = self.__PlistValue(child)
+      return value
+    elif element.tag == "array":
+      return [self.__PlistValue(child) for child in element]
+    elif element.tag == "string":
+      return element.text or ''
+    elif element.tag == "integer":
+      return int(element.text)
+    elif element.tag == "real":
+      return float(element.text)
+    elif element.tag == "true":
+      return True
+    elif element.tag == "false":
+      return False
+    elif element.tag == "date":
+      return datetime.datetime.strptime(element.text, "%Y-%m-%dT%H:%M:%SZ")
+    elif element.tag == "data":
+      return plistlib.Data(base64.decodestring(element.text or ''))
+    raise EnvironmentError("%(debug)s__PlistValue] Unknown plist type: %(tag)s" %
+                           {'debug':self.__DEBUG_INFO,'tag':element.tag})
+
+  def __NormalizeRoll(self, roll=None):
+    """ Cleans a roll read from the library into the Rolls dictionary format.
+
+    Args:
+      roll: Dictionary roll as stored in the 'List of Rolls' section
+
+    Returns:
+      A tuple (RollID, roll dictionary)
+    """
+    if 'RollDateAsTimerInterval' in roll:
+      roll['RollDate'] = self.GetUnixEpochTime(roll['RollDateAsTimerInterval'])
+      roll['RollDateAsAppleTimer'] = roll['RollDateAsTimerInterval']
+      del roll['RollDateAsTimerInterval']
+    if 'KeyPhotoKey' in roll:
+      roll['KeyPhoto'] = roll['KeyPhotoKey']
+      del roll['KeyPhotoKey']
+    return roll['RollID'], roll
+
+  def __NormalizeAlbum(self, album=None):
+    """ Cleans an album read from the library into the Albums dictionary format.
+
+    Args:
+      album: Dictionary album as stored in the 'List of Albums' section
+
+    Returns:
+      A tuple (AlbumID, album dictionary)
+    """
+    album_key = album['AlbumId']
+    if "Filter Mode" in album:
+      album['FilterMode'] = album['Filter Mode']
+      del album['Filter Mode']
+    if "Album Type" in album:
+      album['AlbumType'] = album['Album Type']
+      del album['Album Type']
+    for boolean in ("Master", "PlayMusic", "RepeatSlideShow",
+                    "SlideShowUseTitles", "PanAndZoom", "ShuffleSlides"):
+      if boolean in album:
+        album[boolean] = self.__ConvertBoolean(album[boolean])
+    album['AlbumID'] = album['AlbumId']
+    del album['AlbumId']
+    return album_key, album
+
+  def __NormalizeImage(self, image_key=None, image=None):
+    """ Cleans an image read from the library into the Images dictionary format.
+
+    Args:
+      image_key: String key of the image in the 'Master Image List' section
+      image: Dictionary image as stored in the 'Master Image List' section
+
+    Returns:
+      A tuple (ImageID, image dictionary)
+    """
+    if "DateAsTimerInterval" in image:
+      image['OriginalDate'] = self.GetUnixEpochTime(
+          image['DateAsTimerInterval'])
+      image['OriginalDateAsAppleTimer'] = image['DateAsTimerInterval']
+      del image['DateAsTimerInterval']
+    if "ModDateAsTimerInterval" in image:
+      image['ModifiedDate'] = self.GetUnixEpochTime(
+          image['ModDateAsTimerInterval'])
+      image['ModifiedDateAsAppleTimer'] = image['ModDateAsTimerInterval']
+      del image['ModDateAsTimerInterval']
+    if "MetaModDateAsTimerInterval" in image:
+      image['ImportDate'] = self.GetUnixEpochTime(
+          image['MetaModDateAsTimerInterval'])
+      image['ImportDateAsAppleTimer'] = image['MetaModDateAsTimerInterval']
+      del image['MetaModDateAsTimerInterval']
+    if "Roll" in image:
+      image['RollID'] = image['Roll']
+      del image['Roll']
+    if "Aspect Ratio" in image:
+      image['AspectRatio'] = image['Aspect Ratio']
+      del image['Aspect Ratio']
+    if "RotationIsOnlyEdit" in image:
+      image['RotationIsOnlyEdit'] = self.__ConvertBoolean(
+          image['RotationIsOnlyEdit'])
+    image['ImageID'] = int(image_key)
+    return image['ImageID'], image
+
+  def __SetProperty(self, library_key=None, value=None):
+    """ Stores a top level library value into the properties dictionary.
+
+    Top level values which are not properties of the library are ignored.
+
+    Args:
+      library_key: String key of the value in the library file
+      value: The converted value of the key
+
+    Raises:
+      EnvironmentError: Incompatible library version detected
+    """
+    if library_key not in self.__PROPERTY_KEYS:
+      return
+    if library_key == "Application Version":
+      if not self.CompareLibraryVersion(value):
+        raise EnvironmentError('Incompatable version detected.')
+    self.properties[self.__PROPERTY_KEYS[library_key]] = value
+
+  def __LibraryStamp(self, with_digest=True):
+    """ Identifies the current contents of the library file.
+
+    Args:
+      with_digest: Boolean True to include the MD5 digest of the library file
+
+    Returns:
+      A dictionary {'location','size','mtime','digest'}
+    """
+    status = os.stat(self.__library_location)
+    stamp = {'format':self.__CACHE_FORMAT,
+             'version':self.__version__,
+             'location':os.path.abspath(self.__library_location),
+             'size':status.st_size,
+             'mtime':status.st_mtime,
+             'digest':None}
+    if with_digest:
+      digest = hashlib.md5()
+      library = open(self.__library_location, 'rb')
+      try:
+        chunk = library.read(self.__CACHE_BUFFER)
+        while chunk:
+          digest.update(chunk)
+          chunk = library.read(self.__CACHE_BUFFER)
+      finally:
+        library.close()
+      stamp['digest'] = digest.hexdigest()
+    return stamp
+
+  def __OpenCache(self):
+    """ Opens the library cache, if it is valid for the current library file.
+
+    The cheap size and modification time checks are done before the library
+    file is read to verify its digest.
+
+    Returns:
+      An open cache file positioned after its header; None if there is no
+      usable cache
+    """
+    if not self.__cache_file or self.__refresh_cache:
+      return None
+    try:
+      cache = open(self.__cache_file, 'rb')
+    except EnvironmentError:
+      return None
+    try:
+      header = cPickle.load(cache)
+      stamp = self.__LibraryStamp(with_digest=False)
+      for check in ('format', 'version', 'location', 'size', 'mtime'):
+        if header.get(check) != stamp[check]:
+          raise ValueError("%s changed" % check)
+      if header.get('digest') != self.__LibraryStamp()['digest']:
+        raise ValueError("digest changed")
+    except Exception, e:
+      if __debug__:
+        print ("%(debug)s__OpenCache] Cache not used: %(error)s" % 
+               {'debug':self.__DEBUG_INFO,'error':e})
+      cache.close()
+      return None
+    return cache
+
+  def __StreamCache(self, cache=None):
+    """ Streams a cached library, storing entries as they are read.
+
+    Args:
+      cache: Open cache file, as returned by __OpenCache()
+
+    Raises:
+      EnvironmentError: Cache file is corrupt
+
+    Yields:
+      A tuple (section, key, value), the same as __StreamLibrary()
+    """
+    try:
+      try:
+        section, key, value = cPickle.load(cache)
+        while section != "properties":
+          getattr(self, section)[key] = value
+          yield section, key, value
+          section, key, value = cPickle.load(cache)
+        self.properties.update(value)
+      except (cPickle.UnpicklingError, EOFError, ValueError, TypeError), e:
+        raise EnvironmentError("%(debug)sLoad] Library cache is corrupt, "
+                               "refresh it!\n%(debug)sLoad] %(error)s" %
+                               {'debug':self.__DEBUG_INFO,'error':e})
+    finally:
+      cache.close()
+    if not self.CompareLibraryVersion(self.properties['iPhotoVersion']):
+      raise EnvironmentError('Incompatable version detected.')
+    if __debug__:
+      print "%sLoad] Loaded library from cache." % self.__DEBUG_INFO
+
+  def __CreateCache(self):
+    """ Starts writing a new library cache next to the final cache file.
+
+    Returns:
+      A tuple (file, pickler) for the temporary cache file; (None, None) if
+      caching is disabled or the cache cannot be written
+    """
+    if not self.__cache_file:
+      return None, None
+    try:
+      cache_directory = os.path.dirname(self.__cache_file)
+      if cache_directory and not os.path.exists(cache_directory):
+        os.makedirs(cache_directory, 0700)
+      cache = open(self.__cache_file + ".tmp", 'wb')
+      pickler = cPickle.Pickler(cache, cPickle.HIGHEST_PROTOCOL)
+      pickler.dump(self.__LibraryStamp())
+    except EnvironmentError, e:
+      print ("%(warn)s__CreateCache] Cannot write library cache: %(error)s" %
+             {'warn':self.__WARNING_INFO,'error':e})
+      return None, None
+    return cache, pickler
+
+  def __StreamLibrary(self):
+    """ Streams the library file, writing the library cache along the way.
+
+    Entries are written to the cache as they are parsed, before any caller can
+    change them.  The cache only replaces the previous one once the whole
+    library has been read.
+
+    Raises:
+      EnvironmentError: Library could not be read, or incompatible version
+
+    Yields:
+      A tuple (section, key, value), see __ParseLibrary()
+    """
+    cache, pickler = self.__CreateCache()
+    if self.__processes > 1 and multiprocessing:
+      entries = self.__ParseLibraryParallel()
+    else:
+      entries = self.__ParseLibrary()
+    try:
+      for entry in entries:
+        if cache:
+          pickler.dump(entry)
+          # entries are never referenced again by the cache; keep it flat
+          pickler.clear_memo()
+        yield entry
+      if cache:
+        pickler.dump(("properties", None, self.properties))
+        cache.close()
+        os.rename(self.__cache_file + ".tmp", self.__cache_file)
+        cache = None
+        if __debug__:
+          print "%sLoad] Wrote library cache." % self.__DEBUG_INFO
+    finally:
+      if cache:
+        cache.close()
+        os.remove(self.__cache_file + ".tmp")
+
+  def __LocateImageList(self):
+    """ Finds the Master Image List section and splits it on image boundaries.
+
+    The section is scanned for <dict>/<array> tags only, tracking nesting so
+    that ranges always end right after the closing tag of an image.
+
+    Returns:
+      A tuple (start, end, ranges): the byte offsets of the section's <dict>
+      and of the end of its </dict>, and a list of (start, end) byte ranges
+      covering the images in order; None if the section cannot be found
+    """
+    library = open(self.__library_location, 'rb')
+    try:
+      if not os.fstat(library.fileno()).st_size:
+        return None
+      library_map = mmap.mmap(library.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      library.close()
+    try:
+      key_position = library_map.find(self.__IMAGE_LIST_KEY)
+      if key_position < 0:
+        return None
+      tags = re.compile(r"<(/?)(dict|array)(/?)>")
+      opening = tags.search(library_map,
+                            key_position + len(self.__IMAGE_LIST_KEY))
+      if not opening or opening.group(1) or opening.group(2) != "dict":
+        return None
+      if opening.group(3):
+        return opening.start(), opening.end(), []
+      chunk_size = ((library_map.size() - opening.end()) // 
+                    (self.__processes * self.__CHUNKS_PER_PROCESS)) + 1
+      ranges = []
+      range_start = opening.end()
+      depth = 1
+      for tag in tags.finditer(library_map, opening.end()):
+        if tag.group(3):
+          continue
+        if not tag.group(1):
+          depth += 1
+          continue
+        depth -= 1
+        if not depth:
+          if tag.start() > range_start:
+            ranges.append((range_start, tag.start()))
+          return opening.start(), tag.end(), ranges
+        if depth == 1 and tag.end() - range_start >= chunk_size:
+          ranges.append((range_start, tag.end()))
+          range_start = tag.end()
+      return None
+    finally:
+      library_map.close()
+
+  def _ParseImageRange(self, start=None, end=None):
+    """ Parses and normalizes the images in a byte range of the library.
+
+    Used by worker processes; the range must hold complete <key>/<dict> image
+    pairs, as returned by __LocateImageList().
+
+    Args:
+      start: Integer byte offset of the first image key
+      end: Integer byte offset just after the last image dict
+
+    Returns:
+      A list of (ImageID, ImageRecord) tuples, in library order
+    """
+    library = open(self.__library_location, 'rb')
+    try:
+      library.seek(start)
+      images = ElementTree.XML("<dict>%s</dict>" % library.read(end - start))
+    finally:
+      library.close()
+    results = []
+    image_key = None
+    for element in images:
+      if element.tag == "key":
+        image_key = element.text
+      else:
+        image_key, image = self.__NormalizeImage(image_key,
+                                                 self.__PlistValue(element))
+        results.append((image_key, LibraryRecords.ImageRecord(image)))
+    return results
+
+  def __ParseLibraryParallel(self):
+    """ Parses the library, handing the Master Image List to worker processes.
+
+    The workers parse the image ranges while the rest of the library is parsed
+    here.  Their results are then stored in range order, so images are always
+    added in library order.
+
+    Raises:
+      EnvironmentError: Library could not be read, or incompatible version
+
+    Yields:
+      A tuple (section, key, value), see __ParseLibrary()
+    """
+    layout = self.__LocateImageList()
+    if not layout or len(layout[2]) < 2:
+      if __debug__:
+        print ("%sLoad] Master Image List not split, parsing serially." %
+               self.__DEBUG_INFO)
+      for entry in self.__ParseLibrary():
+        yield entry
+      return
+    section_start, section_end, ranges = layout
+    if __debug__:
+      print ("%(debug)sLoad] Parsing %(ranges)s image ranges with %(processes)s"
+             " processes." % {'debug':self.__DEBUG_INFO,
+                              'ranges':len(ranges),
+                              'processes':self.__processes})
+    pool = multiprocessing.Pool(self.__processes)
+    try:
+      results = pool.map_async(
+          _ParseImageRange,
+          [(self.__library_location, start, end) for start, end in ranges])
+      pool.close()
+      library = _ExcludedRangeFile(self.__library_location, section_start,
+                                   section_end, "<dict/>")
+      try:
+        for entry in self.__ParseLibrary(library):
+          yield entry
+      finally:
+        library.close()
+      try:
+        results = results.get()
+      except Exception, e:
+        raise EnvironmentError("%(debug)sLoad] Could not load Library file!\n"
+                               "%(debug)sLoad] %(error)s" %
+                               {'debug':self.__DEBUG_INFO,'error':e})
+      for images in results:
+        for image_key, image in images:
+          self.images[image_key] = image
+          yield "images", image_key, image
+      pool.join()
+    finally:
+      pool.terminate()
+
+  def __ParseLibrary(self, source=None):
+    """ Parses the library file, storing entries as they are read.
+
+    The library is read with an event driven parser instead of loading the
+    whole plist; only the image, album or roll currently being read is held as
+    parsed XML.  Each entry is normalized and stored in images, albums or rolls
+    as a record before it is yielded.
+
+    Args:
+      source: File object to parse instead of the library file
+
+    Raises:
+      EnvironmentError: Library could not be read, or incompatible version
+
+    Yields:
+      A tuple (section, key, value) where section is 'images', 'albums' or
+      'rolls', key is the ImageID, AlbumID or RollID and value is the record
+    """
+    depth = 0
+    library_key = None
+    entry_key = None
+    section = None
+    container = None
+    try:
+      events = ElementTree.iterparse(source or self.__library_location,
+                                     events=("start", "end"))
+    except EnvironmentError, e:
+      raise EnvironmentError("%sLoad] Could not load Library file!" %
+                             self.__DEBUG_INFO)
+    while True:
+      try:
+        event, element = events.next()
+      except StopIteration:
+        break
+      except (SyntaxError, EnvironmentError), e:
+        raise EnvironmentError("%(debug)sLoad] Could not load Library file!\n"
+                               "%(debug)sLoad] %(error)s" %
+                               {'debug':self.__DEBUG_INFO,'error':e})
+      # depth 1 is <plist>, 2 the library <dict>, 3 its keys and values, and 4
+      # the individual images, albums and rolls of a streamed section
+      if event == "start":
+        depth += 1
+        if (depth == 3 and element.tag != "key" and 
+            library_key in self.__STREAMED_SECTIONS):
+          section = self.__STREAMED_SECTIONS[library_key]
+          container = element
+        continue
+      if depth == 3:
+        if element.tag == "key":
+          library_key = element.text
+        elif section:
+          if __debug__:
+            print ("%(debug)sLoad] Loaded %(section)s." %
+                   {'debug':self.__DEBUG_INFO,'section':section})
+          section = None
+          container = None
+        else:
+          self.__SetProperty(library_key, self.__PlistValue(element))
+        element.clear()
+      elif depth == 4 and section:
+        if element.tag == "key":
+          entry_key = element.text
+        else:
+          value = self.__PlistValue(element)
+          if section == "images":
+            key, value = self.__NormalizeImage(entry_key, value)
+          elif section == "albums":
+            key, value = self.__NormalizeAlbum(value)
+          else:
+            key, value = self.__NormalizeRoll(value)
+          value = self.__RECORD_TYPES[section](value)
+          getattr(self, section)[key] = value
+          # drop the parsed XML of every entry read so far in this section
+          container.clear()
+          yield section, key, value
+      depth -= 1
+    for library_key in self.__PROPERTY_KEYS:
+      if self.__PROPERTY_KEYS[library_key] not in self.properties:
+        raise EnvironmentError("%(debug)sLoad] Library file is missing "
+                               "'%(key)s'!" % 
+                               {'debug':self.__DEBUG_INFO,'key':library_key})
+    if __debug__:
+      print "%sLoad] Loaded album preferences." % self.__DEBUG_INFO
+
+  def __IterSection(self, section=None):
+    """ Iterates over a section, reading more of the library when needed.
+
+    Entries already read are returned first; the library stream is then
+    advanced until it is exhausted.  Entries of other sections read along the
+    way are stored, and returned by their own iterators.
+
+    Args:
+      section: String section to iterate ('images', 'albums' or 'rolls')
+
+    Raises:
+      EnvironmentError: Library could not be read, or incompatible version
+
+    Yields:
+      A tuple (key, value) for each entry of the section
+    """
+    store = getattr(self, section)
+    for key in store.keys():
+      yield key, store[key]
+    while self.__stream:
+      try:
+        entry_section, key, value = self.__stream.next()
+      except StopIteration:
+        self.__stream = None
+        break
+      if entry_section == section:
+        yield key, value
+
+  def IterImages(self):
+    """ Iterates over the images of the library as they are read.
+
+    With a lazy AlbumData this lets callers start working on images before the
+    whole library file has been read.  Properties are filled in as their keys
+    are read from the library.
+
+    Yields:
+      A tuple (ImageID, image dictionary)
+    """
+    return self.__IterSection("images")
+
+  def IterAlbums(self):
+    """ Iterates over the albums of the library as they are read.
+
+    Yields:
+      A tuple (AlbumID, album dictionary)
+    """
+    return self.__IterSection("albums")
+
+  def IterRolls(self):
+    """ Iterates over the rolls of the library as they are read.
+
+    Yields:
+      A tuple (RollID, roll dictionary)
+    """
+    return self.__IterSection("rolls")
+
   def Load(self, iphoto_library):
     """ Loads or reloads the object with the given album data file
     
-    Current data existing in the object will be destroyed.
+    Current data existing in the object will be destroyed.  A lazy AlbumData
+    only opens the library here; it is read by the Iter*() methods.
     
     Args:
       iphoto_library: String path to an iPhoto AlbumData.xml file, defaults to 
@@ -304,9 +934,7 @@ class AlbumData(object):
     if __debug__:
       print "%sLoad] Resetting internal variables" % self.__DEBUG_INFO
 
-    if self.__library:
-      del self.__library
-    self.__library = {}
+    self.__stream = None
     if self.rolls:
       del self.rolls
     self.rolls = {}
@@ -333,101 +961,74 @@ class AlbumData(object):
              "%(debug)sLoad] Loading %(location)s..." % {
              'debug':self.__DEBUG_INFO, 
              'location':self.__library_location})
-    try:
-      self.__library = plistlib.readPlist(self.__library_location)
-    except Exception, e:
-      raise EnvironmentError("%sLoad] Could not load Library file!" %
-                             self.__DEBUG_INFO)
-    if __debug__:
-      print "%sLoad] File loaded." % self.__DEBUG_INFO
-    if not self.CompareLibraryVersion(self.__library['Application Version']):
-      raise EnvironmentError('Incompatable version detected.')
-    self.properties['MinorVersion'] = self.__library['Minor Version']
-    self.properties['MajorVersion'] = self.__library['Major Version']
-    self.properties['Keywords'] = self.__library['List of Keywords']
-    self.properties['Path'] = self.__library['Archive Path']
-    self.properties['iPhotoVersion'] = self.__library['Application Version']
-    self.properties['ArchiveID'] = self.__library['ArchiveId']
-    if __debug__:
-      print "%sLoad] Loaded album preferences." % self.__DEBUG_INFO
-    for roll in self.__library['List of Rolls']:
-      self.rolls[roll['RollID']] = roll
-      if 'RollDateAsTimerInterval' in roll:
-        self.rolls[roll['RollID']]['RollDate'] = (
-            self.GetUnixEpochTime(roll['RollDateAsTimerInterval']))
-        self.rolls[roll['RollID']]['RollDateAsAppleTimer'] = (
-            roll['RollDateAsTimerInterval'])
-        del self.rolls[roll['RollID']]['RollDateAsTimerInterval']
-      if 'KeyPhotoKey' in roll:
-        self.rolls[roll['RollID']]['KeyPhoto'] = roll['KeyPhotoKey']
-        del self.rolls[roll['RollID']]['KeyPhotoKey']
-    if __debug__:
-      print "%sLoad] Loaded rolls." % self.__DEBUG_INFO
-    for album in self.__library['List of Albums']:
-      self.albums[album['AlbumId']] = album
-      if "Filter Mode" in album:
-        self.albums[album['AlbumId']]['FilterMode'] = album['Filter Mode']
-        del self.albums[album['AlbumId']]['Filter Mode']
-      if "Album Type" in album:
-        self.albums[album['AlbumId']]['AlbumType'] = album['Album Type']
-        del self.albums[album['AlbumId']]['Album Type']
-      if "Master" in album:
-        self.albums[album['AlbumId']]['Master'] = (
-            self.__ConvertBoolean(album['Master']))
-      if "PlayMusic" in album:
-        self.albums[album['AlbumId']]['PlayMusic'] = (
-            self.__ConvertBoolean(album['PlayMusic']))
-      if "RepeatSlideShow" in album:
-        self.albums[album['AlbumId']]['RepeatSlideShow'] = (
-            self.__ConvertBoolean(album['RepeatSlideShow']))
-      if "SlideShowUseTitles" in album:
-        self.albums[album['AlbumId']]['SlideShowUseTitles'] = (
-            self.__ConvertBoolean(album['SlideShowUseTitles']))
-      if "PanAndZoom" in album:
-        self.albums[album['AlbumId']]['PanAndZoom'] = (
-            self.__ConvertBoolean(album['PanAndZoom']))
-      if "ShuffleSlides" in album:
-        self.albums[album['AlbumId']]['ShuffleSlides'] = (
-            self.__ConvertBoolean(album['ShuffleSlides']))
-      if "AlbumId" in album:
-        self.albums[album['AlbumId']]['AlbumID'] = album['AlbumId']
-        del self.albums[album['AlbumId']]['AlbumId']
-    if __debug__:
-      print "%sLoad] Loaded albums." % self.__DEBUG_INFO
-    for image in self.__library['Master Image List']:
-      self.images[int(image)] = self.__library['Master Image List'][image]
-      if "DateAsTimerInterval" in self.images[int(image)]:
-        self.images[int(image)]['OriginalDate'] = self.GetUnixEpochTime(
-            self.images[int(image)]['DateAsTimerInterval'])
-        self.images[int(image)]['OriginalDateAsAppleTimer'] = (
-            self.images[int(image)]['DateAsTimerInterval'])
-        del self.images[int(image)]['DateAsTimerInterval']
-      if "ModDateAsTimerInterval" in self.images[int(image)]:
-        self.images[int(image)]['ModifiedDate'] = self.GetUnixEpochTime(
-            self.images[int(image)]['ModDateAsTimerInterval'])
-        self.images[int(image)]['ModifiedDateAsAppleTimer'] = (
-            self.images[int(image)]['ModDateAsTimerInterval'])
-        del self.images[int(image)]['ModDateAsTimerInterval']
-      if "MetaModDateAsTimerInterval" in self.images[int(image)]:
-        self.images[int(image)]['ImportDate'] = self.GetUnixEpochTime(
-            self.images[int(image)]['MetaModDateAsTimerInterval'])
-        self.images[int(image)]['ImportDateAsAppleTimer'] = (
-            self.images[int(image)]['MetaModDateAsTimerInterval'])
-        del self.images[int(image)]['MetaModDateAsTimerInterval']
-      if "Roll" in self.images[int(image)]:
-        self.images[int(image)]['RollID'] = self.images[int(image)]['Roll']
-        del self.images[int(image)]['Roll']
-      if "Aspect Ratio" in self.images[int(image)]:
-        self.images[int(image)]['AspectRatio'] = (
-            self.images[int(image)]['Aspect Ratio'])
-        del self.images[int(image)]['Aspect Ratio']
-      if "RotationIsOnlyEdit" in self.images[int(image)]:
-        self.images[int(image)]['RotationIsOnlyEdit'] = self.__ConvertBoolean(
-            self.images[int(image)]['RotationIsOnlyEdit'])
-      self.images[int(image)]['ImageID'] = int(image)
-    if __debug__:
-      print "%sLoad] Loaded images." % self.__DEBUG_INFO
-    del self.__library
+    cache = self.__OpenCache()
+    if cache:
+      if __debug__:
+        print "%sLoad] Using library cache %s" % (self.__DEBUG_INFO, 
+                                                 self.__cache_file)
+      self.__stream = self.__StreamCache(cache)
+    else:
+      self.__stream = self.__StreamLibrary()
+    if not self.__lazy:
+      for entry in self.__stream:
+        pass
+      self.__stream = None
+      if __debug__:
+        print "%sLoad] File loaded." % self.__DEBUG_INFO
+
+
+
+class _ExcludedRangeFile(object):
+  """ Read-only file which replaces a byte range of a file with other data.
+
+  Lets the library be parsed without the Master Image List, which is parsed by
+  worker processes instead.
+  """
+
+  def __init__(self, location=None, start=None, end=None, replacement=""):
+    """ Opens the file.
+
+    Args:
+      location: String path of the file to read
+      start: Integer byte offset of the range to replace
+      end: Integer byte offset of the end of the range to replace
+      replacement: String data to read instead of the range
+    """
+    self.__file = open(location, 'rb')
+    self.__start = start
+    self.__end = end
+    self.__replacement = replacement
+
+  def read(self, size=-1):
+    """ Reads up to size bytes; the whole remaining file if size < 0. """
+    position = self.__file.tell()
+    if position < self.__start:
+      if size < 0 or position + size > self.__start:
+        size = self.__start - position
+      return self.__file.read(size)
+    if position == self.__start:
+      self.__file.seek(self.__end)
+      return self.__replacement
+    return self.__file.read(size)
+
+  def close(self):
+    """ Closes the file. """
+    self.__file.close()
+
+
+
+def _ParseImageRange(arguments=None):
+  """ Parses a byte range of the Master Image List in a worker process.
+
+  Args:
+    arguments: Tuple (library location, start offset, end offset)
+
+  Returns:
+    A list of (ImageID, ImageRecord) tuples, see AlbumData._ParseImageRange()
+  """
+  location, start, end = arguments
+  return AlbumData(iphoto_library=location, lazy=True)._ParseImageRange(start,
+                                                                       end)
 
 
 
@@ -448,6 +1049,23 @@ if __name__ == '__main__':
   print "-->Test Properties retrieval:"
   print "Properties: %s" % album_test.properties
   print "-->PASS!\n"
+  print "-->Test lazy AlbumData streaming:"
+  lazy_test = AlbumData(iphoto_library="AlbumData.xml", lazy=True)
+  streamed_images = 0
+  for image_key, image in lazy_test.IterImages():
+    streamed_images += 1
+  if (streamed_images == len(album_test.images) and 
+      len(list(lazy_test.IterAlbums())) == len(album_test.albums) and
+      len(list(lazy_test.IterRolls())) == len(album_test.rolls)):
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
+  print "-->Test parallel Master Image List parsing:"
+  parallel_test = AlbumData(iphoto_library="AlbumData.xml", processes=4)
+  if parallel_test.images == album_test.images:
+    print "-->PASS!\n"
+  else:
+    print "-->FAIL!\n"
   print "-->Test AlbumData version/author retrieval:"
   print "AlbumData Version: %s" % album_test.__version__
   print "AlbumData Author: %s" % album_test.__author__